@@ -0,0 +1,123 @@
+"""
+Shared Gallery Memory Benchmark
+Total memory of the embedding gallery as the number of worker processes grows
+
+Compares a private EmbeddingGallery per worker with one SharedGallery
+snapshot mapped by all of them. Memory is PSS (proportional set size) from
+/proc/<pid>/smaps_rollup, which splits shared pages between the processes
+mapping them, so the sum over workers is the real footprint. Linux only.
+
+Usage:
+  python benchmarks/gallery_memory.py --students 100000 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+
+from utils.gallery import EmbeddingGallery, SharedGallery, EMBEDDING_DIM
+
+
+def memory_kb(pid="self"):
+    """PSS and RSS in KB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Pss", "Rss"):
+                values[key] = int(rest.split()[0])
+    return values.get("Pss", 0), values.get("Rss", 0)
+
+
+def entries(students):
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((students, EMBEDDING_DIM)).astype(np.float32)
+    return [{"student_id": f"STUD{i:07d}", "profile_id": None, "embedding": matrix[i]} for i in range(students)]
+
+
+def worker(mode, directory, students, ready, done, queries):
+    if mode == "shared":
+        gallery = SharedGallery(directory, reuse_seconds=3600)
+        gallery.load(client=None)
+    else:
+        gallery = EmbeddingGallery()
+        gallery.add(entries(students))
+    # Touch every page, as matching does
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(queries):
+        gallery.search(rng.standard_normal(EMBEDDING_DIM), match_threshold=-1.0)
+    ready.release()
+    done.wait()
+
+
+def measure(mode, directory, students, workers, queries):
+    ready = multiprocessing.Semaphore(0)
+    done = multiprocessing.Event()
+    procs = [
+        multiprocessing.Process(target=worker, args=(mode, directory, students, ready, done, queries))
+        for _ in range(workers)
+    ]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+    ready_seconds = time.perf_counter() - start
+    usage = [memory_kb(p.pid) for p in procs]
+    done.set()
+    for p in procs:
+        p.join()
+    return {
+        "mode": mode,
+        "workers": workers,
+        "total_pss_mb": round(sum(pss for pss, _ in usage) / 1024, 1),
+        "total_rss_mb": round(sum(rss for _, rss in usage) / 1024, 1),
+        "ready_seconds": round(ready_seconds, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gallery memory per worker count, private vs shared')
+    parser.add_argument('--students', type=int, default=100000, help='Gallery size (default: 100000)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to test')
+    parser.add_argument('--queries', type=int, default=5, help='Searches per worker before measuring')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("❌ Needs Linux /proc/<pid>/smaps_rollup")
+        sys.exit(1)
+
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    directory = tempfile.mkdtemp(prefix="attendify_gallery_", dir=base)
+    print(f"Building shared snapshot of {args.students:,} students in {directory}")
+    SharedGallery(directory).add(entries(args.students))
+
+    baseline_pss, _ = memory_kb()
+    results = []
+    print(f"\n{'mode':<8} {'workers':>7} {'total PSS MB':>13} {'total RSS MB':>13} {'ready s':>8}")
+    for mode in ("private", "shared"):
+        for workers in args.workers:
+            r = measure(mode, directory, args.students, workers, args.queries)
+            results.append(r)
+            print(f"{mode:<8} {workers:>7} {r['total_pss_mb']:>13.1f} {r['total_rss_mb']:>13.1f} {r['ready_seconds']:>8.2f}")
+
+    print(f"\nMatrix size: {args.students * EMBEDDING_DIM * 4 / 1e6:.0f} MB; parent PSS {baseline_pss / 1024:.0f} MB")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"students": args.students, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Inference Backend Comparison
+Latency, throughput and memory of DeepFace/TensorFlow vs the exported ONNX
+models on ONNX Runtime and OpenCV DNN (ATTENDIFY_INFERENCE_BACKEND)
+
+Each backend runs in its own interpreter so import time and RSS are not
+shared. Per backend it reports:
+  import      seconds to import utils.face_engine
+  load        seconds and RSS to load the detector and embedding model
+  embed       batch-1 forward pass on a pre-cropped face
+  pipeline    get_embedding end to end (needs --images with real faces)
+
+Usage:
+  python benchmarks/inference_backends.py --images ../dataset --threads 1 2 4 --output backends.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent
+BACKENDS = ("deepface", "onnxruntime", "opencv")
+
+
+def rss_mb():
+    """Current and peak resident memory of this process in MB"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        current = peak
+    return round(current, 1), round(peak, 1)
+
+
+def percentiles(latencies, elapsed):
+    import numpy as np
+    return {
+        "iterations": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "ops_per_second": round(len(latencies) / elapsed, 2) if elapsed else None
+    }
+
+
+def timed_loop(fn, inputs, iterations, warmup):
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return percentiles(latencies, time.perf_counter() - start)
+
+
+def worker(args):
+    """Runs inside the child interpreter; prints one JSON result line"""
+    sys.path.append(str(BACKEND_DIR))
+    result = {"backend": args.worker, "threads": args.worker_threads}
+
+    start = time.perf_counter()
+    import cv2
+    import numpy as np
+    from utils.face_engine import get_face_engine
+    from utils.model_registry import model_registry
+    result["import_seconds"] = round(time.perf_counter() - start, 3)
+
+    engine = get_face_engine()
+    start = time.perf_counter()
+    stats = engine.preload_models()
+    result["load_seconds"] = round(time.perf_counter() - start, 3)
+    errors = [info["error"] for info in stats.values() if "error" in info]
+    if errors:
+        result["error"] = "; ".join(errors)
+        print(json.dumps(result))
+        return
+    result["rss_after_load_mb"], _ = rss_mb()
+
+    # Batch-1 forward passes on fixed crops, independent of detection
+    rng = np.random.default_rng(0)
+    crops = [{"face": rng.random((160, 160, 3), dtype=np.float32)} for _ in range(8)]
+    model = model_registry.get_embedding_model(engine.embedding_model_id)
+    result["embed"] = timed_loop(lambda face: engine._forward_batch(model, [face]), crops, args.iterations, args.warmup)
+
+    images = []
+    if args.images:
+        for path in sorted(Path(args.images).rglob("*")):
+            if path.suffix.lower() in (".jpg", ".jpeg", ".png"):
+                img = cv2.imread(str(path))
+                if img is not None:
+                    images.append(img)
+            if len(images) >= 20:
+                break
+    images = [img for img in images if engine.get_embedding(img, use_cache=False)]
+    if images:
+        result["pipeline"] = timed_loop(lambda img: engine.get_embedding(img, use_cache=False), images, args.iterations, args.warmup)
+
+    result["rss_mb"], result["peak_rss_mb"] = rss_mb()
+    print(json.dumps(result))
+
+
+def run_backend(backend, threads, args):
+    env = dict(
+        os.environ,
+        ATTENDIFY_DATA_BACKEND="memory",
+        ATTENDIFY_INFERENCE_BACKEND=backend,
+        ATTENDIFY_EMBEDDING_CACHE=""
+    )
+    if threads:
+        # Same budget for every runtime: ONNX Runtime / OpenCV read ATTENDIFY_INFERENCE_THREADS,
+        # TensorFlow and the BLAS libraries read the rest
+        env.update(
+            ATTENDIFY_INFERENCE_THREADS=str(threads),
+            TF_NUM_INTRAOP_THREADS=str(threads),
+            TF_NUM_INTEROP_THREADS="1",
+            OMP_NUM_THREADS=str(threads)
+        )
+    cmd = [
+        sys.executable, __file__, "--worker", backend, "--worker-threads", str(threads),
+        "--iterations", str(args.iterations), "--warmup", str(args.warmup)
+    ]
+    if args.images:
+        cmd += ["--images", str(Path(args.images).resolve())]
+    proc = subprocess.run(cmd, cwd=str(BACKEND_DIR), env=env, capture_output=True, text=True)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line)
+    return {"backend": backend, "threads": threads, "error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference backends: latency, throughput and RSS')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS, help='Backends to compare')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='Thread counts to try (0 = runtime default)')
+    parser.add_argument('--images', type=str, help='Directory of real face photos for the end-to-end pipeline')
+    parser.add_argument('--iterations', type=int, default=100, help='Timed iterations per stage (default: 100)')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed warm-up iterations (default: 5)')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('--worker', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-threads', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    results = []
+    print(f"{'backend':<12} {'thr':>3} {'import s':>8} {'load s':>7} {'embed p50':>10} {'embed/s':>8} "
+          f"{'pipe p50':>9} {'pipe/s':>7} {'RSS MB':>7} {'peak MB':>8}")
+    for backend in args.backends:
+        for threads in args.threads:
+            r = run_backend(backend, threads, args)
+            results.append(r)
+            if "error" in r:
+                print(f"{backend:<12} {threads:>3} ❌ {r['error']}")
+                continue
+            pipe = r.get("pipeline", {})
+            print(f"{backend:<12} {threads:>3} {r['import_seconds']:>8.2f} {r['load_seconds']:>7.2f} "
+                  f"{r['embed']['p50_ms']:>8.2f}ms {r['embed']['ops_per_second']:>8.1f} "
+                  f"{pipe.get('p50_ms', float('nan')):>7.2f}ms {pipe.get('ops_per_second', float('nan')):>7.1f} "
+                  f"{r['rss_mb']:>7.0f} {r['peak_rss_mb']:>8.0f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "timestamp": datetime.now().isoformat(),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "results": results
+            }, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""
+HTTP Load Test
+Drives the FastAPI endpoints of a locally started server and finds its saturation point
+
+Starts `uvicorn main:app` in a subprocess on the in-memory data backend,
+seeded with an enrolled gallery and pending approvals, then runs one load
+level per concurrency value. Each level reports throughput, latency
+percentiles and a histogram, and error rate per endpoint. The saturation
+point is the first level where throughput stops growing (< --min-gain) or
+errors exceed --max-error-rate; the level before it is the capacity.
+
+Rejections the API is expected to give under load are counted as
+"rejected", not as errors: synthetic images fail the upload quality check
+(400; use --images with real face photos to exercise enrollment). Each
+seeded pending approval is approved once; when they run out, further
+approvals are not sent but counted as "exhausted" (raise --pending).
+
+Closed loop by default (each worker sends its next request when the last
+one returns). With --rate, arrivals are open loop (Poisson) and latency is
+measured from the scheduled send time, so queueing in the client counts.
+
+Usage:
+  python benchmarks/load_test.py --concurrency 1 2 4 8 16 32 --duration 20 --output load_v1.json
+  python benchmarks/load_test.py --mix match=1 --rate 50 --concurrency 64
+  python benchmarks/load_test.py --compare load_v1.json load_v2.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+ENDPOINTS = {
+    "match": "/api/v1/attendance/match-face",
+    "upload": "/api/v1/students/upload-biometrics",
+    "approve": "/api/v1/teacher/approve-biometrics"
+}
+
+# Expected rejections per endpoint, reported apart from errors
+EXPECTED_STATUSES = {
+    "upload": {400}  # No face / poor quality (always for synthetic images)
+}
+
+# Approvals a closed-loop client is assumed to manage per second at most, to size --pending
+APPROVALS_PER_CLIENT_SECOND = 20
+
+# Histogram bucket upper bounds (ms)
+HISTOGRAM_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        name, weight = item.split("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def synthetic_image(width, height, rng):
+    img = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    cx, cy, r = width // 2, height // 2, max(20, height // 6)
+    cv2.ellipse(img, (cx, cy), (int(r * 0.8), r), 0, 0, 360, (150, 180, 220), -1)
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.tobytes()).decode()
+
+
+def load_images(args, rng):
+    """Base64 images: real photos from --images, else synthetic ones per --image-sizes"""
+    if args.images:
+        paths = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        images = ["data:image/jpeg;base64," + base64.b64encode(p.read_bytes()).decode() for p in paths[:50]]
+        if images:
+            return images
+    images = []
+    for size in args.image_sizes:
+        w, h = (int(v) for v in size.lower().split("x"))
+        images.append(synthetic_image(w, h, rng))
+    return images
+
+
+def write_seed(path, students, pending, rng):
+    """Seed the memory backend: an approved gallery plus pending approvals to approve"""
+    profiles, active, pending_rows = [], [], []
+    for i in range(students + pending):
+        profile_id = str(uuid.uuid4())
+        student_id = f"LOAD{i:06d}"
+        embedding = rng.standard_normal(512).tolist()
+        profiles.append({"id": profile_id, "student_id": student_id, "full_name": f"Load Student {i}", "role": "student"})
+        if i < students:
+            active.append({"profile_id": profile_id, "student_id": student_id, "embedding": embedding})
+        else:
+            pending_rows.append({"id": str(uuid.uuid4()), "profile_id": profile_id, "student_id": student_id,
+                                 "full_name": f"Load Student {i}", "embedding": embedding, "status": "pending"})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"profiles": profiles, "active_embeddings": active, "pending_approvals": pending_rows}, f)
+    return [row["id"] for row in pending_rows]
+
+
+class Server:
+    def __init__(self, port, seed_path, workdir, preload_models):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ)
+        env.update({
+            "ATTENDIFY_DATA_BACKEND": "memory",
+            "ATTENDIFY_MEMORY_SEED": seed_path,
+            "ATTENDIFY_PRELOAD_MODELS": "1" if preload_models else "0",
+            "ATTENDANCE_QUEUE_PATH": os.path.join(workdir, "attendance_queue.sqlite3"),
+            "ENROLLMENT_QUEUE_PATH": os.path.join(workdir, "enrollment_queue.sqlite3"),
+            "ENROLLMENT_SPOOL_DIR": os.path.join(workdir, "spool")
+        })
+        self.log = open(os.path.join(workdir, "server.log"), "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=str(BACKEND_DIR), env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}; see {self.log.name}")
+            try:
+                if httpx.get(self.url + "/health", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"Server not ready after {timeout}s; see {self.log.name}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class LoadLevel:
+    def __init__(self, base_url, mix, images, pending_ids, timeout):
+        self.base_url = base_url
+        self.names = list(mix)
+        self.weights = [mix[n] for n in self.names]
+        self.images = images
+        self.pending_ids = pending_ids
+        self.timeout = timeout
+        self.samples = {name: [] for name in self.names}
+        self.errors = {name: {} for name in self.names}
+        self.rejected = {name: 0 for name in self.names}
+        self.exhausted = {name: 0 for name in self.names}
+
+    def _request(self, name):
+        if name == "match":
+            return {"image": random.choice(self.images)}
+        if name == "upload":
+            n = random.randrange(10**6)
+            return {"profile_id": str(uuid.uuid4()), "student_id": f"UP{n:06d}", "full_name": f"Upload {n}",
+                    "image": random.choice(self.images)}
+        # Each pending id can be approved once
+        if not self.pending_ids:
+            return None
+        return {"pending_id": self.pending_ids.pop()}
+
+    async def _send(self, client, name, scheduled):
+        payload = self._request(name)
+        if payload is None:
+            self.exhausted[name] += 1
+            return
+        try:
+            response = await client.post(ENDPOINTS[name], json=payload)
+            latency = (time.perf_counter() - scheduled) * 1000
+            if response.status_code in EXPECTED_STATUSES.get(name, ()):
+                self.rejected[name] += 1
+            elif response.status_code >= 400:
+                self.errors[name][str(response.status_code)] = self.errors[name].get(str(response.status_code), 0) + 1
+            else:
+                self.samples[name].append(latency)
+        except httpx.HTTPError as e:
+            key = type(e).__name__
+            self.errors[name][key] = self.errors[name].get(key, 0) + 1
+
+    async def run(self, concurrency, duration, rate=None):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.timeout) as client:
+            start = time.perf_counter()
+            end = start + duration
+
+            if rate:
+                # Open loop: Poisson arrivals, at most `concurrency` in flight
+                slots = asyncio.Semaphore(concurrency)
+                tasks = []
+
+                async def fire(name, scheduled):
+                    async with slots:
+                        await self._send(client, name, scheduled)
+
+                next_at = start
+                while next_at < end:
+                    await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                    name = random.choices(self.names, self.weights)[0]
+                    tasks.append(asyncio.create_task(fire(name, next_at)))
+                    next_at += random.expovariate(rate)
+                await asyncio.gather(*tasks)
+            else:
+                async def worker():
+                    while time.perf_counter() < end:
+                        name = random.choices(self.names, self.weights)[0]
+                        await self._send(client, name, time.perf_counter())
+
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+            return time.perf_counter() - start
+
+
+def summarize(samples, errors, elapsed, rejected=0, exhausted=0):
+    ok = len(samples)
+    failed = sum(errors.values())
+    total = ok + failed + rejected
+    histogram = {}
+    for bound in HISTOGRAM_BOUNDS:
+        histogram[f"<={bound}ms"] = 0
+    histogram[f">{HISTOGRAM_BOUNDS[-1]}ms"] = 0
+    for latency in samples:
+        bound = next((b for b in HISTOGRAM_BOUNDS if latency <= b), None)
+        histogram[f"<={bound}ms" if bound else f">{HISTOGRAM_BOUNDS[-1]}ms"] += 1
+
+    stats = {
+        "requests": total,
+        "ok": ok,
+        "rejected": rejected,
+        "exhausted": exhausted,
+        "errors": errors,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "histogram": histogram
+    }
+    if samples:
+        stats.update({
+            "p50_ms": round(float(np.percentile(samples, 50)), 2),
+            "p95_ms": round(float(np.percentile(samples, 95)), 2),
+            "p99_ms": round(float(np.percentile(samples, 99)), 2),
+            "max_ms": round(float(np.max(samples)), 2)
+        })
+    return stats
+
+
+def print_level(result):
+    overall = result["overall"]
+    print(f"\nconcurrency={result['concurrency']} rate={result['rate'] or 'closed-loop'} "
+          f"elapsed={result['elapsed_seconds']}s")
+    print(f"  {'endpoint':<10} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>8} {'rejected':>9}")
+    for name, s in list(result["endpoints"].items()) + [("overall", overall)]:
+        print(f"  {name:<10} {s['throughput_rps']:>8.1f} {s.get('p50_ms', 0):>9.1f} {s.get('p95_ms', 0):>9.1f} "
+              f"{s.get('p99_ms', 0):>9.1f} {s['error_rate']:>8.1%} {s['rejected']:>9}")
+    if overall["exhausted"]:
+        print(f"  ⚠️  {overall['exhausted']} approvals not sent: seeded pending ids ran out (raise --pending)")
+    peak = max(overall["histogram"].values()) or 1
+    for bucket, count in overall["histogram"].items():
+        if count:
+            print(f"  {bucket:>10} {'#' * max(1, int(40 * count / peak))} {count}")
+
+
+def find_saturation(levels, min_gain, max_error_rate):
+    """
+    Returns:
+        (capacity level, saturation level) dictionaries, either may be None
+    """
+    capacity = None
+    for level in levels:
+        overall = level["overall"]
+        if overall["error_rate"] > max_error_rate:
+            return capacity, level
+        if capacity and overall["throughput_rps"] < capacity["overall"]["throughput_rps"] * (1 + min_gain):
+            return capacity, level
+        capacity = level
+    return capacity, None
+
+
+def compare_runs(old_path, new_path):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    old_levels = {lvl["concurrency"]: lvl for lvl in old["levels"]}
+
+    print(f"\n{'='*70}")
+    print(f"LOAD TEST COMPARISON: {old.get('label') or old_path} -> {new.get('label') or new_path}")
+    print(f"{'='*70}")
+    print(f"{'concurrency':>11} {'rps old':>9} {'rps new':>9} {'p99 old':>9} {'p99 new':>9}")
+    for level in new["levels"]:
+        before = old_levels.get(level["concurrency"])
+        if not before:
+            continue
+        print(f"{level['concurrency']:>11} {before['overall']['throughput_rps']:>9.1f} {level['overall']['throughput_rps']:>9.1f} "
+              f"{before['overall'].get('p99_ms', 0):>9.1f} {level['overall'].get('p99_ms', 0):>9.1f}")
+    print(f"Capacity: {old.get('capacity_concurrency')} -> {new.get('capacity_concurrency')} concurrent clients")
+    print(f"{'='*70}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Attendify API on a local server with the memory backend')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32], help='Load levels (in-flight requests)')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per level (default: 15)')
+    parser.add_argument('--rate', type=float, help='Open-loop arrival rate (requests/s); default: closed loop')
+    parser.add_argument('--mix', nargs='+', default=["match=0.85", "upload=0.1", "approve=0.05"], help='Endpoint weights')
+    parser.add_argument('--image-sizes', nargs='+', default=["640x480", "1280x720", "1920x1080"], help='Synthetic image sizes WxH')
+    parser.add_argument('--images', type=str, help='Directory of real photos to send instead of synthetic images')
+    parser.add_argument('--students', type=int, default=1000, help='Enrolled students in the seeded gallery (default: 1000)')
+    parser.add_argument('--pending', type=int, help='Seeded pending approvals (default: enough for the run, at least 2000)')
+    parser.add_argument('--url', type=str, help='Use an already running server instead of starting one')
+    parser.add_argument('--preload-models', action='store_true', help='Let the server preload models before the run')
+    parser.add_argument('--startup-timeout', type=float, default=300, help='Seconds to wait for the server (default: 300)')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds (default: 30)')
+    parser.add_argument('--warmup', type=float, default=3, help='Unrecorded warm-up seconds (default: 3)')
+    parser.add_argument('--min-gain', type=float, default=0.05, help='Throughput gain below which a level is saturated')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Error rate above which a level is saturated')
+    parser.add_argument('--label', type=str, help='Release label stored with the results')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two saved result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_runs(*args.compare)
+        return
+
+    mix = parse_mix(args.mix)
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    images = load_images(args, rng)
+
+    if args.pending is None:
+        # Upper bound on approvals the run can send, so the seeded ids do not run out
+        approve_share = mix.get("approve", 0) / sum(mix.values())
+        if args.rate:
+            sendable = args.rate * args.duration * len(args.concurrency)
+        else:
+            sendable = APPROVALS_PER_CLIENT_SECOND * args.duration * sum(args.concurrency)
+        args.pending = max(2000, int(approve_share * sendable * 1.5))
+
+    workdir = tempfile.mkdtemp(prefix="attendify_load_")
+    seed_path = os.path.join(workdir, "seed.json")
+    pending_ids = write_seed(seed_path, args.students, args.pending, rng)
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server = Server(free_port(), seed_path, workdir, args.preload_models)
+        print(f"Starting server on {server.url} (memory backend, {args.students} students)...")
+        server.wait_ready(args.startup_timeout)
+        base_url = server.url
+
+    print(f"\n{'='*70}")
+    print(f"LOAD TEST: {base_url}")
+    print(f"Mix: {', '.join(f'{k}={v:g}' for k, v in mix.items())} | {len(images)} image(s) | {args.duration}s per level"
+          f" | {args.pending} pending approvals")
+    print(f"{'='*70}")
+
+    levels = []
+    try:
+        # Warm-up (first requests load models and JIT paths)
+        if args.warmup:
+            asyncio.run(LoadLevel(base_url, {"match": 1}, images, [], args.timeout).run(1, args.warmup))
+
+        for concurrency in args.concurrency:
+            level = LoadLevel(base_url, mix, images, pending_ids, args.timeout)
+            elapsed = asyncio.run(level.run(concurrency, args.duration, args.rate))
+            endpoints = {
+                name: summarize(level.samples[name], level.errors[name], elapsed,
+                                level.rejected[name], level.exhausted[name])
+                for name in level.names
+            }
+            all_samples = [s for name in level.names for s in level.samples[name]]
+            all_errors = {}
+            for name in level.names:
+                for key, count in level.errors[name].items():
+                    all_errors[key] = all_errors.get(key, 0) + count
+            result = {
+                "concurrency": concurrency,
+                "rate": args.rate,
+                "elapsed_seconds": round(elapsed, 2),
+                "endpoints": endpoints,
+                "overall": summarize(all_samples, all_errors, elapsed,
+                                     sum(level.rejected.values()), sum(level.exhausted.values()))
+            }
+            levels.append(result)
+            print_level(result)
+    finally:
+        if server:
+            server.stop()
+
+    capacity, saturated = find_saturation(levels, args.min_gain, args.max_error_rate)
+    print(f"\n{'='*70}")
+    if capacity:
+        print(f"Capacity: {capacity['concurrency']} concurrent clients, "
+              f"{capacity['overall']['throughput_rps']:.1f} req/s, p99 {capacity['overall'].get('p99_ms', 0):.0f} ms")
+    print(f"Saturation: {'concurrency ' + str(saturated['concurrency']) if saturated else 'not reached'}")
+    print(f"{'='*70}\n")
+
+    if args.output:
+        try:
+            commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(BACKEND_DIR),
+                                    capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            commit = None
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "label": args.label,
+                "commit": commit,
+                "created_at": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "mix": mix,
+                "duration": args.duration,
+                "students": args.students,
+                "capacity_concurrency": capacity["concurrency"] if capacity else None,
+                "saturation_concurrency": saturated["concurrency"] if saturated else None,
+                "levels": levels
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+match_students Plan Benchmark
+Query plan and latency of face matching at 1k, 10k and 100k enrolled students
+
+Runs against a scratch schema (attendify_bench) so real data is untouched.
+For each size it loads random unit vectors, builds the HNSW index from
+database_updates_v10_hnsw_match.sql, and compares:
+  - legacy:  WHERE similarity > threshold ORDER BY distance LIMIT k (v1 function body)
+  - indexed: ORDER BY distance LIMIT k, threshold applied afterward (v10)
+  - batch:   the match_students_batch body for several faces at once
+HNSW is approximate, so it also reports recall against an exact scan (index
+scans disabled): of the threshold matches, and of the k nearest neighbours
+at each --ef-search value.
+
+Usage:
+  DATABASE_URL=postgresql://... python benchmarks/match_students_plan.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEMA = "attendify_bench"
+
+LEGACY_QUERY = f"""
+    SELECT student_id, 1 - (embedding <=> %(q)s::vector(512)) AS similarity
+    FROM {SCHEMA}.active_embeddings
+    WHERE 1 - (embedding <=> %(q)s::vector(512)) > %(threshold)s
+    ORDER BY embedding <=> %(q)s::vector(512)
+    LIMIT %(k)s
+"""
+
+INDEXED_QUERY = f"""
+    SELECT nearest.student_id, nearest.similarity
+    FROM (
+        SELECT student_id, 1 - (embedding <=> %(q)s::vector(512)) AS similarity
+        FROM {SCHEMA}.active_embeddings
+        ORDER BY embedding <=> %(q)s::vector(512)
+        LIMIT %(k)s
+    ) nearest
+    WHERE nearest.similarity > %(threshold)s
+    ORDER BY nearest.similarity DESC
+"""
+
+BATCH_QUERY = f"""
+    SELECT (q.ord - 1)::INT, nearest.student_id, nearest.similarity
+    FROM jsonb_array_elements(%(qs)s::JSONB) WITH ORDINALITY AS q(embedding, ord)
+    CROSS JOIN LATERAL (
+        SELECT student_id, 1 - (embedding <=> q.embedding::TEXT::vector(512)) AS similarity
+        FROM {SCHEMA}.active_embeddings
+        ORDER BY embedding <=> q.embedding::TEXT::vector(512)
+        LIMIT %(k)s
+    ) nearest
+    WHERE nearest.similarity > %(threshold)s
+"""
+
+
+TOPK_QUERY = f"""
+    SELECT student_id
+    FROM {SCHEMA}.active_embeddings
+    ORDER BY embedding <=> %(q)s::vector(512)
+    LIMIT %(k)s
+"""
+
+
+def vector_literal(v) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in v) + "]"
+
+
+def random_unit(rng, n):
+    m = rng.standard_normal((n, 512)).astype(np.float32)
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+def load_rows(cur, vectors, offset):
+    args = [(f"STUD{offset + i:07d}", vector_literal(v)) for i, v in enumerate(vectors)]
+    execute_values(
+        cur,
+        f"INSERT INTO {SCHEMA}.active_embeddings (student_id, embedding) VALUES %s",
+        args,
+        template="(%s, %s::vector(512))",
+        page_size=500
+    )
+
+
+def explain(cur, query, params) -> str:
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " + query, params)
+    return "\n".join(row[0] for row in cur.fetchall())
+
+
+def time_query(cur, query, param_list):
+    latencies = []
+    for params in param_list:
+        start = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2)
+    }
+
+
+def recall(cur, query, param_list, ef_search: int = 40) -> float:
+    """
+    Fraction of the students an exact scan returns that the index also returns
+
+    Rows are compared by student_id (the first column), summed over all queries.
+    """
+    found = expected = 0
+    for params in param_list:
+        cur.execute("SET enable_indexscan = off")
+        cur.execute(query, params)
+        exact = {row[0] for row in cur.fetchall()}
+        cur.execute("SET enable_indexscan = on")
+        cur.execute("SET hnsw.ef_search = %s", (ef_search,))
+        cur.execute(query, params)
+        approx = {row[0] for row in cur.fetchall()}
+        found += len(exact & approx)
+        expected += len(exact)
+    cur.execute("RESET hnsw.ef_search")
+    return round(found / expected, 4) if expected else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare match_students query plans and latency by gallery size')
+    parser.add_argument('--dsn', type=str, default=os.getenv("DATABASE_URL"), help='Postgres DSN (default: $DATABASE_URL)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Gallery sizes to test')
+    parser.add_argument('--queries', type=int, default=50, help='Queries timed per variant (default: 50)')
+    parser.add_argument('--faces', type=int, default=8, help='Faces per batch query (default: 8)')
+    parser.add_argument('--threshold', type=float, default=0.4, help='match_threshold (default: 0.4)')
+    parser.add_argument('--recall-k', type=int, default=10, help='Neighbours compared for recall@k (default: 10)')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[40, 100], help='hnsw.ef_search values for recall@k (default: 40 100)')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch schema afterwards')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        print("❌ Provide --dsn or set DATABASE_URL")
+        sys.exit(1)
+
+    rng = np.random.default_rng(0)
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.active_embeddings (id BIGSERIAL PRIMARY KEY, student_id TEXT, embedding vector(512))")
+
+    results = []
+    loaded = 0
+    try:
+        for size in sorted(args.sizes):
+            print(f"\n{'='*70}")
+            print(f"GALLERY SIZE: {size:,}")
+            print(f"{'='*70}")
+
+            # Grow the table incrementally; the index is rebuilt for each size
+            cur.execute(f"DROP INDEX IF EXISTS {SCHEMA}.bench_hnsw")
+            start = time.perf_counter()
+            while loaded < size:
+                chunk = min(5000, size - loaded)
+                load_rows(cur, random_unit(rng, chunk), loaded)
+                loaded += chunk
+            load_seconds = time.perf_counter() - start
+
+            # Queries are noisy copies of enrolled students, like real probes
+            cur.execute(f"SELECT embedding::TEXT FROM {SCHEMA}.active_embeddings ORDER BY random() LIMIT %s",
+                        (args.queries * args.faces,))
+            enrolled = np.array([json.loads(row[0]) for row in cur.fetchall()], dtype=np.float32)
+            probes = enrolled + rng.standard_normal(enrolled.shape).astype(np.float32) * 0.02
+            probes /= np.linalg.norm(probes, axis=1, keepdims=True)
+            singles = [{"q": vector_literal(p), "threshold": args.threshold, "k": 1} for p in probes[:args.queries]]
+            batches = [
+                {"qs": json.dumps(probes[i * args.faces:(i + 1) * args.faces].tolist()), "threshold": args.threshold, "k": 1}
+                for i in range(args.queries)
+            ]
+
+            cur.execute(f"ANALYZE {SCHEMA}.active_embeddings")
+            legacy_seq = time_query(cur, LEGACY_QUERY, singles)
+            legacy_plan = explain(cur, LEGACY_QUERY, singles[0])
+
+            start = time.perf_counter()
+            cur.execute(f"CREATE INDEX bench_hnsw ON {SCHEMA}.active_embeddings "
+                        f"USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)")
+            index_seconds = time.perf_counter() - start
+            cur.execute(f"ANALYZE {SCHEMA}.active_embeddings")
+
+            legacy_indexed = time_query(cur, LEGACY_QUERY, singles)
+            indexed = time_query(cur, INDEXED_QUERY, singles)
+            indexed_plan = explain(cur, INDEXED_QUERY, singles[0])
+            batch = time_query(cur, BATCH_QUERY, batches)
+
+            # Recall of the approximate index against an exact scan
+            match_recall = recall(cur, INDEXED_QUERY, singles)
+            neighbours = [dict(params, k=args.recall_k) for params in singles]
+            recall_at_k = {ef: recall(cur, TOPK_QUERY, neighbours, ef) for ef in args.ef_search}
+
+            print(f"Load: {load_seconds:.1f}s | HNSW build: {index_seconds:.1f}s")
+            print(f"\nLegacy plan (with index present):\n{explain(cur, LEGACY_QUERY, singles[0])}")
+            print(f"\nIndexed plan:\n{indexed_plan}")
+            print(f"\n{'variant':<28} {'p50 ms':>9} {'p95 ms':>9}")
+            print(f"{'legacy, no index':<28} {legacy_seq['p50_ms']:>9.2f} {legacy_seq['p95_ms']:>9.2f}")
+            print(f"{'legacy, with index':<28} {legacy_indexed['p50_ms']:>9.2f} {legacy_indexed['p95_ms']:>9.2f}")
+            print(f"{'indexed (v10)':<28} {indexed['p50_ms']:>9.2f} {indexed['p95_ms']:>9.2f}")
+            print(f"{f'batch of {args.faces} (v10)':<28} {batch['p50_ms']:>9.2f} {batch['p95_ms']:>9.2f}")
+            print(f"\nRecall vs exact scan: threshold matches {match_recall:.2%}")
+            for ef, value in recall_at_k.items():
+                print(f"  recall@{args.recall_k}, ef_search={ef}: {value:.2%}")
+
+            results.append({
+                "size": size,
+                "load_seconds": round(load_seconds, 2),
+                "index_build_seconds": round(index_seconds, 2),
+                "legacy_no_index": legacy_seq,
+                "legacy_with_index": legacy_indexed,
+                "indexed": indexed,
+                "batch": {**batch, "faces": args.faces},
+                "match_recall": match_recall,
+                "recall_at_k": {"k": args.recall_k, "by_ef_search": recall_at_k},
+                "legacy_plan": legacy_plan,
+                "indexed_plan": indexed_plan
+            })
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"threshold": args.threshold, "results": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
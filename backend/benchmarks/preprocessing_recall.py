@@ -0,0 +1,122 @@
+"""
+Preprocessing Benchmark
+Detection latency vs. recall for different max_detect_side settings
+
+Faces found on the full-resolution image are the reference. For every
+setting, each image is decoded at reduced scale (utils/preprocessing.py),
+detected, and its boxes mapped back; a reference face counts as recalled
+if a mapped box overlaps it with IoU >= 0.5.
+
+Usage:
+  python benchmarks/preprocessing_recall.py --images dataset --sides 1920 1280 960 640
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.preprocessing import prepare_bytes, map_box
+from utils.model_registry import model_registry
+from deepface import DeepFace
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def iou(a, b) -> float:
+    x0, y0 = max(a['x'], b['x']), max(a['y'], b['y'])
+    x1 = min(a['x'] + a['w'], b['x'] + b['w'])
+    y1 = min(a['y'] + a['h'], b['y'] + b['h'])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a['w'] * a['h'] + b['w'] * b['h'] - inter
+    return inter / union if union else 0.0
+
+
+def detect(image, detector_backend):
+    faces = DeepFace.extract_faces(img_path=image, detector_backend=detector_backend, enforce_detection=False)
+    return [f["facial_area"] for f in faces if f.get("confidence", 1) > 0]
+
+
+def run_setting(images, max_side, detector_backend, reference):
+    decode_ms, detect_ms = [], []
+    recalled = total = 0
+    for path, data in images:
+        start = time.perf_counter()
+        prepared = prepare_bytes(data, max_side)
+        decoded = time.perf_counter()
+        boxes = detect(prepared.image, detector_backend)
+        done = time.perf_counter()
+
+        decode_ms.append((decoded - start) * 1000)
+        detect_ms.append((done - decoded) * 1000)
+
+        mapped = [map_box(b, prepared.scale, (prepared.original_size[1], prepared.original_size[0])) for b in boxes]
+        for ref in reference[path]:
+            total += 1
+            if any(iou(ref, m) >= 0.5 for m in mapped):
+                recalled += 1
+
+    total_ms = np.add(decode_ms, detect_ms)
+    return {
+        "max_side": max_side or "full",
+        "decode_ms_mean": round(float(np.mean(decode_ms)), 2),
+        "detect_ms_mean": round(float(np.mean(detect_ms)), 2),
+        "total_ms_p50": round(float(np.percentile(total_ms, 50)), 2),
+        "total_ms_p95": round(float(np.percentile(total_ms, 95)), 2),
+        "reference_faces": total,
+        "recall": round(recalled / total, 4) if total else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark detection latency vs. recall across max_detect_side values')
+    parser.add_argument('--images', type=str, required=True, help='Directory of images (searched recursively)')
+    parser.add_argument('--sides', type=int, nargs='+', default=[1920, 1280, 960, 640, 480], help='max_detect_side values to test')
+    parser.add_argument('--detector', type=str, default='mtcnn', help='Detector backend (default: mtcnn)')
+    parser.add_argument('--limit', type=int, default=200, help='Maximum number of images (default: 200)')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    paths = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)[:args.limit]
+    if not paths:
+        print(f"❌ No images found in {args.images}")
+        sys.exit(1)
+    images = [(str(p), p.read_bytes()) for p in paths]
+
+    model_registry.ensure_detector(args.detector)
+
+    print(f"\n{'='*70}")
+    print(f"PREPROCESSING BENCHMARK ({len(images)} images, detector: {args.detector})")
+    print(f"{'='*70}")
+
+    # Full-resolution detections are the reference for recall
+    reference = {}
+    for path, data in images:
+        full = prepare_bytes(data, None)
+        reference[path] = detect(full.image, args.detector) if full is not None else []
+
+    results = [run_setting(images, None, args.detector, reference)]
+    for side in args.sides:
+        results.append(run_setting(images, side, args.detector, reference))
+
+    print(f"{'max_side':>9} {'decode ms':>10} {'detect ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'recall':>8}")
+    for r in results:
+        recall = f"{r['recall']:.1%}" if r['recall'] is not None else "n/a"
+        print(f"{str(r['max_side']):>9} {r['decode_ms_mean']:>10.1f} {r['detect_ms_mean']:>10.1f} "
+              f"{r['total_ms_p50']:>9.1f} {r['total_ms_p95']:>9.1f} {recall:>8}")
+    print(f"{'='*70}\n")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"detector": args.detector, "images": len(images), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Stage Micro-Benchmarks
+Per-stage latency and throughput of face_engine and attendance_marker
+
+Runs against the in-memory data backend (ATTENDIFY_DATA_BACKEND=memory), so
+no database is needed. Stages:
+  decode       base64 JPEG -> detection-sized array (_decode_image), per image size
+  detect       DeepFace.extract_faces on the decoded image, per image size
+  embed        Embedding forward pass (_forward_batch) on the face extracted from
+               each image, per image size
+  match        EmbeddingGallery.search, per gallery size
+  should_mark  AttendanceMarker.should_mark_attendance, per attendance history size
+  startup      Import time of backend modules and CLI start-up, each in a fresh interpreter
+
+detect and embed need DeepFace and are skipped without it. Faces are
+synthetic unless --images points at a directory of real face photos; embed
+extracts with enforce_detection=False, so a synthetic image that no
+detector accepts is still embedded (as a whole-image crop) rather than
+timing the "no face" failure path.
+
+Usage:
+  python benchmarks/stage_bench.py --output results.json
+  python benchmarks/stage_bench.py --baseline baseline.json   # exit 1 on regression
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Stand-in data backend and a scratch queue, before the backend modules load
+os.environ["ATTENDIFY_DATA_BACKEND"] = "memory"
+os.environ.setdefault("ATTENDANCE_QUEUE_PATH", os.path.join(tempfile.mkdtemp(prefix="attendify_bench_"), "queue.sqlite3"))
+
+# Add parent directory to path
+BACKEND_DIR = Path(__file__).parent.parent
+sys.path.append(str(BACKEND_DIR))
+
+import cv2
+import numpy as np
+
+from utils.data_access import get_supabase
+from utils.gallery import EmbeddingGallery
+from utils.face_engine import get_face_engine
+from utils.attendance_marker import attendance_marker
+from utils.model_registry import model_registry
+from utils.lazy_import import DeepFace
+
+face_engine = get_face_engine()
+
+STAGES = ("decode", "detect", "embed", "match", "should_mark", "startup")
+
+# Measured in a fresh interpreter each time: (name, Python statement or CLI args)
+STARTUP_TARGETS = (
+    ("import[utils.face_engine]", "import utils.face_engine"),
+    ("import[utils.dataset_builder]", "import utils.dataset_builder"),
+    ("import[main]", "import main"),
+    ("import[deepface]", "from deepface import DeepFace"),
+    ("cli[enroll_student --help]", ["scripts/enroll_student.py", "--help"]),
+)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def synthetic_face(width, height, rng):
+    """A noisy background with a face-like shape covering ~1/3 of the height"""
+    img = rng.integers(60, 120, (height, width, 3), dtype=np.uint8)
+    cx, cy, r = width // 2, height // 2, max(20, height // 6)
+    cv2.ellipse(img, (cx, cy), (int(r * 0.8), r), 0, 0, 360, (150, 180, 220), -1)
+    for dx in (-r // 3, r // 3):
+        cv2.circle(img, (cx + dx, cy - r // 4), max(2, r // 10), (40, 40, 40), -1)
+    cv2.ellipse(img, (cx, cy + r // 2), (r // 3, max(2, r // 10)), 0, 0, 180, (60, 60, 150), -1)
+    return img
+
+
+def load_faces(images_dir, width, height, limit=10):
+    """Real photos letterboxed to width x height"""
+    faces = []
+    for path in sorted(Path(images_dir).rglob("*"))[:limit * 5]:
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        scale = min(width / img.shape[1], height / img.shape[0])
+        resized = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        y, x = (height - resized.shape[0]) // 2, (width - resized.shape[1]) // 2
+        canvas[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+        faces.append(canvas)
+        if len(faces) >= limit:
+            break
+    return faces
+
+
+def to_base64(img):
+    ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.tobytes()).decode()
+
+
+def measure(fn, inputs, iterations, warmup):
+    """Run fn over inputs round-robin; return latency percentiles and throughput"""
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "iterations": iterations,
+        "mean_ms": round(float(np.mean(latencies)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "ops_per_second": round(iterations / elapsed, 2) if elapsed else None
+    }
+
+
+def time_startup(target):
+    """Seconds for one import (measured in the child) or one full CLI run"""
+    env = dict(os.environ, ATTENDIFY_DATA_BACKEND="memory")
+    if isinstance(target, list):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *target], cwd=str(BACKEND_DIR), env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - start
+    code = f"import time; t = time.perf_counter(); {target}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=str(BACKEND_DIR), env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def seed_attendance(client, history, class_id="BENCH_CLASS"):
+    """Reset the memory backend to one always-in-session class with `history` past marks"""
+    with client.lock:
+        client.tables.clear()
+    days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    client.table("classes").insert({"id": class_id, "schedule": {d: ["00:00-23:59"] for d in days}}).execute()
+    client.table("class_enrollments").insert([
+        {"student_id": f"STUD{i:06d}", "class_id": class_id} for i in range(200)
+    ]).execute()
+    # Old marks: dedup has to look at them but none fall in the window
+    old = "2000-01-01T09:00:00"
+    client.table("attendance_logs").insert([
+        {"student_id": f"STUD{i % 200:06d}", "class_id": class_id, "marked_at": old, "confidence_score": 0.9}
+        for i in range(history)
+    ]).execute()
+    return class_id
+
+
+def run(args):
+    rng = np.random.default_rng(0)
+    sizes = [parse_size(s) for s in args.image_sizes]
+    results = {}
+    skipped = []
+
+    def record(name, stats):
+        results[name] = stats
+        print(f"{name:<32} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  {stats['ops_per_second']:>10.1f} ops/s")
+
+    if not DeepFace:
+        skipped += [s for s in ("detect", "embed") if s in args.stages]
+
+    for width, height in sizes:
+        label = f"{width}x{height}"
+        images = load_faces(args.images, width, height) if args.images else []
+        if not images:
+            images = [synthetic_face(width, height, rng) for _ in range(4)]
+        encoded = [to_base64(img) for img in images]
+
+        if "decode" in args.stages:
+            record(f"decode[{label}]", measure(face_engine._decode_image, encoded, args.iterations, args.warmup))
+
+        if DeepFace and "detect" in args.stages:
+            decoded = [face_engine._decode_image(e) for e in encoded]
+
+            def detect(img):
+                DeepFace.extract_faces(img_path=img, detector_backend=face_engine.detector_backend, enforce_detection=False)
+            record(f"detect[{label}]", measure(detect, decoded, args.model_iterations, 1))
+
+        if DeepFace and "embed" in args.stages:
+            model = model_registry.get_embedding_model(face_engine.embedding_model_id)
+            faces = [
+                DeepFace.extract_faces(img_path=face_engine._decode_image(e), detector_backend=face_engine.detector_backend,
+                                       enforce_detection=False)[0]
+                for e in encoded
+            ]
+            record(f"embed[{label}]", measure(lambda face: face_engine._forward_batch(model, [face]),
+                                              faces, args.model_iterations, 1))
+
+    if "match" in args.stages:
+        for n in args.gallery_sizes:
+            gallery = EmbeddingGallery()
+            vectors = rng.standard_normal((n, 512)).astype(np.float32)
+            gallery.add({"student_id": f"STUD{i:06d}", "profile_id": None, "embedding": v} for i, v in enumerate(vectors))
+            probes = [vectors[i % n] + rng.standard_normal(512).astype(np.float32) * 0.05 for i in range(32)]
+            record(f"match[gallery={n}]", measure(lambda q: gallery.search(q, 0.4, 1), probes, args.iterations, args.warmup))
+
+    if "should_mark" in args.stages:
+        client = get_supabase()
+        for n in args.gallery_sizes:
+            class_id = seed_attendance(client, n)
+            students = [f"STUD{i:06d}" for i in range(200)]
+            record(f"should_mark[logs={n}]", measure(
+                lambda s: attendance_marker.should_mark_attendance(s, class_id, confidence=0.9),
+                students, args.iterations, args.warmup
+            ))
+
+    if "startup" in args.stages:
+        for name, target in STARTUP_TARGETS:
+            samples = []
+            try:
+                for _ in range(args.startup_iterations):
+                    samples.append(time_startup(target) * 1000)
+            except (subprocess.CalledProcessError, ValueError):
+                skipped.append(name)
+                continue
+            record(name, {
+                "iterations": len(samples),
+                "mean_ms": round(float(np.mean(samples)), 2),
+                "p50_ms": round(float(np.percentile(samples, 50)), 2),
+                "p95_ms": round(float(np.percentile(samples, 95)), 2),
+                "p99_ms": round(float(np.percentile(samples, 99)), 2),
+                "ops_per_second": round(1000 / float(np.mean(samples)), 2)
+            })
+
+    return results, skipped
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Compare p50 latency against a baseline
+
+    Returns:
+        List of regression descriptions (empty if none)
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        limit = base["p50_ms"] * (1 + tolerance)
+        if stats["p50_ms"] > limit and stats["p50_ms"] - base["p50_ms"] > min_delta_ms:
+            regressions.append(
+                f"{name}: p50 {stats['p50_ms']:.3f} ms vs baseline {base['p50_ms']:.3f} ms "
+                f"(+{(stats['p50_ms'] / base['p50_ms'] - 1):.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-stage micro-benchmarks for the recognition pipeline')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES, help='Stages to run (default: all)')
+    parser.add_argument('--image-sizes', nargs='+', default=["640x480", "1280x720", "1920x1080", "4032x3024"], help='Image sizes WxH')
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Gallery / history sizes')
+    parser.add_argument('--images', type=str, help='Directory of real face photos (default: synthetic faces)')
+    parser.add_argument('--iterations', type=int, default=200, help='Timed iterations for fast stages (default: 200)')
+    parser.add_argument('--model-iterations', type=int, default=10, help='Timed iterations for detect/embed (default: 10)')
+    parser.add_argument('--startup-iterations', type=int, default=3, help='Fresh interpreters per startup target (default: 3)')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed warm-up iterations (default: 5)')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('--baseline', type=str, help='Baseline JSON to compare against; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p50 slowdown vs baseline (default: 0.25)')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help='Ignore slowdowns smaller than this (default: 0.05)')
+    args = parser.parse_args()
+
+    print(f"\n{'='*70}")
+    print(f"STAGE BENCHMARKS (data backend: memory)")
+    print(f"{'='*70}")
+
+    results, skipped = run(args)
+    if skipped:
+        print(f"Skipped (DeepFace not installed or target failed): {', '.join(skipped)}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "max_detect_side": face_engine.max_detect_side,
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        print(f"\n{'='*70}")
+        if regressions:
+            print(f"❌ {len(regressions)} REGRESSION(S) vs {args.baseline}")
+            for line in regressions:
+                print(f"  - {line}")
+            print(f"{'='*70}\n")
+            sys.exit(1)
+        print(f"✅ No regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+        print(f"{'='*70}\n")
+
+    attendance_marker.close()
+    face_engine.close()
+
+
+if __name__ == "__main__":
+    main()
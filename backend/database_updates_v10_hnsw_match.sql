@@ -0,0 +1,76 @@
+-- HNSW-INDEXED FACE MATCHING (v10)
+-- Run this after supabase_setup.sql (requires pgvector >= 0.5.0)
+
+-- 1. Approximate nearest-neighbour index for cosine distance (<=>)
+-- Without it every match is a sequential scan over active_embeddings.
+CREATE INDEX IF NOT EXISTS idx_active_embeddings_hnsw ON active_embeddings
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+-- 2. match_students: ORDER BY distance LIMIT k first, threshold afterward
+-- A WHERE on the similarity expression cannot be answered by the index, so
+-- the planner falls back to scanning every row. Ordering by distance with a
+-- LIMIT lets the index answer it, and the threshold is applied to those k
+-- rows afterward. Results are approximate: HNSW returns close neighbours, not
+-- always the exact k nearest, and how often it misses one depends on
+-- hnsw.ef_search (see the end of this file). benchmarks/match_students_plan.py
+-- measures recall against an exact scan.
+CREATE OR REPLACE FUNCTION match_students (
+    query_embedding vector(512),
+    match_threshold FLOAT,
+    match_count INT
+)
+RETURNS TABLE (
+    student_id TEXT,
+    profile_id UUID,
+    similarity FLOAT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT nearest.student_id, nearest.profile_id, nearest.similarity
+    FROM (
+        SELECT
+            ae.student_id,
+            ae.profile_id,
+            1 - (ae.embedding <=> query_embedding) AS similarity
+        FROM active_embeddings ae
+        ORDER BY ae.embedding <=> query_embedding
+        LIMIT match_count
+    ) nearest
+    WHERE nearest.similarity > match_threshold
+    ORDER BY nearest.similarity DESC;
+$$;
+
+-- 3. Batched variant: every face of a frame in one call
+-- query_embeddings is a JSON array of 512-d arrays, as in recognize_and_mark (v5).
+-- Each face gets its own index scan through the LATERAL subquery.
+CREATE OR REPLACE FUNCTION match_students_batch (
+    query_embeddings JSONB,
+    match_threshold FLOAT,
+    match_count INT
+)
+RETURNS TABLE (
+    query_index INT,
+    student_id TEXT,
+    profile_id UUID,
+    similarity FLOAT
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT (q.ord - 1)::INT, nearest.student_id, nearest.profile_id, nearest.similarity
+    FROM jsonb_array_elements(query_embeddings) WITH ORDINALITY AS q(embedding, ord)
+    CROSS JOIN LATERAL (
+        SELECT
+            ae.student_id,
+            ae.profile_id,
+            1 - (ae.embedding <=> q.embedding::TEXT::vector(512)) AS similarity
+        FROM active_embeddings ae
+        ORDER BY ae.embedding <=> q.embedding::TEXT::vector(512)
+        LIMIT match_count
+    ) nearest
+    WHERE nearest.similarity > match_threshold
+    ORDER BY q.ord, nearest.similarity DESC;
+$$;
+
+-- Recall / speed trade-off for HNSW scans (default 40). Raise per session with
+--   SET hnsw.ef_search = 100;
+-- if match_count gets close to it or the benchmark shows recall too low.
@@ -0,0 +1,15 @@
+-- CAMERA-AWARE CLASS RESOLUTION (v11)
+-- Run this after database_updates.sql
+
+-- 1. Which camera covers each class's room
+-- Several classes can share a camera (same room, different periods); the
+-- backend picks the one whose schedule is in session right now.
+ALTER TABLE classes ADD COLUMN IF NOT EXISTS camera_id TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_classes_camera ON classes(camera_id);
+
+-- 2. Roster lookups for the per-class gallery
+-- UNIQUE(class_id, student_id) already indexes class_id as its leading column.
+
+-- Example:
+--   UPDATE classes SET camera_id = 'room_204' WHERE class_name = 'Physics 10A';
@@ -0,0 +1,63 @@
+-- INCREMENTAL GALLERY SYNC (v12)
+-- Run this after database_updates_v8_bulk_approval.sql
+-- Lets a cached gallery (utils/gallery_sync.py) fetch only what changed
+-- since its last sync instead of the whole active_embeddings table.
+
+-- 1. Last-change time of every embedding row
+-- Existing rows take their created_at, so they do not all share one timestamp
+ALTER TABLE active_embeddings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE;
+UPDATE active_embeddings SET updated_at = COALESCE(created_at, NOW()) WHERE updated_at IS NULL;
+ALTER TABLE active_embeddings ALTER COLUMN updated_at SET DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_active_embeddings_updated ON active_embeddings(updated_at);
+
+CREATE OR REPLACE FUNCTION touch_active_embeddings()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_touch_active_embeddings ON active_embeddings;
+CREATE TRIGGER trg_touch_active_embeddings
+    BEFORE UPDATE ON active_embeddings
+    FOR EACH ROW EXECUTE FUNCTION touch_active_embeddings();
+
+-- 2. Tombstones: deleted rows leave their id behind so syncs can drop them
+CREATE TABLE IF NOT EXISTS active_embeddings_tombstones (
+    id UUID PRIMARY KEY,
+    student_id TEXT,
+    profile_id UUID,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_tombstones_deleted ON active_embeddings_tombstones(deleted_at);
+
+CREATE OR REPLACE FUNCTION record_active_embedding_delete()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO active_embeddings_tombstones (id, student_id, profile_id)
+    VALUES (OLD.id, OLD.student_id, OLD.profile_id)
+    ON CONFLICT (id) DO UPDATE SET deleted_at = NOW();
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_active_embeddings_tombstone ON active_embeddings;
+CREATE TRIGGER trg_active_embeddings_tombstone
+    AFTER DELETE ON active_embeddings
+    FOR EACH ROW EXECUTE FUNCTION record_active_embedding_delete();
+
+ALTER TABLE active_embeddings_tombstones ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Teachers can view embedding tombstones" ON active_embeddings_tombstones;
+CREATE POLICY "Teachers can view embedding tombstones" ON active_embeddings_tombstones
+  FOR SELECT USING ( public.is_teacher() );
+
+-- Tombstones only need to outlive the longest gap between syncs. Prune with e.g.
+--   DELETE FROM active_embeddings_tombstones WHERE deleted_at < NOW() - INTERVAL '30 days';
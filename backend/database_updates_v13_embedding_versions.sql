@@ -0,0 +1,178 @@
+-- MODEL-VERSIONED EMBEDDINGS AND RE-EMBEDDING (v13)
+-- Run this after database_updates_v12_embedding_changes.sql
+-- Embeddings from different models (or detectors, which change the aligned
+-- crop) are not comparable. Every row records which one produced it, and
+-- utils/reembedding.py migrates all rows to a new one through a shadow table.
+
+-- 1. Which pipeline produced each embedding, e.g. 'Facenet512/mtcnn' (DeepFace)
+--    or 'Facenet512@onnxruntime/yunet' (exported model; see utils/face_engine.py)
+-- Everything stored so far came from the original configuration.
+ALTER TABLE pending_approvals ADD COLUMN IF NOT EXISTS embedding_version TEXT;
+ALTER TABLE active_embeddings ADD COLUMN IF NOT EXISTS embedding_version TEXT;
+ALTER TABLE active_embedding_templates ADD COLUMN IF NOT EXISTS embedding_version TEXT;
+
+UPDATE pending_approvals SET embedding_version = 'Facenet512/mtcnn' WHERE embedding_version IS NULL;
+UPDATE active_embeddings SET embedding_version = 'Facenet512/mtcnn' WHERE embedding_version IS NULL;
+UPDATE active_embedding_templates SET embedding_version = 'Facenet512/mtcnn' WHERE embedding_version IS NULL;
+
+-- 2. Shadow table filled by the re-embedding tool, one row per student and version
+-- The vector is untyped so a model with another dimension can be staged; the
+-- cutover casts to vector(512) and fails (changing nothing) if it does not fit.
+CREATE TABLE IF NOT EXISTS embedding_reembed (
+    student_id TEXT NOT NULL,
+    embedding_version TEXT NOT NULL,
+    embedding VECTOR,
+    templates JSONB,
+    images INT,
+    source TEXT,  -- 'bucket' or 'dataset'
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (student_id, embedding_version)
+);
+
+ALTER TABLE embedding_reembed ENABLE ROW LEVEL SECURITY;
+-- No policies: only the service role (the tool) reads or writes it
+
+-- 3. Approvals carry the version over to active_embeddings (replaces v8)
+CREATE OR REPLACE FUNCTION approve_pending_bulk(
+    pending_ids UUID[]
+)
+RETURNS TABLE (
+    pending_id UUID,
+    result TEXT,
+    student_id TEXT,
+    profile_id UUID,
+    embedding vector(512)
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    pid UUID;
+    p RECORD;
+BEGIN
+    FOR pid IN SELECT DISTINCT unnest(pending_ids) LOOP
+        pending_id := pid;
+        student_id := NULL;
+        profile_id := NULL;
+        embedding := NULL;
+
+        SELECT pa.id, pa.profile_id, pa.student_id, pa.embedding, pa.templates, pa.status, pa.embedding_version
+          INTO p
+          FROM pending_approvals pa
+         WHERE pa.id = pid
+           FOR UPDATE;
+
+        IF NOT FOUND THEN
+            result := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        student_id := p.student_id;
+        profile_id := p.profile_id;
+
+        IF p.status IS DISTINCT FROM 'pending' THEN
+            result := 'already_' || COALESCE(p.status, 'unknown');
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        INSERT INTO active_embeddings (profile_id, student_id, embedding, embedding_version)
+        VALUES (p.profile_id, p.student_id, p.embedding, p.embedding_version);
+
+        IF p.templates IS NOT NULL THEN
+            INSERT INTO active_embedding_templates (profile_id, student_id, template_index, embedding, embedding_version)
+            SELECT p.profile_id, p.student_id, (t.ord - 1)::INT, t.value::TEXT::vector(512), p.embedding_version
+              FROM jsonb_array_elements(p.templates) WITH ORDINALITY AS t(value, ord);
+        END IF;
+
+        UPDATE profiles SET is_active = TRUE WHERE id = p.profile_id;
+        UPDATE pending_approvals SET status = 'approved' WHERE id = pid;
+
+        result := 'approved';
+        embedding := p.embedding;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+-- 4. Atomic cutover to a re-embedded version
+-- One transaction: every active and still-pending embedding of a student with
+-- a shadow row is replaced, templates are rewritten, and the shadow rows are
+-- removed. It refuses (changing nothing) while any student still lacks a
+-- shadow row: matching never filters by version, so old and new vectors must
+-- not be searched side by side. Students that cannot be re-embedded have to
+-- be re-enrolled or removed first. The UPDATE stamps updated_at, so
+-- incremental gallery syncs (v12) pick up every changed row.
+--
+-- Returns one row per table with the number of rows switched.
+DROP FUNCTION IF EXISTS cutover_embedding_version(TEXT, BOOLEAN);
+
+CREATE OR REPLACE FUNCTION cutover_embedding_version(
+    target_version TEXT
+)
+RETURNS TABLE (
+    item TEXT,
+    rows_changed BIGINT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    missing BIGINT;
+    n BIGINT;
+BEGIN
+    -- Serialize with approvals and other cutovers
+    LOCK TABLE active_embeddings, active_embedding_templates, pending_approvals IN SHARE ROW EXCLUSIVE MODE;
+
+    SELECT COUNT(DISTINCT s.student_id) INTO missing
+      FROM (
+        SELECT ae.student_id FROM active_embeddings ae
+         WHERE ae.embedding_version IS DISTINCT FROM target_version
+        UNION
+        SELECT pa.student_id FROM pending_approvals pa
+         WHERE pa.status = 'pending' AND pa.embedding_version IS DISTINCT FROM target_version
+      ) s
+     WHERE NOT EXISTS (
+        SELECT 1 FROM embedding_reembed r
+         WHERE r.student_id = s.student_id AND r.embedding_version = target_version
+     );
+
+    IF missing > 0 THEN
+        RAISE EXCEPTION '% students have no % embedding yet; finish re-embedding, or re-enroll or remove them', missing, target_version;
+    END IF;
+
+    UPDATE active_embeddings ae
+       SET embedding = r.embedding::vector(512), embedding_version = target_version
+      FROM embedding_reembed r
+     WHERE r.student_id = ae.student_id AND r.embedding_version = target_version;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    item := 'active_embeddings'; rows_changed := n; RETURN NEXT;
+
+    DELETE FROM active_embedding_templates t
+     USING embedding_reembed r
+     WHERE r.student_id = t.student_id AND r.embedding_version = target_version;
+
+    INSERT INTO active_embedding_templates (profile_id, student_id, template_index, embedding, embedding_version)
+    SELECT ae.profile_id, ae.student_id, (t.ord - 1)::INT, t.value::TEXT::vector(512), target_version
+      FROM embedding_reembed r
+      JOIN (SELECT DISTINCT ON (student_id) student_id, profile_id FROM active_embeddings ORDER BY student_id, updated_at DESC) ae
+        ON ae.student_id = r.student_id
+      CROSS JOIN LATERAL jsonb_array_elements(r.templates) WITH ORDINALITY AS t(value, ord)
+     WHERE r.embedding_version = target_version AND r.templates IS NOT NULL;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    item := 'active_embedding_templates'; rows_changed := n; RETURN NEXT;
+
+    UPDATE pending_approvals pa
+       SET embedding = r.embedding::vector(512), templates = r.templates, embedding_version = target_version
+      FROM embedding_reembed r
+     WHERE r.student_id = pa.student_id AND r.embedding_version = target_version AND pa.status = 'pending';
+    GET DIAGNOSTICS n = ROW_COUNT;
+    item := 'pending_approvals'; rows_changed := n; RETURN NEXT;
+
+    DELETE FROM embedding_reembed WHERE embedding_version = target_version;
+END;
+$$;
+
+-- Usage (after the tool reports 100%):
+--   SELECT * FROM cutover_embedding_version('Facenet512/yunet');
+-- then restart the API with the matching ATTENDIFY_* model settings.
@@ -0,0 +1,10 @@
+-- ATTENDANCE WRITE-AHEAD QUEUE (v4)
+-- Run this after database_updates.sql
+
+-- 1. Idempotency key for attendance_logs
+-- The backend queues accepted marks locally and flushes them in batches.
+-- Each mark carries a deterministic key so retried batches never create duplicates.
+ALTER TABLE attendance_logs ADD COLUMN IF NOT EXISTS idempotency_key UUID;
+
+-- Unique index lets the flusher upsert with ON CONFLICT (idempotency_key) DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_idempotency ON attendance_logs(idempotency_key);
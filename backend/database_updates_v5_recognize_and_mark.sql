@@ -0,0 +1,139 @@
+-- FUSED RECOGNIZE-AND-MARK (v5)
+-- Run this after supabase_setup.sql, database_updates.sql and database_updates_v4_attendance_queue.sql
+
+-- One call per frame: match every face, dedup, check enrollment and schedule,
+-- insert attendance and update recognition_stats in a single transaction.
+--
+-- query_embeddings is a JSON array of 512-d arrays (one per detected face).
+-- JSONB is used instead of vector(512)[] because PostgREST passes RPC
+-- arguments as JSON and each element casts cleanly to pgvector's text format.
+--
+-- Schedule times are compared in the database time zone.
+CREATE OR REPLACE FUNCTION recognize_and_mark(
+    query_embeddings JSONB,
+    p_camera_id TEXT DEFAULT 'cctv_main',
+    p_class_id TEXT DEFAULT NULL,
+    match_threshold FLOAT DEFAULT 0.4,
+    min_confidence FLOAT DEFAULT 0.70,
+    verify_confidence FLOAT DEFAULT 0.85,
+    dedup_window_hours INT DEFAULT 1
+)
+RETURNS TABLE (
+    face_index INT,
+    student_id TEXT,
+    profile_id UUID,
+    similarity FLOAT,
+    status TEXT,
+    reason TEXT,
+    record_id UUID
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    i INT;
+    q vector(512);
+    m RECORD;
+    sched JSONB;
+    slot TEXT;
+    in_session BOOLEAN := TRUE;
+    class_found BOOLEAN := FALSE;
+    now_local TIMESTAMP := LOCALTIMESTAMP;
+    now_hhmm TEXT := to_char(LOCALTIMESTAMP, 'HH24:MI');
+    n_marked INT := 0;
+    sum_conf FLOAT := 0;
+BEGIN
+    -- Schedule is checked once per frame, not once per face
+    IF p_class_id IS NOT NULL THEN
+        SELECT c.schedule INTO sched FROM classes c WHERE c.id::TEXT = p_class_id;
+        class_found := FOUND;
+
+        IF class_found AND sched IS NOT NULL THEN
+            in_session := FALSE;
+            FOR slot IN
+                SELECT jsonb_array_elements_text(
+                    COALESCE(sched -> lower(trim(to_char(now_local, 'Day'))), '[]'::JSONB)
+                )
+            LOOP
+                IF position('-' IN slot) > 0
+                   AND now_hhmm >= split_part(slot, '-', 1)
+                   AND now_hhmm <= split_part(slot, '-', 2) THEN
+                    in_session := TRUE;
+                END IF;
+            END LOOP;
+        END IF;
+    END IF;
+
+    FOR i IN 0 .. COALESCE(jsonb_array_length(query_embeddings), 0) - 1 LOOP
+        face_index := i;
+        student_id := NULL;
+        profile_id := NULL;
+        similarity := NULL;
+        record_id := NULL;
+        q := (query_embeddings -> i)::TEXT::vector(512);
+
+        SELECT ae.student_id, ae.profile_id, 1 - (ae.embedding <=> q) AS sim
+          INTO m
+          FROM active_embeddings ae
+         ORDER BY ae.embedding <=> q
+         LIMIT 1;
+
+        IF NOT FOUND OR m.sim <= match_threshold THEN
+            status := 'no_match';
+            reason := 'No matching student';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        student_id := m.student_id;
+        profile_id := m.profile_id;
+        similarity := m.sim;
+
+        IF m.sim < min_confidence THEN
+            status := 'skipped';
+            reason := format('Confidence too low (%s%% < %s%%)', round((m.sim * 100)::NUMERIC), round((min_confidence * 100)::NUMERIC));
+        ELSIF EXISTS (
+            SELECT 1 FROM attendance_logs al
+             WHERE al.student_id = m.student_id
+               AND (p_class_id IS NULL OR al.class_id = p_class_id)
+               AND al.marked_at >= NOW() - make_interval(hours => dedup_window_hours)
+        ) THEN
+            status := 'skipped';
+            reason := format('Already marked within last %s hour(s)', dedup_window_hours);
+        ELSIF p_class_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM class_enrollments ce
+             WHERE ce.student_id = m.student_id
+               AND ce.class_id::TEXT = p_class_id
+        ) THEN
+            status := 'skipped';
+            reason := 'Student not enrolled in this class';
+        ELSIF NOT in_session THEN
+            status := 'skipped';
+            reason := 'Class not currently in session';
+        ELSE
+            INSERT INTO attendance_logs (student_id, profile_id, class_id, confidence_score, camera_id, verified, method)
+            VALUES (m.student_id, m.profile_id, p_class_id, m.sim, p_camera_id, m.sim >= verify_confidence, 'face_recognition')
+            RETURNING attendance_logs.id INTO record_id;
+
+            status := 'success';
+            reason := 'OK';
+            n_marked := n_marked + 1;
+            sum_conf := sum_conf + m.sim;
+        END IF;
+
+        RETURN NEXT;
+    END LOOP;
+
+    IF n_marked > 0 THEN
+        INSERT INTO recognition_stats AS rs
+            (date, camera_id, total_recognitions, successful_matches, failed_matches, avg_confidence, avg_processing_time_ms)
+        VALUES
+            (CURRENT_DATE, p_camera_id, n_marked, n_marked, 0, sum_conf / n_marked, 0)
+        ON CONFLICT (date, camera_id) DO UPDATE SET
+            total_recognitions = rs.total_recognitions + EXCLUDED.total_recognitions,
+            successful_matches = rs.successful_matches + EXCLUDED.successful_matches,
+            avg_confidence = (COALESCE(rs.avg_confidence, 0) * rs.total_recognitions + sum_conf)
+                             / (rs.total_recognitions + EXCLUDED.total_recognitions);
+    END IF;
+END;
+$$;
@@ -0,0 +1,56 @@
+-- ATTENDANCE SUMMARY & EXPORT (v6)
+-- Run this after database_updates.sql
+
+-- 1. Keyset index: export pages seek on (marked_at, id) instead of using OFFSET
+CREATE INDEX IF NOT EXISTS idx_attendance_marked_id ON attendance_logs(marked_at, id);
+CREATE INDEX IF NOT EXISTS idx_class_attendance_marked_id ON attendance_logs(class_id, marked_at, id);
+
+-- 2. Per-class, per-day summary built on get_attendance_stats
+-- If p_class_id is NULL every class is summarized.
+CREATE OR REPLACE FUNCTION get_attendance_summary(
+    p_start DATE,
+    p_end DATE DEFAULT CURRENT_DATE,
+    p_class_id TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    class_id TEXT,
+    day DATE,
+    total_students INT,
+    present_students INT,
+    absent_students INT,
+    attendance_percentage FLOAT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT c.id::TEXT, d.day::DATE, s.total_students, s.present_students, s.absent_students, s.attendance_percentage
+    FROM classes c
+    CROSS JOIN generate_series(p_start, p_end, INTERVAL '1 day') AS d(day)
+    CROSS JOIN LATERAL get_attendance_stats(c.id::TEXT, d.day::DATE) s
+    WHERE p_class_id IS NULL OR c.id::TEXT = p_class_id
+    ORDER BY c.id, d.day;
+$$;
+
+-- 3. One keyset page of attendance_logs for streaming exports
+-- Pass the (marked_at, id) of the last row of the previous page, or NULLs for the first page.
+CREATE OR REPLACE FUNCTION export_attendance_page(
+    p_start TIMESTAMP WITH TIME ZONE,
+    p_end TIMESTAMP WITH TIME ZONE,
+    p_class_id TEXT DEFAULT NULL,
+    p_after_marked_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL,
+    p_limit INT DEFAULT 1000
+)
+RETURNS SETOF attendance_logs
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT *
+    FROM attendance_logs al
+    WHERE al.marked_at >= p_start
+      AND al.marked_at < p_end
+      AND (p_class_id IS NULL OR al.class_id = p_class_id)
+      AND (p_after_marked_at IS NULL OR (al.marked_at, al.id) > (p_after_marked_at, p_after_id))
+    ORDER BY al.marked_at, al.id
+    LIMIT p_limit;
+$$;
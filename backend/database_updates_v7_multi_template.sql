@@ -0,0 +1,56 @@
+-- MULTI-TEMPLATE ENROLLMENT (v7)
+-- Run this after supabase_setup.sql
+
+-- 1. Pending approvals keep every accepted enrollment photo's embedding.
+-- pending_approvals.embedding holds their normalized centroid.
+ALTER TABLE pending_approvals ADD COLUMN IF NOT EXISTS templates JSONB;
+
+-- 2. Per-photo templates of approved students.
+-- active_embeddings keeps one centroid per student (small gallery, fast search);
+-- this table is searched only for hard cases.
+CREATE TABLE IF NOT EXISTS active_embedding_templates (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    profile_id UUID REFERENCES profiles(id) ON DELETE CASCADE,
+    student_id TEXT NOT NULL,
+    template_index INT NOT NULL,
+    embedding VECTOR(512),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_templates_student ON active_embedding_templates(student_id);
+
+ALTER TABLE active_embedding_templates ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Teachers can view embedding templates" ON active_embedding_templates;
+CREATE POLICY "Teachers can view embedding templates" ON active_embedding_templates
+  FOR SELECT USING ( public.is_teacher() );
+
+-- 3. Match against every template, best template per student
+create or replace function match_students_templates (
+  query_embedding vector(512),
+  match_threshold float,
+  match_count int
+)
+returns table (
+  student_id text,
+  profile_id uuid,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  return query
+  select best.student_id, best.profile_id, best.similarity
+  from (
+    select distinct on (t.student_id)
+      t.student_id,
+      t.profile_id,
+      1 - (t.embedding <=> query_embedding) as similarity
+    from active_embedding_templates t
+    where 1 - (t.embedding <=> query_embedding) > match_threshold
+    order by t.student_id, t.embedding <=> query_embedding
+  ) best
+  order by best.similarity desc
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,74 @@
+-- BULK TEACHER APPROVAL (v8)
+-- Run this after supabase_setup.sql and database_updates_v7_multi_template.sql
+
+-- Approve any number of pending_approvals rows in one call and one transaction.
+-- For each approved row: copy the centroid into active_embeddings, the
+-- per-photo templates into active_embedding_templates, activate the profile
+-- and mark the pending row approved. Rows are locked, so two teachers
+-- approving the same batch cannot insert a student twice.
+--
+-- Returns one row per requested id. result is 'approved', 'not_found' or
+-- 'already_<status>'; approved rows also carry the embedding so the API can
+-- update its in-process gallery without another query.
+CREATE OR REPLACE FUNCTION approve_pending_bulk(
+    pending_ids UUID[]
+)
+RETURNS TABLE (
+    pending_id UUID,
+    result TEXT,
+    student_id TEXT,
+    profile_id UUID,
+    embedding vector(512)
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    pid UUID;
+    p RECORD;
+BEGIN
+    FOR pid IN SELECT DISTINCT unnest(pending_ids) LOOP
+        pending_id := pid;
+        student_id := NULL;
+        profile_id := NULL;
+        embedding := NULL;
+
+        SELECT pa.id, pa.profile_id, pa.student_id, pa.embedding, pa.templates, pa.status
+          INTO p
+          FROM pending_approvals pa
+         WHERE pa.id = pid
+           FOR UPDATE;
+
+        IF NOT FOUND THEN
+            result := 'not_found';
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        student_id := p.student_id;
+        profile_id := p.profile_id;
+
+        IF p.status IS DISTINCT FROM 'pending' THEN
+            result := 'already_' || COALESCE(p.status, 'unknown');
+            RETURN NEXT;
+            CONTINUE;
+        END IF;
+
+        INSERT INTO active_embeddings (profile_id, student_id, embedding)
+        VALUES (p.profile_id, p.student_id, p.embedding);
+
+        IF p.templates IS NOT NULL THEN
+            INSERT INTO active_embedding_templates (profile_id, student_id, template_index, embedding)
+            SELECT p.profile_id, p.student_id, (t.ord - 1)::INT, t.value::TEXT::vector(512)
+              FROM jsonb_array_elements(p.templates) WITH ORDINALITY AS t(value, ord);
+        END IF;
+
+        UPDATE profiles SET is_active = TRUE WHERE id = p.profile_id;
+        UPDATE pending_approvals SET status = 'approved' WHERE id = pid;
+
+        result := 'approved';
+        embedding := p.embedding;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
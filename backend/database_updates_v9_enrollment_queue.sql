@@ -0,0 +1,11 @@
+-- ENROLLMENT WRITE-AHEAD QUEUE (v9)
+-- Run this after supabase_setup.sql
+
+-- 1. Idempotency key for pending_approvals
+-- upload_biometrics queues the embedding locally and returns; a background
+-- flusher uploads the selfie and writes the rows. Each enrollment carries a
+-- key so a retried batch never creates a second pending record.
+ALTER TABLE pending_approvals ADD COLUMN IF NOT EXISTS enrollment_id UUID;
+
+-- Unique index lets the flusher upsert with ON CONFLICT (enrollment_id) DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pending_enrollment_id ON pending_approvals(enrollment_id);
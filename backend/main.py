@@ -1,11 +1,37 @@
-from fastapi import FastAPI, HTTPException, Body, Depends
+from fastapi import FastAPI, HTTPException, Body, Depends, Header, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+from uuid import UUID
+from datetime import date
 import base64
-from utils.face_engine import face_engine
+import csv
+import hmac
+import io
+import json
+import os
+from utils.face_engine import get_face_engine
+from utils.attendance_marker import attendance_marker, EXPORT_COLUMNS
+from utils.data_access import run_blocking, get_supabase
+from utils.model_registry import model_registry
+from utils.gallery import gallery, class_galleries
+from utils.gallery_sync import gallery_sync
+from utils.quality_gate import quality_gates
+from utils.metrics import metrics, begin_request, end_request, stage, QUEUE_DEPTH, QUEUE_LAG
+from utils import profiler
 
 app = FastAPI(title="Attendify Hybrid AI Backend")
+face_engine = get_face_engine()
+
+# Admin endpoints (profiling) are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ATTENDIFY_ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
 # Data Models
 class BiometricsUploadRequest(BaseModel):
@@ -15,10 +41,20 @@ class BiometricsUploadRequest(BaseModel):
     image: str  # Base64 string
 
 class ApprovalRequest(BaseModel):
-    pending_id: str
+    pending_id: UUID
+
+class BulkApprovalRequest(BaseModel):
+    pending_ids: List[UUID]  # Malformed ids are rejected with 422 before reaching the RPC
 
 class MatchRequest(BaseModel):
     image: str  # Base64 string
+    camera_id: Optional[str] = None  # Search the class in session in front of this camera first
+    class_id: Optional[str] = None
+
+class MarkRequest(BaseModel):
+    image: str  # Base64 string
+    camera_id: str = "cctv_main"
+    class_id: Optional[str] = None
 
 # Configure CORS
 app.add_middleware(
@@ -29,13 +65,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    token = begin_request()
+    profile_token = profiler.request_profiler.begin(request.url.path)
+    try:
+        with stage("total"):
+            response = await call_next(request)
+    finally:
+        timing = end_request(token)
+        if profile_token is not None:
+            profiler.request_profiler.end(profile_token)
+    if timing:
+        response.headers["Server-Timing"] = timing
+    return response
+
+@app.on_event("startup")
+async def startup():
+    # Flush marks and enrollments spooled before a restart now, not when the next one arrives
+    attendance_marker.start()
+    face_engine.start()
+    # Load detector + embedding model once, before the first camera frame
+    if os.getenv("ATTENDIFY_PRELOAD_MODELS", "1") == "1":
+        await run_blocking(face_engine.preload_models)
+    # Embeddings from another model/detector never match; say so loudly
+    stale = await run_blocking(face_engine.check_embedding_version)
+    if stale:
+        print(f"⚠️  {stale}{'+' if stale >= 1000 else ''} active embeddings are not {face_engine.embedding_version}; "
+              f"re-embed them (scripts/reembed.py) or restore the previous model settings")
+    # Mirror active_embeddings in-process so centroid matching skips the RPC
+    if os.getenv("ATTENDIFY_LOCAL_GALLERY", "0") == "1":
+        if os.getenv("ATTENDIFY_GALLERY_SYNC", "0") == "1":
+            # Snapshot + delta on start, then incremental pulls in the background
+            await run_blocking(gallery_sync.start, get_supabase())
+        else:
+            await run_blocking(gallery.load, get_supabase())
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Drain queued attendance marks and enrollments before the process exits
+    attendance_marker.close()
+    face_engine.close()
+    gallery_sync.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Attendify Hybrid AI Backend", "status": "online"}
 
 @app.post("/api/v1/students/upload-biometrics")
 async def upload_biometrics(request: BiometricsUploadRequest):
-    result = face_engine.upload_biometrics(
+    result = await run_blocking(
+        face_engine.upload_biometrics,
         request.profile_id, 
         request.student_id, 
         request.full_name, 
@@ -44,23 +124,172 @@ async def upload_biometrics(request: BiometricsUploadRequest):
     if isinstance(result, dict) and "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     if result:
-        return {"status": "success", "message": "Biometrics uploaded and pending approval"}
+        return {
+            "status": "success",
+            "message": "Biometrics uploaded and pending approval",
+            "enrollment_id": result.get("enrollment_id")
+        }
     raise HTTPException(status_code=400, detail="Failed to upload biometrics. face not detected.")
 
 @app.post("/api/v1/teacher/approve-biometrics")
 async def approve_biometrics(request: ApprovalRequest):
-    success = face_engine.approve_student(request.pending_id)
+    success = await run_blocking(face_engine.approve_student, str(request.pending_id))
     if success:
         return {"status": "success", "message": "Student biometrics approved"}
     raise HTTPException(status_code=400, detail="Approval failed")
 
+@app.post("/api/v1/teacher/approve-biometrics/bulk")
+async def approve_biometrics_bulk(request: BulkApprovalRequest):
+    results = await run_blocking(face_engine.approve_students_bulk, [str(pid) for pid in request.pending_ids])
+    if request.pending_ids and not results:
+        raise HTTPException(status_code=500, detail="Approval failed")
+    return {
+        "status": "success",
+        "approved": sum(1 for r in results if r["result"] == "approved"),
+        "results": results
+    }
+
 @app.post("/api/v1/attendance/match-face")
 async def match_face(request: MatchRequest):
-    match = face_engine.recognize_from_frame(request.image)
+    match = await run_blocking(
+        face_engine.recognize_from_frame, request.image,
+        class_id=request.class_id, camera_id=request.camera_id
+    )
     if match:
         return {"status": "success", "match": match}
     return {"status": "not_found", "message": "No matching student discovered"}
 
+@app.post("/api/v1/attendance/mark-face")
+async def mark_face(request: MarkRequest):
+    results = await run_blocking(face_engine.recognize_and_mark, request.image, request.class_id, request.camera_id)
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        raise HTTPException(status_code=500, detail=errors[0])
+    return {
+        "status": "success",
+        "faces": len(results),
+        "marked": sum(1 for r in results if r.get("status") == "success"),
+        "results": results
+    }
+
+@app.get("/api/v1/attendance/summary")
+async def attendance_summary(start_date: date, end_date: Optional[date] = None, class_id: Optional[str] = None):
+    if end_date and end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    summary = await run_blocking(attendance_marker.get_attendance_summary, start_date, end_date, class_id)
+    return {"status": "success", "summary": summary}
+
+def _csv_stream(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row.get(c) for c in columns])
+        # Flush roughly every 64KB so memory stays constant
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_stream(rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+@app.get("/api/v1/attendance/export")
+async def export_attendance(
+    start_date: date,
+    end_date: date,
+    class_id: Optional[str] = None,
+    format: str = "csv",
+    columns: Optional[str] = None
+):
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else EXPORT_COLUMNS
+    unknown = [c for c in selected if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+
+    # Sync generator: Starlette iterates it in a worker thread, page by page
+    rows = attendance_marker.iter_attendance(start_date, end_date, class_id, selected)
+    filename = f"attendance_{start_date}_{end_date}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "csv":
+        return StreamingResponse(_csv_stream(rows, selected), media_type="text/csv", headers=headers)
+    return StreamingResponse(_ndjson_stream(rows), media_type="application/x-ndjson", headers=headers)
+
+@app.get("/api/v1/attendance/queue")
+async def attendance_queue_status():
+    return attendance_marker.queue_stats()
+
+@app.get("/api/v1/enrollment/queue")
+async def enrollment_queue_status():
+    return face_engine.enrollment_queue_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    for queue in (attendance_marker.queue_stats(), face_engine.enrollment_queue_stats()):
+        QUEUE_DEPTH.set(queue["depth"], queue=queue["name"])
+        QUEUE_LAG.set(queue["flush_lag_seconds"], queue=queue["name"])
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/v1/models")
+async def loaded_models():
+    return model_registry.stats()
+
+@app.get("/api/v1/gallery")
+async def gallery_stats():
+    return {**gallery.stats(), "class_galleries": class_galleries.stats(), "sync": gallery_sync.stats()}
+
+@app.get("/api/v1/embedding-cache")
+async def embedding_cache_stats():
+    return face_engine.embedding_cache_stats()
+
+@app.get("/api/v1/quality-gate")
+async def quality_gate_settings():
+    return quality_gates.stats()
+
+@app.post("/api/v1/admin/profile/sample", dependencies=[Depends(require_admin)])
+async def profile_sample(seconds: float = 10.0, interval_ms: float = 5.0, format: str = "json", idle: bool = False):
+    if not 0 < seconds <= 60:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 60]")
+    if format not in ("json", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'collapsed'")
+    # One capture at a time; samples from two would describe each other
+    if not profiler.sampling_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A sampling profile is already running")
+    try:
+        result = await run_blocking(profiler.sample, seconds, max(interval_ms, 1.0) / 1000, 30, idle)
+    finally:
+        profiler.sampling_lock.release()
+    if format == "collapsed":
+        # flamegraph.pl / speedscope input
+        return PlainTextResponse(result["collapsed"])
+    return result
+
+@app.post("/api/v1/admin/profile/requests", dependencies=[Depends(require_admin)])
+async def profile_requests(count: int = 20, path: Optional[str] = "/api/v1/attendance/"):
+    if not 0 < count <= 1000:
+        raise HTTPException(status_code=400, detail="count must be in (0, 1000]")
+    profiler.request_profiler.arm(count, path)
+    return {"status": "armed", "count": count, "path_prefix": path}
+
+@app.get("/api/v1/admin/profile/requests", dependencies=[Depends(require_admin)])
+async def profile_requests_report(format: str = "json", sort: str = "tottime", limit: int = 30):
+    if format == "pstats":
+        # Load with pstats.Stats(path) or open in snakeviz
+        data = await run_blocking(profiler.request_profiler.dump)
+        if data is None:
+            raise HTTPException(status_code=404, detail="No requests profiled yet")
+        headers = {"Content-Disposition": 'attachment; filename="requests.prof"'}
+        return Response(content=data, media_type="application/octet-stream", headers=headers)
+    return await run_blocking(profiler.request_profiler.report, limit, sort)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
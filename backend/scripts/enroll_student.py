@@ -8,12 +8,15 @@ import csv
 import sys
 import os
 from pathlib import Path
+from typing import Optional
 
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from utils.dataset_builder import DatasetBuilder
-from utils.face_engine import face_engine
+from utils.face_engine import get_face_engine
+from utils.data_access import get_supabase
+from utils.bulk_enrollment import BulkEnroller, tasks_from_directory, tasks_from_csv, load_names, lookup_profile_ids
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -76,20 +79,30 @@ class StudentEnroller:
             # Generate embeddings and upload to database
             print(f"\n📊 Generating face embeddings...")
             
-            # Use the first (best quality) photo for embedding
-            best_photo_idx = validation['quality_scores'].index(max(validation['quality_scores']))
-            best_photo_path = photos[best_photo_idx]
+            # Use every accepted photo as a template, best quality first
+            ranked = sorted(zip(validation['quality_scores'], validation['photos']), key=lambda pair: pair[0], reverse=True)
+            accepted_photos = [path for score, path in ranked if score >= self.builder.min_quality_score]
+            if not accepted_photos:
+                accepted_photos = [ranked[0][1]]
             
-            # For now, we'll use a dummy profile_id
-            # In production, this should come from the authentication system
-            profile_id = f"profile_{student_id}"
+            # The profile comes from the student's account (profiles.id references auth.users)
+            supabase = get_supabase()
+            if supabase is None:
+                print(f"❌ Failed: Supabase not configured")
+                return False
+            profile_id = lookup_profile_ids(supabase, [student_id]).get(student_id)
+            if profile_id is None:
+                print(f"❌ Failed: No profile with student_id {student_id} - create the student's account first")
+                return False
             
-            # Upload biometrics
-            result = face_engine.upload_biometrics(
+            # Upload biometrics (template set + centroid); written before returning,
+            # since this process exits right after
+            result = get_face_engine().upload_biometrics_multi(
                 profile_id=profile_id,
                 student_id=student_id,
                 full_name=full_name,
-                image_input=best_photo_path
+                image_inputs=accepted_photos,
+                wait=True
             )
             
             if isinstance(result, dict) and "error" in result:
@@ -102,6 +115,7 @@ class StudentEnroller:
             print(f"Student: {full_name} ({student_id})")
             print(f"Status: Pending teacher approval")
             print(f"Photos saved: {len(photos)}")
+            print(f"Photos used as templates: {len(accepted_photos)}")
             print(f"{'='*70}\n")
             
             return True
@@ -200,6 +214,49 @@ class StudentEnroller:
             print(f"\n❌ Error reading CSV: {str(e)}")
         
         return results
+    
+    def enroll_bulk(
+        self,
+        dataset_dir: Optional[str] = None,
+        csv_path: Optional[str] = None,
+        names_csv: Optional[str] = None,
+        workers: Optional[int] = None,
+        batch_size: int = 50,
+        min_quality: Optional[float] = None,
+        state_path: str = "bulk_enroll_state.jsonl",
+        report_path: str = "bulk_enroll_report.csv"
+    ) -> dict:
+        """
+        Non-interactive bulk enrollment from photos already on disk
+        
+        Args:
+            dataset_dir: Directory laid out as <dataset_dir>/<student_id>/*.jpg
+            csv_path: CSV with student_id,full_name,image_path[,profile_id] (alternative to dataset_dir)
+            names_csv: Optional student_id,full_name CSV for dataset_dir mode
+            workers: Process pool size (default: CPU count)
+            batch_size: Students per pending_approvals write
+            min_quality: Override the minimum quality score
+            state_path: Checkpoint file used to resume
+            report_path: Per-student CSV report
+            
+        Returns:
+            Dictionary with enrollment results and throughput
+        """
+        if dataset_dir:
+            tasks = tasks_from_directory(dataset_dir, load_names(names_csv))
+        else:
+            tasks = tasks_from_csv(csv_path)
+        
+        enroller = BulkEnroller(
+            supabase=get_supabase(),
+            state_path=state_path,
+            report_path=report_path,
+            workers=workers,
+            batch_size=batch_size,
+            min_quality=min_quality,
+            dataset_root=str(self.builder.dataset_root)
+        )
+        return enroller.run(tasks)
 
 
 def main():
@@ -219,11 +276,20 @@ Examples:
   
   # Use external camera
   python enroll_student.py --student-id STUD001 --name "John Doe" --camera 1
+  
+  # Bulk enrollment from existing photos (non-interactive, parallel, resumable)
+  python enroll_student.py --bulk-dir dataset --names students.csv --workers 8
+  python enroll_student.py --bulk-csv id_cards.csv
 
 CSV Format:
   student_id,full_name,class,division
   STUD001,John Doe,10,A
   STUD002,Jane Smith,10,A
+
+Bulk CSV Format (one row per photo, or ';'-separated paths):
+  student_id,full_name,image_path
+  STUD001,John Doe,photos/stud001.jpg
+  Bulk-enrolled students must already have a profile (matched by student_id)
         """
     )
     
@@ -235,6 +301,16 @@ CSV Format:
     # Batch enrollment
     parser.add_argument('--csv', type=str, help='Path to CSV file for batch enrollment')
     
+    # Bulk enrollment from photos on disk
+    parser.add_argument('--bulk-dir', type=str, help='Dataset directory laid out as <dir>/<student_id>/*.jpg')
+    parser.add_argument('--bulk-csv', type=str, help='CSV with student_id,full_name,image_path[,profile_id UUID]')
+    parser.add_argument('--names', type=str, help='student_id,full_name CSV for --bulk-dir')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=50, help='Students per database insert (default: 50)')
+    parser.add_argument('--min-quality', type=float, default=None, help='Minimum photo quality score (default: 70)')
+    parser.add_argument('--state-file', type=str, default='bulk_enroll_state.jsonl', help='Resume checkpoint file')
+    parser.add_argument('--report', type=str, default='bulk_enroll_report.csv', help='Per-student report file')
+    
     # Camera settings
     parser.add_argument('--camera', type=int, default=0, help='Camera source index (default: 0)')
     
@@ -245,8 +321,26 @@ CSV Format:
     
     enroller = StudentEnroller()
     
+    # Bulk enrollment from disk
+    if args.bulk_dir or args.bulk_csv:
+        try:
+            results = enroller.enroll_bulk(
+                dataset_dir=args.bulk_dir,
+                csv_path=args.bulk_csv,
+                names_csv=args.names,
+                workers=args.workers,
+                batch_size=args.batch_size,
+                min_quality=args.min_quality,
+                state_path=args.state_file,
+                report_path=args.report
+            )
+        except ValueError as e:
+            print(f"\n❌ Error: {e}")
+            sys.exit(1)
+        sys.exit(0 if results["failed"] == 0 else 1)
+    
     # Batch enrollment
-    if args.csv:
+    elif args.csv:
         enroller.enroll_from_csv(args.csv, camera_source=args.camera)
     
     # Single student enrollment
@@ -262,7 +356,7 @@ CSV Format:
     
     else:
         parser.print_help()
-        print("\n❌ Error: Either provide --student-id and --name, or --csv")
+        print("\n❌ Error: Either provide --student-id and --name, --csv, or --bulk-dir/--bulk-csv")
         sys.exit(1)
 
 
@@ -0,0 +1,82 @@
+"""
+ONNX Model Export
+Writes the files used by ATTENDIFY_INFERENCE_BACKEND=onnxruntime / opencv
+
+  facenet512.onnx  DeepFace's Facenet512 Keras model, converted with tf2onnx
+                   (NCHW input so OpenCV DNN can read it too)
+  face_detection_yunet_2023mar.onnx
+                   YuNet face detector from the OpenCV model zoo
+
+Needs deepface, tensorflow and tf2onnx, but only here: the server itself
+then runs without TensorFlow.
+
+Usage:
+  python scripts/export_onnx_models.py --output-dir models
+  python verify_onnx_backend.py   # check parity afterwards
+"""
+
+import argparse
+import os
+import sys
+import urllib.request
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+YUNET_URL = "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx"
+
+
+def export_facenet(output_path: str, opset: int):
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    keras_model = DeepFace.build_model("Facenet512").model
+    height, width = keras_model.input_shape[1], keras_model.input_shape[2]
+    signature = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(
+        keras_model,
+        input_signature=signature,
+        opset=opset,
+        inputs_as_nchw=["input"],
+        output_path=output_path
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export Facenet512 and fetch YuNet as ONNX')
+    parser.add_argument('--output-dir', type=str, default='models', help='Directory for the .onnx files (default: models)')
+    parser.add_argument('--opset', type=int, default=13, help='ONNX opset (default: 13)')
+    parser.add_argument('--skip-detector', action='store_true', help='Only export Facenet512')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    facenet_path = os.path.join(args.output_dir, "facenet512.onnx")
+    print(f"⏳ Exporting Facenet512 -> {facenet_path}")
+    try:
+        export_facenet(facenet_path, args.opset)
+    except ImportError as e:
+        print(f"❌ Export needs deepface, tensorflow and tf2onnx: {e}")
+        sys.exit(1)
+    print(f"✅ Facenet512 exported ({os.path.getsize(facenet_path) / 1e6:.1f} MB)")
+
+    if not args.skip_detector:
+        yunet_path = os.path.join(args.output_dir, os.path.basename(YUNET_URL))
+        if os.path.isfile(yunet_path):
+            print(f"✅ YuNet already present: {yunet_path}")
+        else:
+            print(f"⏳ Downloading YuNet -> {yunet_path}")
+            urllib.request.urlretrieve(YUNET_URL, yunet_path)
+            print("✅ YuNet downloaded")
+
+    print("\nSet in backend/.env:")
+    print("  ATTENDIFY_INFERENCE_BACKEND=onnxruntime   # or opencv")
+    print(f"  ATTENDIFY_FACENET_ONNX={facenet_path}")
+    if not args.skip_detector:
+        print(f"  ATTENDIFY_DETECTOR_ONNX={os.path.join(args.output_dir, os.path.basename(YUNET_URL))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Re-embedding Script
+Migrates stored embeddings to a new model, detector or runtime (utils/reembedding.py)
+
+Needs database_updates_v13_embedding_versions.sql. The target defaults to
+the current ATTENDIFY_EMBEDDING_MODEL / ATTENDIFY_DETECTOR_BACKEND /
+ATTENDIFY_INFERENCE_BACKEND settings.
+
+Usage:
+  python scripts/reembed.py --status --runtime onnxruntime --detector yunet
+  python scripts/reembed.py --runtime onnxruntime --detector yunet --source auto --dataset dataset --workers 8
+  python scripts/reembed.py --runtime onnxruntime --detector yunet --cutover
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.data_access import get_supabase
+from utils.face_engine import get_face_engine, INFERENCE_BACKENDS
+from utils.reembedding import Reembedder, SOURCES
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def main():
+    engine = get_face_engine()
+    parser = argparse.ArgumentParser(description='Re-embed stored students for a new model or detector, then cut over')
+    parser.add_argument('--model', type=str, default=engine.model_name, help=f'Target model (default: {engine.model_name})')
+    parser.add_argument('--detector', type=str, default=engine.detector_backend,
+                        help=f'Target detector (default: {engine.detector_backend})')
+    parser.add_argument('--runtime', choices=INFERENCE_BACKENDS, default=engine.inference_backend,
+                        help=f'Target inference backend (default: {engine.inference_backend})')
+    parser.add_argument('--source', choices=SOURCES, default='auto',
+                        help="Photos: selfies 'bucket', local 'dataset', or 'auto' (dataset first)")
+    parser.add_argument('--dataset', type=str, default='dataset', help='Dataset directory laid out as <dir>/<student_id>/*.jpg')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=16, help='Students per worker task (default: 16)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Students per shadow table write (default: 100)')
+    parser.add_argument('--max-images', type=int, default=10, help='Photos embedded per student at most (default: 10)')
+    parser.add_argument('--report', type=str, default='reembed_report.csv', help='Per-student report file')
+    parser.add_argument('--status', action='store_true', help='Only show how many students are staged')
+    parser.add_argument('--cutover', action='store_true', help='Switch all staged students in one transaction')
+    args = parser.parse_args()
+
+    supabase = get_supabase()
+    if not supabase:
+        print("❌ Supabase not configured")
+        sys.exit(1)
+
+    try:
+        reembedder = Reembedder(
+            supabase,
+            model_name=args.model,
+            detector_backend=args.detector,
+            inference_backend=args.runtime,
+            source=args.source,
+            dataset_root=args.dataset,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            batch_size=args.batch_size,
+            max_images=args.max_images,
+            report_path=args.report
+        )
+    except ValueError as e:
+        print(f"❌ Unsupported target: {e}")
+        sys.exit(1)
+
+    if args.status:
+        print(json.dumps(reembedder.status(), indent=2))
+        return
+
+    if args.cutover:
+        try:
+            changed = reembedder.cutover()
+        except Exception as e:
+            print(f"❌ Cutover refused: {e}")
+            sys.exit(1)
+        print(f"✅ Switched to {reembedder.version}: {json.dumps(changed)}")
+        print("Restart the API with the same model settings so new enrollments and matches use it")
+        return
+
+    summary = reembedder.run()
+    sys.exit(0 if summary["failed"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
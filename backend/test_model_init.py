@@ -1,6 +1,6 @@
 import os
 import sys
-from utils.face_engine import face_engine
+from utils.face_engine import get_face_engine
 from deepface import DeepFace
 
 print("\n" + "="*50)
@@ -26,7 +26,7 @@ except Exception as e:
 
 # 3. Test Database Connection
 print("\n🔄 Checking Supabase Connection...")
-if face_engine.supabase:
+if get_face_engine().supabase:
     print("✅ Supabase Client Initialized")
 else:
     print("❌ Supabase Client Failed (Check .env)")
@@ -4,25 +4,151 @@ Intelligent attendance marking with deduplication and business logic
 """
 
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, Optional, Dict, List
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from utils.data_access import get_supabase, coalesce
+from utils.write_queue import WriteAheadQueue
+from utils.metrics import stage, MATCHES, REJECTIONS
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+ATTENDANCE_QUEUE_PATH = os.getenv("ATTENDANCE_QUEUE_PATH", "attendance_queue.sqlite3")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+# Columns that may be requested from the bulk export
+EXPORT_COLUMNS = [
+    "id", "student_id", "profile_id", "class_id", "marked_at", "confidence_score",
+    "camera_id", "frame_url", "verified", "method", "marked_by"
+]
+
+
+# Stable metric labels for the human-readable skip reasons
+_REJECTION_CODES = {
+    "Confidence too low": "low_confidence",
+    "Already marked": "already_marked",
+    "Student not enrolled": "not_enrolled",
+    "Class not currently in session": "not_in_session",
+}
+
+
+def _rejection_code(reason: str) -> str:
+    for prefix, code in _REJECTION_CODES.items():
+        if reason.startswith(prefix):
+            return code
+    return "other"
+
+
+def _in_session(schedule: Optional[Dict], now: datetime) -> bool:
+    """True if now falls in one of the day's "HH:MM-HH:MM" slots"""
+    day_schedule = (schedule or {}).get(now.strftime("%A").lower(), [])
+    current_time = now.strftime("%H:%M")
+    for time_slot in day_schedule:
+        if "-" in time_slot:
+            start_time, end_time = time_slot.split("-")
+            if start_time <= current_time <= end_time:
+                return True
+    return False
 
 
 class AttendanceMarker:
     def __init__(self):
         """Initialize attendance marker"""
-        self.supabase = supabase
         self.min_confidence = 0.70  # Minimum confidence to auto-mark (70%)
         self.dedup_window_hours = 1  # Don't mark same student twice within 1 hour
+        self.write_queue: Optional[WriteAheadQueue] = None
+        self.camera_cache_seconds = 60  # How long a camera's class list is reused
+        self._camera_classes: Dict[str, tuple] = {}
+        self._camera_lock = threading.Lock()
+    
+    @property
+    def supabase(self):
+        """Shared Supabase client, created on first use (see utils/data_access.py)"""
+        return get_supabase()
+        
+    def _get_write_queue(self) -> WriteAheadQueue:
+        """Open the local write-ahead queue and start its flusher (once)"""
+        if self.write_queue is None:
+            with self._camera_lock:
+                if self.write_queue is None:
+                    queue = WriteAheadQueue(
+                        ATTENDANCE_QUEUE_PATH,
+                        flush_fn=self._flush_attendance_batch,
+                        batch_size=int(os.getenv("ATTENDANCE_QUEUE_BATCH_SIZE", "100")),
+                        flush_interval=float(os.getenv("ATTENDANCE_QUEUE_FLUSH_INTERVAL", "1.0")),
+                        name="attendance_logs",
+                        lookup_fn=lambda record: record["student_id"]
+                    )
+                    queue.start()
+                    self.write_queue = queue
+        return self.write_queue
+    
+    def start(self):
+        """
+        Open the queue at startup, so marks spooled before a restart are
+        flushed, and seen by deduplication, before the next mark arrives
+        """
+        self._get_write_queue()
+    
+    def _flush_attendance_batch(self, records: List[Dict]):
+        """
+        Write a batch of queued attendance records to Supabase
+        
+        The upsert ignores rows whose idempotency_key already exists, so a
+        batch that is retried after a partial failure never duplicates marks.
+        Rows it ignores are counted as duplicate_mark rejections.
+        
+        Args:
+            records: attendance_logs rows, each carrying an idempotency_key
+        """
+        with stage("db_write"):
+            response = self.supabase.table("attendance_logs").upsert(
+                records,
+                on_conflict="idempotency_key",
+                ignore_duplicates=True
+            ).execute()
+        
+        # Only inserted rows come back
+        written = {row.get("idempotency_key") for row in (response.data or [])}
+        for record in records:
+            if record["idempotency_key"] in written:
+                self._update_stats(record["camera_id"], success=True, confidence=record["confidence_score"])
+            else:
+                REJECTIONS.inc(reason="duplicate_mark")
+    
+    def _is_pending_in_queue(
+        self,
+        student_id: str,
+        class_id: Optional[str],
+        threshold_time: datetime
+    ) -> bool:
+        """Check marks accepted locally but not yet flushed to Supabase"""
+        threshold = threshold_time.isoformat()
+        for record in self._get_write_queue().pending_for(student_id):
+            if class_id and record.get("class_id") != class_id:
+                continue
+            if record["marked_at"] >= threshold:
+                return True
+        return False
+    
+    def queue_stats(self) -> Dict:
+        """
+        Get write-ahead queue depth and flush lag
+        
+        Returns:
+            Dictionary of queue metrics (empty queue if never used)
+        """
+        if self.write_queue is None:
+            return {"name": "attendance_logs", "depth": 0, "flush_lag_seconds": 0.0, "dead_letters": 0,
+                    "flusher_running": False}
+        return self.write_queue.stats()
+    
+    def close(self):
+        """Stop the background flusher after a final drain attempt"""
+        if self.write_queue is not None:
+            self.write_queue.stop()
         
     def is_already_marked(
         self, 
@@ -46,7 +172,11 @@ class AttendanceMarker:
         
         try:
             # Calculate time threshold
-            threshold_time = datetime.now() - timedelta(hours=window_hours)
+            threshold_time = datetime.now(timezone.utc) - timedelta(hours=window_hours)
+            
+            # Marks still waiting in the local queue are not in the database yet
+            if self._is_pending_in_queue(student_id, class_id, threshold_time):
+                return True
             
             query = self.supabase.table("attendance_logs").select("*").eq("student_id", student_id)
             
@@ -55,7 +185,8 @@ class AttendanceMarker:
             
             query = query.gte("marked_at", threshold_time.isoformat())
             
-            result = query.execute()
+            with stage("db_dedup"):
+                result = query.execute()
             
             return len(result.data) > 0
             
@@ -78,37 +209,95 @@ class AttendanceMarker:
         
         try:
             # Get class schedule
-            result = self.supabase.table("classes").select("schedule").eq("id", class_id).execute()
+            # Many cameras ask about the same class at once; share one request
+            with stage("db_schedule"):
+                result = coalesce(
+                    ("classes.schedule", class_id),
+                    lambda: self.supabase.table("classes").select("schedule").eq("id", class_id).execute()
+                )
             
             if not result.data:
                 return True  # If class not found, allow marking
             
             schedule = result.data[0].get("schedule", {})
+            if schedule is None:
+                return True  # No schedule configured, allow marking
             
-            # Get current day and time
-            now = datetime.now()
-            day_name = now.strftime("%A").lower()  # monday, tuesday, etc.
-            current_time = now.strftime("%H:%M")
-            
-            # Check if current day has classes
-            day_schedule = schedule.get(day_name, [])
-            
-            if not day_schedule:
-                return False  # No classes on this day
-            
-            # Check if current time falls within any class period
-            for time_slot in day_schedule:
-                if "-" in time_slot:
-                    start_time, end_time = time_slot.split("-")
-                    if start_time <= current_time <= end_time:
-                        return True
-            
-            return False
+            # Check if current time falls within any class period today
+            return _in_session(schedule, datetime.now())
             
         except Exception as e:
             print(f"Error checking class schedule: {e}")
             return True  # Default to allowing marking
     
+    def resolve_class(self, camera_id: str) -> Optional[str]:
+        """
+        Find the class in session in front of a camera (classes.camera_id, v11)
+        
+        A camera's classes are cached for camera_cache_seconds; the schedule
+        is evaluated on every call.
+        
+        Args:
+            camera_id: Camera identifier
+            
+        Returns:
+            class_id of the class in session, or None
+        """
+        if not self.supabase or not camera_id:
+            return None
+        
+        with self._camera_lock:
+            cached = self._camera_classes.get(camera_id)
+        if cached is None or time.monotonic() - cached[0] > self.camera_cache_seconds:
+            try:
+                with stage("db_schedule"):
+                    result = coalesce(
+                        ("classes.camera", camera_id),
+                        lambda: self.supabase.table("classes")
+                            .select("id, schedule")
+                            .eq("camera_id", camera_id)
+                            .execute()
+                    )
+            except Exception as e:
+                print(f"Error resolving class for camera {camera_id}: {e}")
+                return None
+            cached = (time.monotonic(), result.data or [])
+            with self._camera_lock:
+                self._camera_classes[camera_id] = cached
+        
+        now = datetime.now()
+        for row in cached[1]:
+            if _in_session(row.get("schedule"), now):
+                return str(row["id"])
+        return None
+    
+    def get_class_roster(self, class_id: str) -> List[str]:
+        """
+        Student IDs enrolled in a class
+        
+        Args:
+            class_id: Class ID
+            
+        Returns:
+            List of student IDs (empty if unknown or on error)
+        """
+        if not self.supabase:
+            return []
+        
+        try:
+            with stage("db_enrollment"):
+                result = coalesce(
+                    ("class_enrollments.roster", class_id),
+                    lambda: self.supabase.table("class_enrollments")
+                        .select("student_id")
+                        .eq("class_id", class_id)
+                        .execute()
+                )
+            return [row["student_id"] for row in result.data or []]
+        except Exception as e:
+            print(f"Error loading roster for class {class_id}: {e}")
+            return []
+    
     def is_student_enrolled(self, student_id: str, class_id: str) -> bool:
         """
         Check if student is enrolled in the class
@@ -124,11 +313,16 @@ class AttendanceMarker:
             return True  # Assume yes if can't check
         
         try:
-            result = self.supabase.table("class_enrollments")\
-                .select("*")\
-                .eq("student_id", student_id)\
-                .eq("class_id", class_id)\
-                .execute()
+            with stage("db_enrollment"):
+                result = coalesce(
+                    ("class_enrollments", student_id, class_id),
+                    lambda: self.supabase.table("class_enrollments")
+                        .select("id")
+                        .eq("student_id", student_id)
+                        .eq("class_id", class_id)
+                        .limit(1)
+                        .execute()
+                )
             
             return len(result.data) > 0
             
@@ -155,20 +349,24 @@ class AttendanceMarker:
         """
         # Check confidence
         if confidence < self.min_confidence:
+            REJECTIONS.inc(reason="low_confidence")
             return False, f"Confidence too low ({confidence:.0%} < {self.min_confidence:.0%})"
         
         # Check if already marked
         if self.is_already_marked(student_id, class_id, self.dedup_window_hours):
+            REJECTIONS.inc(reason="already_marked")
             return False, f"Already marked within last {self.dedup_window_hours} hour(s)"
         
         # If class_id provided, check class-specific rules
         if class_id:
             # Check if student is enrolled
             if not self.is_student_enrolled(student_id, class_id):
+                REJECTIONS.inc(reason="not_enrolled")
                 return False, "Student not enrolled in this class"
             
             # Check if class is in session
             if not self.is_class_in_session(class_id):
+                REJECTIONS.inc(reason="not_in_session")
                 return False, "Class not currently in session"
         
         return True, "OK"
@@ -212,9 +410,23 @@ class AttendanceMarker:
             
             # Determine if needs verification
             verified = confidence >= 0.85  # Auto-verify if confidence > 85%
-            
-            # Insert attendance record
+            now = datetime.now(timezone.utc)
+            marked_at = now.isoformat()
+            
+            # One key per student, class and dedup window: a repeated mark
+            # (another camera, a retry, a restart) within the window maps to
+            # the same row and is dropped. should_mark_attendance only lets a
+            # mark through once the previous one is a full window old, which
+            # always falls in an earlier bucket.
+            window_seconds = self.dedup_window_hours * 3600
+            idempotency_key = str(uuid.uuid5(
+                uuid.NAMESPACE_URL,
+                f"attendance:{student_id}:{class_id}:{window_seconds}:{int(now.timestamp() // window_seconds)}"
+            ))
+            
+            # Queue attendance record; the background flusher inserts it
             data = {
+                "idempotency_key": idempotency_key,
                 "student_id": student_id,
                 "profile_id": profile_id,
                 "class_id": class_id,
@@ -222,21 +434,26 @@ class AttendanceMarker:
                 "camera_id": camera_id,
                 "frame_url": frame_url,
                 "verified": verified,
-                "method": "face_recognition"
+                "method": "face_recognition",
+                "marked_at": marked_at
             }
             
-            result = self.supabase.table("attendance_logs").insert(data).execute()
-            
-            # Update recognition stats
-            self._update_stats(camera_id, success=True, confidence=confidence)
+            if not self._get_write_queue().enqueue(idempotency_key, data):
+                REJECTIONS.inc(reason="already_marked")
+                return {
+                    "status": "skipped",
+                    "reason": f"Already marked within last {self.dedup_window_hours} hour(s)",
+                    "student_id": student_id
+                }
             
             return {
                 "status": "success",
                 "student_id": student_id,
                 "confidence": confidence,
                 "verified": verified,
-                "marked_at": datetime.now().isoformat(),
-                "record_id": result.data[0]["id"] if result.data else None
+                "marked_at": marked_at,
+                "queued": True,
+                "idempotency_key": idempotency_key
             }
             
         except Exception as e:
@@ -283,6 +500,59 @@ class AttendanceMarker:
         
         return results
     
+    def recognize_and_mark(
+        self,
+        embeddings: List[List[float]],
+        class_id: Optional[str] = None,
+        camera_id: str = "cctv_main",
+        match_threshold: float = 0.4
+    ) -> List[Dict]:
+        """
+        Match, dedup, check enrollment/schedule and mark a batch of faces
+        in one server-side transaction (recognize_and_mark RPC)
+        
+        Args:
+            embeddings: One 512-d embedding per detected face
+            class_id: Optional class ID
+            camera_id: Camera identifier
+            match_threshold: Minimum cosine similarity to count as a match
+            
+        Returns:
+            One outcome per face with face_index, student_id, similarity,
+            status ('success', 'skipped', 'no_match') and reason
+        """
+        if not self.supabase:
+            return [{"error": "Database not configured"}]
+        
+        if not embeddings:
+            return []
+        
+        try:
+            with stage("rpc_recognize_and_mark"):
+                result = self.supabase.rpc("recognize_and_mark", {
+                    "query_embeddings": [list(map(float, e)) for e in embeddings],
+                    "p_camera_id": camera_id,
+                    "p_class_id": class_id,
+                    "match_threshold": match_threshold,
+                    "min_confidence": self.min_confidence,
+                    "verify_confidence": 0.85,
+                    "dedup_window_hours": self.dedup_window_hours
+                }).execute()
+            
+            outcomes = result.data or []
+            for outcome in outcomes:
+                if outcome.get("status") == "no_match":
+                    REJECTIONS.inc(reason="no_match")
+                    continue
+                MATCHES.inc()
+                if outcome.get("status") == "skipped":
+                    REJECTIONS.inc(reason=_rejection_code(outcome.get("reason", "")))
+            return outcomes
+            
+        except Exception as e:
+            print(f"Error in recognize_and_mark: {e}")
+            return [{"error": str(e)}]
+    
     def _update_stats(
         self, 
         camera_id: str, 
@@ -380,6 +650,89 @@ class AttendanceMarker:
             print(f"Error getting attendance: {e}")
             return []
 
+    
+    def get_attendance_summary(
+        self,
+        start_date: date,
+        end_date: Optional[date] = None,
+        class_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Get per-class, per-day attendance summaries computed in the database
+        (get_attendance_summary, built on get_attendance_stats)
+        
+        Args:
+            start_date: First day (inclusive)
+            end_date: Last day (inclusive), defaults to start_date
+            class_id: Optional class ID; all classes if omitted
+            
+        Returns:
+            List of summary rows (class_id, day, totals and percentage)
+        """
+        if not self.supabase:
+            return []
+        
+        try:
+            result = self.supabase.rpc("get_attendance_summary", {
+                "p_start": start_date.isoformat(),
+                "p_end": (end_date or start_date).isoformat(),
+                "p_class_id": class_id
+            }).execute()
+            return result.data or []
+            
+        except Exception as e:
+            print(f"Error getting attendance summary: {e}")
+            return []
+    
+    def iter_attendance(
+        self,
+        start_date: date,
+        end_date: date,
+        class_id: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        page_size: int = 1000
+    ) -> Iterator[Dict]:
+        """
+        Stream attendance records for a date range, one keyset page at a time
+        
+        Memory use is bounded by page_size regardless of the range size.
+        
+        Args:
+            start_date: First day (inclusive)
+            end_date: Last day (inclusive)
+            class_id: Optional class ID to filter by
+            columns: Columns to project (subset of EXPORT_COLUMNS), all if None
+            page_size: Rows fetched per round trip
+            
+        Yields:
+            Attendance records ordered by (marked_at, id)
+        """
+        if not self.supabase:
+            return
+        
+        columns = columns or EXPORT_COLUMNS
+        params = {
+            "p_start": start_date.isoformat(),
+            "p_end": (end_date + timedelta(days=1)).isoformat(),
+            "p_class_id": class_id,
+            "p_after_marked_at": None,
+            "p_after_id": None,
+            "p_limit": page_size
+        }
+        
+        while True:
+            with stage("db_export_page"):
+                page = self.supabase.rpc("export_attendance_page", params).execute().data or []
+            
+            for row in page:
+                yield {column: row.get(column) for column in columns}
+            
+            if len(page) < page_size:
+                break
+            
+            params["p_after_marked_at"] = page[-1]["marked_at"]
+            params["p_after_id"] = page[-1]["id"]
+
 
 # Create singleton instance
 attendance_marker = AttendanceMarker()
@@ -0,0 +1,437 @@
+"""
+Bulk Enrollment
+Non-interactive, parallel, resumable enrollment from photos already on disk
+"""
+
+import csv
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Namespace for enrollment ids, so re-runs produce the same ones
+_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "attendify/bulk-enrollment")
+
+# Per-process state for pool workers (models load once per worker)
+_worker_builder = None
+_worker_engine = None
+_worker_min_quality = None
+
+# Student ids per profiles lookup
+_LOOKUP_CHUNK = 500
+
+
+def lookup_profile_ids(supabase, student_ids: List[str]) -> Dict[str, str]:
+    """
+    Map student ids to the ids of their existing profiles
+
+    profiles.id references auth.users, so a profile (and its account) has to
+    exist before a student can be enrolled; students without one are left
+    out of the mapping.
+    """
+    found = {}
+    student_ids = list(dict.fromkeys(student_ids))
+    for i in range(0, len(student_ids), _LOOKUP_CHUNK):
+        response = supabase.table("profiles").select("id, student_id")\
+            .in_("student_id", student_ids[i:i + _LOOKUP_CHUNK]).execute()
+        for row in response.data or []:
+            found[row["student_id"]] = row["id"]
+    return found
+
+
+def _init_worker(dataset_root: str, min_quality: Optional[float]):
+    global _worker_builder, _worker_engine, _worker_min_quality
+    from utils.dataset_builder import DatasetBuilder
+    from utils.face_engine import get_face_engine
+
+    _worker_builder = DatasetBuilder(dataset_root)
+    _worker_engine = get_face_engine()
+    _worker_min_quality = min_quality
+
+
+def _process_student(task: Dict) -> Dict:
+    """
+    Quality-check and embed one student's photos (runs in a pool worker)
+
+    Args:
+        task: {"student_id", "full_name", "profile_id", "images": [paths]}
+
+    Returns:
+        Result dictionary with status 'success' or 'failed', the templates
+        and centroid on success, and per-photo counts and timing
+    """
+    import cv2
+
+    start = time.perf_counter()
+    result = {
+        "student_id": task["student_id"],
+        "full_name": task["full_name"],
+        "profile_id": task["profile_id"],
+        "photos": len(task["images"]),
+        "accepted": 0,
+        "status": "failed",
+        "error": None
+    }
+
+    try:
+        accepted = []
+        for path in task["images"]:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            verdict = _worker_builder.assess_photo_quality(frame)
+            threshold = _worker_min_quality if _worker_min_quality is not None else _worker_builder.min_quality_score
+            if verdict["face_box"] and verdict["quality_score"] >= threshold:
+                accepted.append((verdict["quality_score"], frame))
+
+        if not accepted:
+            result["error"] = "No photo passed the quality check"
+            return result
+
+        # Best photo first; it becomes the representative image
+        accepted.sort(key=lambda pair: pair[0], reverse=True)
+        frames = [frame for _, frame in accepted]
+        templates = [t for t in _worker_engine.get_embeddings_batch(frames) if t is not None]
+
+        if not templates:
+            result["error"] = "Face not detected in any accepted photo"
+            return result
+
+        result.update({
+            "status": "success",
+            "accepted": len(templates),
+            "templates": [list(map(float, t)) for t in templates],
+            "centroid": _worker_engine.compute_centroid(templates),
+            "embedding_version": _worker_engine.embedding_version
+        })
+        # Same student, photos and model -> same key, so a retried or resumed
+        # batch never creates a second pending record
+        result["enrollment_id"] = str(uuid.uuid5(_ID_NAMESPACE, json.dumps(
+            [task["student_id"], result["embedding_version"], sorted(task["images"])]
+        )))
+        return result
+
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    finally:
+        result["seconds"] = round(time.perf_counter() - start, 3)
+
+
+def tasks_from_directory(dataset_root: str, names: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """
+    Build tasks from a dataset laid out as <dataset_root>/<student_id>/*.jpg
+
+    Args:
+        dataset_root: Root directory (same layout as DatasetBuilder.dataset_root)
+        names: Optional student_id -> full_name mapping
+    """
+    names = names or {}
+    tasks = []
+    for student_dir in sorted(Path(dataset_root).iterdir()):
+        if not student_dir.is_dir():
+            continue
+        images = sorted(str(p) for p in student_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if not images:
+            continue
+        student_id = student_dir.name
+        tasks.append({
+            "student_id": student_id,
+            "full_name": names.get(student_id, student_id),
+            "profile_id": None,
+            "images": images
+        })
+    return tasks
+
+
+def tasks_from_csv(csv_path: str) -> List[Dict]:
+    """
+    Build tasks from a CSV with image paths
+
+    CSV Format (one row per photo, or several paths separated by ';'):
+    student_id,full_name,image_path[,profile_id]
+    STUD001,John Doe,photos/stud001_id_card.jpg
+
+    profile_id is optional; when given it must be the student's profiles.id
+    (a UUID) and is checked against the profile found by student_id.
+
+    Raises:
+        ValueError: If a profile_id is not a UUID
+    """
+    by_student: Dict[str, Dict] = {}
+    base = Path(csv_path).parent
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            student_id = (row.get('student_id') or '').strip()
+            if not student_id:
+                continue
+            task = by_student.get(student_id)
+            if task is None:
+                profile_id = (row.get('profile_id') or '').strip()
+                if profile_id:
+                    try:
+                        profile_id = str(uuid.UUID(profile_id))
+                    except ValueError:
+                        raise ValueError(f"{csv_path}: profile_id {profile_id!r} of {student_id} is not a UUID")
+                task = by_student[student_id] = {
+                    "student_id": student_id,
+                    "full_name": (row.get('full_name') or student_id).strip(),
+                    "profile_id": profile_id or None,
+                    "images": []
+                }
+            for path in (row.get('image_path') or '').split(';'):
+                path = path.strip()
+                if path:
+                    task["images"].append(str(path if os.path.isabs(path) else base / path))
+    return list(by_student.values())
+
+
+def load_names(csv_path: Optional[str]) -> Dict[str, str]:
+    """Read a student_id,full_name CSV into a mapping"""
+    if not csv_path:
+        return {}
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        return {
+            row['student_id'].strip(): row.get('full_name', '').strip() or row['student_id'].strip()
+            for row in csv.DictReader(f) if row.get('student_id')
+        }
+
+
+class BulkEnroller:
+    def __init__(
+        self,
+        supabase=None,
+        state_path: str = "bulk_enroll_state.jsonl",
+        report_path: str = "bulk_enroll_report.csv",
+        workers: Optional[int] = None,
+        batch_size: int = 50,
+        min_quality: Optional[float] = None,
+        dataset_root: str = "dataset"
+    ):
+        """
+        Initialize bulk enroller
+
+        Args:
+            supabase: Supabase client used for batched pending_approvals writes
+            state_path: JSONL checkpoint of students already written (for resume)
+            report_path: Per-student CSV report
+            workers: Process pool size (default: CPU count)
+            batch_size: Students per pending_approvals insert
+            min_quality: Override DatasetBuilder.min_quality_score
+            dataset_root: Passed to DatasetBuilder in workers
+        """
+        self.supabase = supabase
+        self.state_path = state_path
+        self.report_path = report_path
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.min_quality = min_quality
+        self.dataset_root = dataset_root
+
+    def _completed_students(self) -> set:
+        done = set()
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    if entry.get("status") == "success":
+                        done.add(entry["student_id"])
+        return done
+
+    def _checkpoint(self, results: List[Dict]):
+        with open(self.state_path, 'a', encoding='utf-8') as f:
+            for r in results:
+                f.write(json.dumps({"student_id": r["student_id"], "status": r["status"],
+                                    "error": r.get("error"), "at": time.time()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _resolve_profiles(self, tasks: List[Dict]) -> List[Dict]:
+        """
+        Fill in each task's profile_id from the existing profiles
+
+        Returns:
+            Failed results for students without a (matching) profile; they
+            are not enrolled, and a later run retries them
+        """
+        if self.supabase is None:
+            raise RuntimeError("Supabase not configured")
+
+        found = lookup_profile_ids(self.supabase, [t["student_id"] for t in tasks])
+        missing = []
+        for task in tasks:
+            profile_id = found.get(task["student_id"])
+            if profile_id is None:
+                error = "No profile with this student_id - create the student's account first"
+            elif task["profile_id"] and task["profile_id"] != profile_id:
+                error = f"profile_id {task['profile_id']} does not belong to this student_id"
+            else:
+                task["profile_id"] = profile_id
+                continue
+            missing.append({
+                "student_id": task["student_id"],
+                "full_name": task["full_name"],
+                "profile_id": task["profile_id"],
+                "photos": len(task["images"]),
+                "accepted": 0,
+                "status": "failed",
+                "error": error,
+                "seconds": 0.0
+            })
+        return missing
+
+    def _write_batch(self, batch: List[Dict]):
+        """
+        Write a batch of successful students in two round trips
+
+        Profiles are never created here (see _resolve_profiles). Both steps
+        are idempotent (pending_approvals is upserted on its enrollment_id),
+        so a batch that fails part way can simply be retried.
+        """
+        if not batch:
+            return
+        if self.supabase is None:
+            raise RuntimeError("Supabase not configured")
+
+        self.supabase.table("pending_approvals").upsert([
+            {
+                "enrollment_id": r["enrollment_id"],
+                "profile_id": r["profile_id"],
+                "student_id": r["student_id"],
+                "full_name": r["full_name"],
+                "embedding": r["centroid"],
+                "templates": r["templates"],
+                "embedding_version": r["embedding_version"],
+                "status": "pending"
+            }
+            for r in batch
+        ], on_conflict="enrollment_id", ignore_duplicates=True).execute()
+
+        self.supabase.table("profiles").update({"face_enrolled": True})\
+            .in_("id", [r["profile_id"] for r in batch]).execute()
+
+    def run(self, tasks: List[Dict]) -> Dict:
+        """
+        Enroll all tasks across a process pool
+
+        Students already recorded as successful in the state file are skipped,
+        so an interrupted run can simply be started again. Students without
+        an existing profile are reported as failed without being processed.
+
+        Returns:
+            Summary with counts, failures and throughput
+        """
+        done = self._completed_students()
+        pending = [t for t in tasks if t["student_id"] not in done]
+        no_profile = self._resolve_profiles(pending)
+        if no_profile:
+            unresolved = {r["student_id"] for r in no_profile}
+            pending = [t for t in pending if t["student_id"] not in unresolved]
+
+        summary = {
+            "total": len(tasks),
+            "skipped": len(tasks) - len(pending),
+            "success": 0,
+            "failed": 0,
+            "photos": 0,
+            "failed_students": []
+        }
+
+        print(f"\n{'='*70}")
+        print(f"BULK ENROLLMENT")
+        print(f"{'='*70}")
+        print(f"Students: {len(tasks)} ({summary['skipped']} already enrolled, {len(pending)} to process)")
+        if no_profile:
+            print(f"⚠️  {len(no_profile)} student(s) have no profile and are skipped (see report)")
+        print(f"Workers: {self.workers} | Batch size: {self.batch_size}")
+        print(f"{'='*70}\n")
+
+        new_report = not os.path.exists(self.report_path)
+        report_file = open(self.report_path, 'a', newline='', encoding='utf-8')
+        report = csv.writer(report_file)
+        if new_report:
+            report.writerow(["student_id", "full_name", "status", "photos", "accepted", "seconds", "error"])
+
+        start = time.perf_counter()
+        batch: List[Dict] = []
+
+        def record(results: List[Dict]):
+            for r in results:
+                report.writerow([r["student_id"], r["full_name"], r["status"], r["photos"],
+                                 r["accepted"], r["seconds"], r.get("error") or ""])
+                if r["status"] == "success":
+                    summary["success"] += 1
+                else:
+                    summary["failed"] += 1
+                    summary["failed_students"].append(r["student_id"])
+            self._checkpoint(results)
+            report_file.flush()
+
+        def flush_batch():
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                for r in batch:
+                    r["status"], r["error"] = "failed", f"Database error: {e}"
+            record(batch)
+            batch.clear()
+
+        if no_profile:
+            record(no_profile)
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.dataset_root, self.min_quality)
+            ) as pool:
+                futures = [pool.submit(_process_student, task) for task in pending]
+
+                for idx, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    summary["photos"] += result["photos"]
+
+                    if result["status"] == "success":
+                        batch.append(result)
+                        if len(batch) >= self.batch_size:
+                            flush_batch()
+                    else:
+                        # Failures need no database write; record them right away
+                        record([result])
+
+                    if idx % 10 == 0 or idx == len(pending):
+                        elapsed = time.perf_counter() - start
+                        print(f"[{idx}/{len(pending)}] {idx / elapsed:.1f} students/s")
+
+                flush_batch()
+
+        except KeyboardInterrupt:
+            print("\n\n⚠️  Bulk enrollment interrupted - completed batches are saved, re-run to resume")
+        finally:
+            report_file.close()
+
+        elapsed = time.perf_counter() - start
+        summary["elapsed_seconds"] = round(elapsed, 2)
+        summary["students_per_second"] = round((summary["success"] + summary["failed"]) / elapsed, 2) if elapsed else 0
+        summary["photos_per_second"] = round(summary["photos"] / elapsed, 2) if elapsed else 0
+
+        print(f"\n{'='*70}")
+        print(f"BULK ENROLLMENT COMPLETE")
+        print(f"{'='*70}")
+        print(f"✅ Successful: {summary['success']}")
+        print(f"❌ Failed: {summary['failed']}")
+        print(f"⏭️  Skipped (already enrolled): {summary['skipped']}")
+        print(f"⏱️  {summary['elapsed_seconds']}s | {summary['students_per_second']} students/s | {summary['photos_per_second']} photos/s")
+        print(f"Report: {self.report_path}")
+        print(f"{'='*70}\n")
+
+        return summary
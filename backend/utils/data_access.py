@@ -0,0 +1,619 @@
+"""
+Data Access Layer
+Shared pooled Supabase client, request coalescing and an in-memory stand-in backend
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from utils.profiler import profiled
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# 'supabase' (default) or 'memory' for load tests and CI without a database
+DATA_BACKEND = os.getenv("ATTENDIFY_DATA_BACKEND", "supabase")
+POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "20"))
+CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+REQUEST_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "30"))
+# JSON file of {table: [rows]} loaded into the memory backend at startup
+MEMORY_SEED = os.getenv("ATTENDIFY_MEMORY_SEED")
+
+_client = None
+_client_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _http_settings():
+    import httpx
+    limits = httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+    timeout = httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+    return limits, timeout
+
+
+def _create_supabase_client():
+    import httpx
+    from supabase import create_client
+    try:
+        from supabase.lib.client_options import SyncClientOptions as Options
+    except ImportError:
+        from supabase.lib.client_options import ClientOptions as Options
+
+    limits, timeout = _http_settings()
+    try:
+        # Newer supabase-py lets every sub-client share one keep-alive pool
+        options = Options(
+            httpx_client=httpx.Client(limits=limits, timeout=timeout),
+            postgrest_client_timeout=REQUEST_TIMEOUT,
+            storage_client_timeout=int(REQUEST_TIMEOUT)
+        )
+    except TypeError:
+        options = Options(
+            postgrest_client_timeout=REQUEST_TIMEOUT,
+            storage_client_timeout=int(REQUEST_TIMEOUT)
+        )
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+
+
+def get_supabase():
+    """
+    Get the process-wide Supabase client
+
+    Returns:
+        A shared Supabase client, the in-memory stand-in when
+        ATTENDIFY_DATA_BACKEND=memory, or None if not configured
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if DATA_BACKEND == "memory":
+                    _client = MemoryClient()
+                    if MEMORY_SEED:
+                        _client.load_seed(MEMORY_SEED)
+                elif SUPABASE_URL and SUPABASE_KEY:
+                    _client = _create_supabase_client()
+    return _client
+
+
+async def run_blocking(fn: Callable, *args, **kwargs):
+    """
+    Run a blocking call (model inference, sync Supabase I/O) off the event loop
+
+    Uses a bounded thread pool sized like the HTTP connection pool and
+    carries the caller's context (e.g. Server-Timing collection, an active
+    request profile) along. Handlers reach the database this way rather
+    than through an async client, so model inference and queries share one
+    pool and coalesce() works across threads.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="attendify-io")
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    # profiled() is a pass-through unless the request is being profiled (utils/profiler.py)
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, profiled, fn, *args, **kwargs))
+
+
+# --- Request coalescing ---
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+_inflight: Dict[Any, _InFlight] = {}
+_inflight_lock = threading.Lock()
+
+
+def coalesce(key, fn: Callable[[], Any]):
+    """
+    Share one in-flight call among concurrent identical reads
+
+    The first caller for a key runs fn; callers arriving while it is in
+    flight wait and receive the same result (or exception). Nothing is
+    cached once the call completes.
+
+    Args:
+        key: Hashable identity of the read, e.g. ("classes.schedule", class_id)
+        fn: Zero-argument callable performing the read
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _InFlight()
+
+    if not leader:
+        call.done.wait()
+        if call.error:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fn()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+
+# --- In-memory stand-in backend ---
+
+class _Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+        self.error = None
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat()
+
+
+def _comparable(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+# Column defaults applied on insert, mirroring the SQL schema
+_DEFAULTS = {
+    "attendance_logs": {"marked_at": _now_iso, "camera_id": lambda: "cctv_main",
+                        "verified": lambda: False, "method": lambda: "face_recognition"},
+    "pending_approvals": {"status": lambda: "pending", "created_at": _now_iso},
+    "active_embeddings": {"created_at": _now_iso, "updated_at": _now_iso},
+    "profiles": {"is_active": lambda: False, "face_enrolled": lambda: False,
+                 "role": lambda: "student", "created_at": _now_iso},
+}
+
+# Trigger emulation (database_updates_v12_embedding_changes.sql):
+# columns stamped on update, and tables whose deleted rows leave a tombstone
+_ON_UPDATE = {
+    "active_embeddings": {"updated_at": _now_iso},
+}
+_TOMBSTONES = {
+    "active_embeddings": ("active_embeddings_tombstones", ("id", "student_id", "profile_id")),
+}
+
+
+class _MemoryQuery:
+    def __init__(self, client: "MemoryClient", table: str):
+        self._client = client
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._payload = None
+        self._filters: List[Callable[[Dict], bool]] = []
+        self._order: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._single = False
+        self._on_conflict: Optional[str] = None
+        self._ignore_duplicates = False
+
+    # Operations
+    def select(self, columns: str = "*", count=None):
+        self._op, self._columns = "select", columns
+        return self
+
+    def insert(self, rows):
+        self._op, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, ignore_duplicates: bool = False):
+        self._op, self._payload = "upsert", rows
+        self._on_conflict, self._ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values: Dict):
+        self._op, self._payload = "update", values
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    # Filters
+    def _add(self, column, predicate):
+        self._filters.append(lambda row: predicate(_comparable(row.get(column))))
+        return self
+
+    def eq(self, column, value):
+        return self._add(column, lambda v: v is not None and str(v) == str(value))
+
+    def neq(self, column, value):
+        return self._add(column, lambda v: v is not None and str(v) != str(value))
+
+    def gt(self, column, value):
+        return self._add(column, lambda v: v is not None and v > _comparable(value))
+
+    def gte(self, column, value):
+        return self._add(column, lambda v: v is not None and v >= _comparable(value))
+
+    def lt(self, column, value):
+        return self._add(column, lambda v: v is not None and v < _comparable(value))
+
+    def lte(self, column, value):
+        return self._add(column, lambda v: v is not None and v <= _comparable(value))
+
+    def in_(self, column, values):
+        wanted = {str(v) for v in values}
+        return self._add(column, lambda v: str(v) in wanted)
+
+    def is_(self, column, value):
+        expected = None if value in (None, "null") else value
+        return self._add(column, lambda v: v is expected or v == expected)
+
+    # Modifiers
+    def order(self, column, desc: bool = False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        return self.single()
+
+    def _project(self, row: Dict) -> Dict:
+        if self._columns.strip() == "*":
+            return dict(row)
+        columns = [c.strip() for c in self._columns.split(",")]
+        return {c: row.get(c) for c in columns}
+
+    def _matching(self, rows):
+        return [row for row in rows if all(f(row) for f in self._filters)]
+
+    def _run(self):
+        with self._client.lock:
+            rows = self._client.tables.setdefault(self._table, [])
+
+            if self._op in ("insert", "upsert"):
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                written = []
+                for record in payload:
+                    record = dict(record)
+                    if self._op == "upsert" and self._on_conflict:
+                        keys = [k.strip() for k in self._on_conflict.split(",")]
+                        existing = next((r for r in rows if all(r.get(k) == record.get(k) for k in keys)), None)
+                        if existing is not None:
+                            if not self._ignore_duplicates:
+                                existing.update(record)
+                                written.append(dict(existing))
+                            continue
+                    record.setdefault("id", str(uuid.uuid4()))
+                    for column, default in _DEFAULTS.get(self._table, {}).items():
+                        if record.get(column) is None:
+                            record[column] = default()
+                    rows.append(record)
+                    written.append(dict(record))
+                return _Response(written)
+
+            matched = self._matching(rows)
+
+            if self._op == "update":
+                for row in matched:
+                    row.update(self._payload)
+                    for column, stamp in _ON_UPDATE.get(self._table, {}).items():
+                        row[column] = stamp()
+                return _Response([dict(r) for r in matched])
+
+            if self._op == "delete":
+                removed = {id(r) for r in matched}
+                self._client.tables[self._table] = [r for r in rows if id(r) not in removed]
+                if self._table in _TOMBSTONES:
+                    table, columns = _TOMBSTONES[self._table]
+                    self._client.tables.setdefault(table, []).extend(
+                        {**{c: r.get(c) for c in columns}, "deleted_at": _now_iso()} for r in matched
+                    )
+                return _Response([dict(r) for r in matched])
+
+            for column, desc in reversed(self._order):
+                matched.sort(key=lambda r: (r.get(column) is None, _comparable(r.get(column))), reverse=desc)
+            if self._offset:
+                matched = matched[self._offset:]
+            if self._limit is not None:
+                matched = matched[:self._limit]
+
+            data = [self._project(r) for r in matched]
+            if self._single:
+                return _Response(data[0] if data else None)
+            return _Response(data, count=len(data))
+
+    def execute(self):
+        return self._run()
+
+
+class _MemoryRPC:
+    def __init__(self, client: "MemoryClient", name: str, params: Dict):
+        self._client = client
+        self._name = name
+        self._params = params
+
+    def execute(self):
+        fn = MemoryClient.rpc_functions.get(self._name)
+        if fn is None:
+            raise Exception(f"Could not find the function public.{self._name}")
+        return _Response(fn(self._client, self._params or {}))
+
+
+class _MemoryBucket:
+    def __init__(self, client: "MemoryClient", bucket: str):
+        self._client = client
+        self._bucket = bucket
+
+    def upload(self, path: str, file, file_options: Optional[Dict] = None):
+        with self._client.lock:
+            self._client.objects[(self._bucket, path)] = bytes(file)
+        return _Response({"path": path})
+
+    def download(self, path: str) -> bytes:
+        return self._client.objects[(self._bucket, path)]
+
+
+class _MemoryStorage:
+    def __init__(self, client: "MemoryClient"):
+        self._client = client
+
+    def from_(self, bucket: str) -> _MemoryBucket:
+        return _MemoryBucket(self._client, bucket)
+
+
+class MemoryClient:
+    """
+    In-process stand-in for the Supabase client
+
+    Implements the subset of the fluent PostgREST/Storage API used by the
+    backend (table/select/insert/upsert/update/delete, common filters,
+    order/limit/single, rpc, storage upload/download) so load tests and CI
+    can run without a database. Postgres functions are emulated by Python
+    callables registered with MemoryClient.register_rpc().
+    """
+
+    rpc_functions: Dict[str, Callable[["MemoryClient", Dict], Any]] = {}
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables: Dict[str, List[Dict]] = {}
+        self.objects: Dict[tuple, bytes] = {}
+        self.storage = _MemoryStorage(self)
+
+    @classmethod
+    def register_rpc(cls, name: str):
+        def decorator(fn):
+            cls.rpc_functions[name] = fn
+            return fn
+        return decorator
+
+    def load_seed(self, path: str):
+        """Insert rows from a JSON file shaped {table: [rows]}"""
+        with open(path, "r", encoding="utf-8") as f:
+            seed = json.load(f)
+        for table, rows in seed.items():
+            if rows:
+                self.table(table).insert(rows).execute()
+
+    def table(self, name: str) -> _MemoryQuery:
+        return _MemoryQuery(self, name)
+
+    def from_(self, name: str) -> _MemoryQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None) -> _MemoryRPC:
+        return _MemoryRPC(self, name, params)
+
+
+def _cosine_similarity(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@MemoryClient.register_rpc("match_students")
+def _memory_match_students(client: MemoryClient, params: Dict):
+    query = params["query_embedding"]
+    with client.lock:
+        rows = list(client.tables.get("active_embeddings", []))
+    scored = [
+        {"student_id": r["student_id"], "profile_id": r.get("profile_id"),
+         "similarity": _cosine_similarity(r["embedding"], query)}
+        for r in rows
+    ]
+    scored = [s for s in scored if s["similarity"] > params["match_threshold"]]
+    scored.sort(key=lambda s: s["similarity"], reverse=True)
+    return scored[:params["match_count"]]
+
+
+@MemoryClient.register_rpc("match_students_batch")
+def _memory_match_students_batch(client: MemoryClient, params: Dict):
+    results = []
+    for idx, query in enumerate(params["query_embeddings"]):
+        matches = _memory_match_students(client, {**params, "query_embedding": query})
+        results.extend({"query_index": idx, **m} for m in matches)
+    return results
+
+
+@MemoryClient.register_rpc("match_students_templates")
+def _memory_match_students_templates(client: MemoryClient, params: Dict):
+    query = params["query_embedding"]
+    with client.lock:
+        rows = list(client.tables.get("active_embedding_templates", []))
+    best: Dict[str, Dict] = {}
+    for r in rows:
+        similarity = _cosine_similarity(r["embedding"], query)
+        if similarity > params["match_threshold"] and similarity > best.get(r["student_id"], {}).get("similarity", -1):
+            best[r["student_id"]] = {"student_id": r["student_id"], "profile_id": r.get("profile_id"),
+                                     "similarity": similarity}
+    scored = sorted(best.values(), key=lambda s: s["similarity"], reverse=True)
+    return scored[:params["match_count"]]
+
+
+@MemoryClient.register_rpc("approve_pending_bulk")
+def _memory_approve_pending_bulk(client: MemoryClient, params: Dict):
+    results = []
+    # One lock hold stands in for the single transaction
+    with client.lock:
+        pending_by_id = {str(r["id"]): r for r in client.tables.get("pending_approvals", [])}
+        for pending_id in dict.fromkeys(str(i) for i in params["pending_ids"]):
+            p = pending_by_id.get(pending_id)
+            if p is None:
+                results.append({"pending_id": pending_id, "result": "not_found", "student_id": None,
+                                "profile_id": None, "embedding": None})
+                continue
+            row = {"pending_id": pending_id, "student_id": p["student_id"], "profile_id": p.get("profile_id"),
+                   "embedding": None}
+            if p.get("status", "pending") != "pending":
+                results.append({**row, "result": f"already_{p['status']}"})
+                continue
+
+            client.table("active_embeddings").insert({
+                "profile_id": p.get("profile_id"), "student_id": p["student_id"], "embedding": p["embedding"],
+                "embedding_version": p.get("embedding_version")
+            }).execute()
+            if p.get("templates"):
+                client.table("active_embedding_templates").insert([
+                    {"profile_id": p.get("profile_id"), "student_id": p["student_id"],
+                     "template_index": idx, "embedding": template, "embedding_version": p.get("embedding_version")}
+                    for idx, template in enumerate(p["templates"])
+                ]).execute()
+            client.table("profiles").update({"is_active": True}).eq("id", p.get("profile_id")).execute()
+            p["status"] = "approved"
+            results.append({**row, "result": "approved", "embedding": p["embedding"]})
+    return results
+
+
+@MemoryClient.register_rpc("cutover_embedding_version")
+def _memory_cutover_embedding_version(client: MemoryClient, params: Dict):
+    target = params["target_version"]
+    # One lock hold stands in for the single transaction
+    with client.lock:
+        shadow = {r["student_id"]: r for r in client.tables.get("embedding_reembed", [])
+                  if r.get("embedding_version") == target}
+        active = client.tables.get("active_embeddings", [])
+        pending = [r for r in client.tables.get("pending_approvals", []) if r.get("status", "pending") == "pending"]
+        stale = {r["student_id"] for r in active + pending if r.get("embedding_version") != target}
+        missing = len(stale - set(shadow))
+        if missing:
+            raise Exception(f"{missing} students have no {target} embedding yet; "
+                            f"finish re-embedding, or re-enroll or remove them")
+
+        switched = client.table("active_embeddings").select("student_id, profile_id").execute().data
+        switched = [r for r in switched if r["student_id"] in shadow]
+        for student_id in {r["student_id"] for r in switched}:
+            client.table("active_embeddings").update({
+                "embedding": shadow[student_id]["embedding"], "embedding_version": target
+            }).eq("student_id", student_id).execute()
+
+        profiles = {r["student_id"]: r.get("profile_id") for r in switched}
+        client.tables["active_embedding_templates"] = [
+            t for t in client.tables.get("active_embedding_templates", []) if t["student_id"] not in shadow
+        ]
+        templates = [
+            {"profile_id": profiles[student_id], "student_id": student_id, "template_index": idx,
+             "embedding": template, "embedding_version": target}
+            for student_id in profiles
+            for idx, template in enumerate(shadow[student_id].get("templates") or [])
+        ]
+        if templates:
+            client.table("active_embedding_templates").insert(templates).execute()
+
+        for r in pending:
+            if r["student_id"] in shadow:
+                r.update(embedding=shadow[r["student_id"]]["embedding"],
+                         templates=shadow[r["student_id"]].get("templates"), embedding_version=target)
+
+        client.tables["embedding_reembed"] = [
+            r for r in client.tables.get("embedding_reembed", []) if r.get("embedding_version") != target
+        ]
+    return [
+        {"item": "active_embeddings", "rows_changed": len(switched)},
+        {"item": "active_embedding_templates", "rows_changed": len(templates)},
+        {"item": "pending_approvals", "rows_changed": sum(1 for r in pending if r["student_id"] in shadow)}
+    ]
+
+
+@MemoryClient.register_rpc("get_attendance_stats")
+def _memory_get_attendance_stats(client: MemoryClient, params: Dict):
+    class_id = str(params["p_class_id"])
+    day = str(params.get("p_date") or date.today().isoformat())
+    with client.lock:
+        enrolled = {e["student_id"] for e in client.tables.get("class_enrollments", [])
+                    if str(e.get("class_id")) == class_id}
+        present = {a["student_id"] for a in client.tables.get("attendance_logs", [])
+                   if str(a.get("class_id")) == class_id
+                   and str(a.get("marked_at", ""))[:10] == day
+                   and a["student_id"] in enrolled}
+    total = len(enrolled)
+    return [{
+        "total_students": total,
+        "present_students": len(present),
+        "absent_students": total - len(present),
+        "attendance_percentage": (len(present) / total * 100) if total else 0
+    }]
+
+
+@MemoryClient.register_rpc("get_attendance_summary")
+def _memory_get_attendance_summary(client: MemoryClient, params: Dict):
+    start = date.fromisoformat(str(params["p_start"])[:10])
+    end = date.fromisoformat(str(params.get("p_end") or date.today().isoformat())[:10])
+    with client.lock:
+        class_ids = sorted(str(c["id"]) for c in client.tables.get("classes", []))
+    if params.get("p_class_id"):
+        class_ids = [c for c in class_ids if c == str(params["p_class_id"])]
+
+    rows = []
+    for class_id in class_ids:
+        day = start
+        while day <= end:
+            stats = _memory_get_attendance_stats(client, {"p_class_id": class_id, "p_date": day.isoformat()})[0]
+            rows.append({"class_id": class_id, "day": day.isoformat(), **stats})
+            day = date.fromordinal(day.toordinal() + 1)
+    return rows
+
+
+@MemoryClient.register_rpc("export_attendance_page")
+def _memory_export_attendance_page(client: MemoryClient, params: Dict):
+    after = None
+    if params.get("p_after_marked_at") is not None:
+        after = (str(params["p_after_marked_at"]), str(params["p_after_id"]))
+    with client.lock:
+        rows = [
+            dict(r) for r in client.tables.get("attendance_logs", [])
+            if str(params["p_start"]) <= str(r["marked_at"]) < str(params["p_end"])
+            and (not params.get("p_class_id") or r.get("class_id") == params["p_class_id"])
+            and (after is None or (str(r["marked_at"]), str(r["id"])) > after)
+        ]
+    rows.sort(key=lambda r: (str(r["marked_at"]), str(r["id"])))
+    return rows[:params.get("p_limit", 1000)]
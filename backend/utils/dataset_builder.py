@@ -4,15 +4,71 @@ Captures multiple high-quality photos for face recognition training
 """
 
 import cv2
+import hashlib
+import json
 import os
 import time
+import threading
 import numpy as np
 from pathlib import Path
-from typing import Optional, List, Tuple
-try:
-    from deepface import DeepFace
-except ImportError:
-    DeepFace = None
+from typing import Optional, List, Tuple, Dict
+from utils.model_registry import model_registry
+from utils.preprocessing import downscale, map_box
+from utils.quality_gate import measure
+from utils.lazy_import import DeepFace
+
+class _QualityWorker:
+    """
+    Scores the most recent preview frame in a background thread
+
+    The preview loop hands over every frame; frames that arrive while a
+    check is running simply replace the pending one, so the camera loop
+    never waits on detection.
+    """
+
+    def __init__(self, builder: "DatasetBuilder", max_detect_side: int):
+        self.builder = builder
+        self.max_detect_side = max_detect_side
+        self._cond = threading.Condition()
+        self._pending: Optional[Tuple[int, np.ndarray]] = None
+        self._verdict: Optional[Dict] = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="quality-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame_id: int, frame: np.ndarray):
+        with self._cond:
+            self._pending = (frame_id, frame)
+            self._cond.notify()
+
+    def latest(self) -> Optional[Dict]:
+        """Most recent verdict, including the full-resolution frame it was computed on"""
+        with self._cond:
+            return self._verdict
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                frame_id, frame = self._pending
+                self._pending = None
+
+            verdict = self.builder.assess_photo_quality(frame, self.max_detect_side)
+            verdict["frame_id"] = frame_id
+            verdict["frame"] = frame
+
+            with self._cond:
+                self._verdict = verdict
+
 
 class DatasetBuilder:
     def __init__(self, dataset_root: str = "dataset"):
@@ -31,67 +87,118 @@ class DatasetBuilder:
         self.max_brightness = 200  # Maximum average brightness
         self.min_quality_score = 70  # Minimum overall quality score (0-100)
         
-    def check_photo_quality(self, frame: np.ndarray) -> Tuple[bool, float, str]:
+        # Live preview: detect on a downscaled copy in a background thread
+        self.preview_detect_side = 480  # Longest side (pixels) used for preview detection
+        
+    def check_photo_quality(
+        self,
+        frame: np.ndarray,
+        max_detect_side: Optional[int] = None
+    ) -> Tuple[bool, float, str]:
         """
         Check if photo meets quality standards
         
+        Args:
+            frame: BGR image
+            max_detect_side: If set, run face detection on a copy downscaled
+                             so its longest side is at most this many pixels
+        
         Returns:
             (is_good_quality, quality_score, feedback_message)
         """
+        verdict = self.assess_photo_quality(frame, max_detect_side)
+        return verdict["is_good"], verdict["quality_score"], verdict["feedback"]
+    
+    def _detect_faces(self, frame: np.ndarray) -> List[Dict]:
+        """Detect faces, returning their facial_area dicts in frame coordinates"""
+        if DeepFace:
+            # Shared, already-loaded detector (DeepFace reuses it internally)
+            model_registry.ensure_detector('mtcnn')
+            faces = DeepFace.extract_faces(
+                img_path=frame,
+                detector_backend='mtcnn',
+                enforce_detection=False
+            )
+            # enforce_detection=False returns the whole frame when nothing is found
+            return [f.get('facial_area', {}) for f in faces if f.get('confidence', 1) > 0]
+        
+        # Fallback to OpenCV Haar Cascade (loaded once, shared)
+        face_cascade = model_registry.get_detector('opencv_haar')
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detected = face_cascade.detectMultiScale(gray, 1.1, 4)
+        return [{'x': x, 'y': y, 'w': w, 'h': h} for (x, y, w, h) in detected]
+    
+    def assess_photo_quality(
+        self,
+        frame: np.ndarray,
+        max_detect_side: Optional[int] = None
+    ) -> Dict:
+        """
+        Score a photo, detecting on an optionally downscaled copy
+        
+        The detected box is mapped back to full resolution, and size,
+        brightness and sharpness are measured on the full-resolution crop,
+        so the verdict matches what a full-resolution check would report.
+        
+        Args:
+            frame: BGR image
+            max_detect_side: Longest side (pixels) used for detection, or None
+            
+        Returns:
+            Dictionary with is_good, quality_score, feedback, face_box
+            ((x, y, w, h) in full-resolution pixels, or None), and the
+            brightness / sharpness measured on the face (None if not reached)
+        """
+        measures = {"brightness": None, "sharpness": None}
+        
+        def verdict(is_good, score, feedback, box=None):
+            return {"is_good": is_good, "quality_score": float(score), "feedback": feedback,
+                    "face_box": box, **measures}
+        
         try:
-            # Detect face using MTCNN
-            if DeepFace:
-                faces = DeepFace.extract_faces(
-                    img_path=frame,
-                    detector_backend='mtcnn',
-                    enforce_detection=False
-                )
-            else:
-                # Fallback to OpenCV Haar Cascade
-                face_cascade = cv2.CascadeClassifier(
-                    cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-                )
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                detected = face_cascade.detectMultiScale(gray, 1.1, 4)
-                faces = [{'facial_area': {'x': x, 'y': y, 'w': w, 'h': h}} 
-                        for (x, y, w, h) in detected]
+            detect_frame, scale = downscale(frame, max_detect_side)
+            
+            faces = self._detect_faces(detect_frame)
             
             if not faces or len(faces) == 0:
-                return False, 0, "No face detected"
+                return verdict(False, 0, "No face detected")
             
             if len(faces) > 1:
-                return False, 0, "Multiple faces detected - only one person should be in frame"
+                return verdict(False, 0, "Multiple faces detected - only one person should be in frame")
             
-            face = faces[0]
-            facial_area = face.get('facial_area', {})
+            facial_area = faces[0]
+            
+            # Map the box back to full resolution
+            full = map_box(facial_area, scale, frame.shape)
+            x, y, w, h = full['x'], full['y'], full['w'], full['h']
+            box = (x, y, w, h)
             
             # Check face size
-            face_width = facial_area.get('w', 0)
-            face_height = facial_area.get('h', 0)
-            face_size = min(face_width, face_height)
+            face_size = min(w, h)
             
             if face_size < self.min_face_size:
-                return False, 30, f"Face too small ({face_size}px) - move closer to camera"
+                return verdict(False, 30, f"Face too small ({face_size}px) - move closer to camera", box)
             
             # Extract face region
-            x, y, w, h = (facial_area.get('x', 0), facial_area.get('y', 0), 
-                         facial_area.get('w', 0), facial_area.get('h', 0))
             face_region = frame[y:y+h, x:x+w]
             
-            # Check brightness
+            # Brightness and sharpness, as the recognition quality gate measures them
             gray_face = cv2.cvtColor(face_region, cv2.COLOR_BGR2GRAY)
-            brightness = np.mean(gray_face)
+            face_measures = measure(gray_face)
+            brightness = float(face_measures["brightness"][0])
+            measures["brightness"] = brightness
             
             if brightness < self.min_brightness:
-                return False, 40, "Too dark - improve lighting"
+                return verdict(False, 40, "Too dark - improve lighting", box)
             if brightness > self.max_brightness:
-                return False, 40, "Too bright - reduce lighting"
+                return verdict(False, 40, "Too bright - reduce lighting", box)
             
             # Check blur (Laplacian variance)
-            laplacian_var = cv2.Laplacian(gray_face, cv2.CV_64F).var()
+            laplacian_var = float(face_measures["sharpness"][0])
+            measures["sharpness"] = laplacian_var
             
             if laplacian_var < 100:
-                return False, 50, "Image too blurry - hold still"
+                return verdict(False, 50, "Image too blurry - hold still", box)
             
             # Calculate overall quality score
             size_score = min(100, (face_size / 200) * 100)
@@ -101,12 +208,12 @@ class DatasetBuilder:
             quality_score = (size_score * 0.4 + brightness_score * 0.3 + sharpness_score * 0.3)
             
             if quality_score >= self.min_quality_score:
-                return True, quality_score, "Good quality!"
+                return verdict(True, quality_score, "Good quality!", box)
             else:
-                return False, quality_score, f"Quality too low ({quality_score:.0f}/100)"
+                return verdict(False, quality_score, f"Quality too low ({quality_score:.0f}/100)", box)
                 
         except Exception as e:
-            return False, 0, f"Error: {str(e)}"
+            return verdict(False, 0, f"Error: {str(e)}")
     
     def capture_student_photos(
         self, 
@@ -141,6 +248,7 @@ class DatasetBuilder:
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
         
         saved_photos = []
+        saved_data: List[Tuple[Path, bytes]] = []
         photo_count = 0
         
         # Instructions for different poses
@@ -164,6 +272,10 @@ class DatasetBuilder:
         current_instruction_idx = 0
         last_capture_time = 0
         min_capture_interval = 2  # Minimum 2 seconds between captures
+        last_captured_frame_id = -1
+        frame_id = 0
+        
+        worker = _QualityWorker(self, self.preview_detect_side)
         
         try:
             while photo_count < num_photos:
@@ -172,12 +284,24 @@ class DatasetBuilder:
                     print("Failed to grab frame")
                     break
                 
+                frame_id += 1
+                worker.submit(frame_id, frame)
+                
                 # Create display frame
                 display_frame = frame.copy()
                 h, w = display_frame.shape[:2]
                 
-                # Check quality
-                is_good, quality_score, feedback = self.check_photo_quality(frame)
+                # Draw the most recent quality verdict (computed in the background)
+                verdict = worker.latest()
+                if verdict is None:
+                    is_good, quality_score, feedback = False, 0, "Checking..."
+                else:
+                    is_good = verdict["is_good"] and verdict["frame_id"] != last_captured_frame_id
+                    quality_score, feedback = verdict["quality_score"], verdict["feedback"]
+                    if verdict["face_box"]:
+                        fx, fy, fw, fh = verdict["face_box"]
+                        cv2.rectangle(display_frame, (fx, fy), (fx + fw, fy + fh),
+                                      (0, 255, 0) if is_good else (0, 165, 255), 2)
                 
                 # Draw instruction box
                 instruction = instructions[min(current_instruction_idx, len(instructions)-1)]
@@ -197,25 +321,6 @@ class DatasetBuilder:
                 indicator_color = (0, 255, 0) if is_good else (0, 165, 255)
                 cv2.circle(display_frame, (w - 40, 40), 20, indicator_color, -1)
                 
-                # Auto-capture if quality is excellent (>85) and enough time has passed
-                current_time = time.time()
-                if is_good and quality_score > 85 and (current_time - last_capture_time) > min_capture_interval:
-                    # Save photo
-                    photo_filename = f"photo_{photo_count + 1}_{int(time.time())}.jpg"
-                    photo_path = student_dir / photo_filename
-                    cv2.imwrite(str(photo_path), frame)
-                    saved_photos.append(str(photo_path))
-                    
-                    print(f"✓ Captured photo {photo_count + 1}/{num_photos} - Quality: {quality_score:.0f}/100")
-                    
-                    photo_count += 1
-                    current_instruction_idx += 1
-                    last_capture_time = current_time
-                    
-                    # Flash effect
-                    flash = np.ones_like(display_frame) * 255
-                    cv2.addWeighted(display_frame, 0.5, flash, 0.5, 0, display_frame)
-                
                 cv2.imshow('Attendify - Student Enrollment', display_frame)
                 
                 # Handle key press
@@ -223,11 +328,18 @@ class DatasetBuilder:
                 if key == ord('q'):
                     print("\nEnrollment cancelled by user")
                     break
-                elif key == ord(' ') and is_good:
-                    # Manual capture with spacebar
+                
+                # Auto-capture if quality is excellent (>85) and enough time has passed,
+                # or manual capture with spacebar
+                current_time = time.time()
+                auto_capture = is_good and quality_score > 85 and (current_time - last_capture_time) > min_capture_interval
+                manual_capture = key == ord(' ') and is_good
+                
+                if auto_capture or manual_capture:
+                    # Save the full-resolution frame the verdict was computed on
                     photo_filename = f"photo_{photo_count + 1}_{int(time.time())}.jpg"
                     photo_path = student_dir / photo_filename
-                    cv2.imwrite(str(photo_path), frame)
+                    saved_data.append((photo_path, self._save_photo(photo_path, verdict["frame"])))
                     saved_photos.append(str(photo_path))
                     
                     print(f"✓ Captured photo {photo_count + 1}/{num_photos} - Quality: {quality_score:.0f}/100")
@@ -235,11 +347,24 @@ class DatasetBuilder:
                     photo_count += 1
                     current_instruction_idx += 1
                     last_capture_time = current_time
+                    last_captured_frame_id = verdict["frame_id"]
+                    
+                    # Flash effect
+                    flash = np.ones_like(display_frame) * 255
+                    cv2.addWeighted(display_frame, 0.5, flash, 0.5, 0, display_frame)
+                    cv2.imshow('Attendify - Student Enrollment', display_frame)
         
         finally:
+            worker.stop()
             cap.release()
             cv2.destroyAllWindows()
         
+        # Full-resolution scoring happens once the camera is closed, so the
+        # preview never waits on it
+        if saved_data:
+            print(f"Scoring {len(saved_data)} photo(s) at full resolution...")
+            self._record_photos(student_dir, saved_data)
+        
         print(f"\n{'='*60}")
         print(f"Enrollment complete! Saved {len(saved_photos)} photos")
         print(f"Location: {student_dir}")
@@ -247,10 +372,81 @@ class DatasetBuilder:
         
         return saved_photos
     
-    def validate_dataset(self, student_id: str) -> dict:
+    MANIFEST_NAME = "manifest.json"
+    
+    def _load_manifest(self, student_dir: Path) -> Dict:
+        manifest_path = student_dir / self.MANIFEST_NAME
+        if not manifest_path.exists():
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("photos", {})
+        except (OSError, ValueError):
+            return {}  # Corrupt manifest: everything gets re-scored
+    
+    def _write_manifest(self, student_dir: Path, photos: Dict):
+        manifest_path = student_dir / self.MANIFEST_NAME
+        tmp_path = manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "photos": photos}, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+    
+    @staticmethod
+    def _manifest_entry(data: bytes, stat: os.stat_result, verdict: Dict) -> Dict:
+        return {
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "quality_score": verdict["quality_score"],
+            "is_good": verdict["is_good"],
+            "face_box": list(verdict["face_box"]) if verdict["face_box"] else None,
+            "brightness": verdict.get("brightness"),
+            "sharpness": verdict.get("sharpness")
+        }
+    
+    def _save_photo(self, photo_path: Path, frame: np.ndarray) -> bytes:
+        """
+        Write a captured photo as JPEG
+        
+        Returns:
+            The encoded bytes, for _record_photos
+        """
+        ok, buffer = cv2.imencode(".jpg", frame)
+        if not ok:
+            raise Exception(f"Could not encode {photo_path.name}")
+        data = buffer.tobytes()
+        with open(photo_path, 'wb') as f:
+            f.write(data)
+        return data
+    
+    def _record_photos(self, student_dir: Path, saved: List[Tuple[Path, bytes]]):
+        """
+        Score captured photos and add them to the manifest in one write
+        
+        The preview verdict comes from a downscaled detection on the raw
+        frame; the manifest instead scores the encoded JPEG at full
+        resolution, exactly as validate_dataset would, so a later rescore
+        reproduces it. Photos left unscored (e.g. after an interrupted
+        capture) are scored by validate_dataset instead.
+        """
+        manifest = self._load_manifest(student_dir)
+        for photo_path, data in saved:
+            verdict = self.assess_photo_quality(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR))
+            manifest[photo_path.name] = self._manifest_entry(data, photo_path.stat(), verdict)
+        self._write_manifest(student_dir, manifest)
+    
+    def validate_dataset(self, student_id: str, rescore: bool = False) -> dict:
         """
         Validate that a student's dataset meets requirements
         
+        Quality scores come from the per-student manifest written at capture
+        time. Only photos that are new or whose content hash changed are
+        decoded and scored again; unchanged size + mtime skips hashing too.
+        
+        Args:
+            student_id: Student ID
+            rescore: Ignore the manifest and re-score every photo
+        
         Returns:
             Dictionary with validation results
         """
@@ -270,20 +466,43 @@ class DatasetBuilder:
                 "error": f"Insufficient photos ({len(photos)}/5 minimum)"
             }
         
-        # Check quality of each photo
+        # Check quality of each photo, reusing manifest entries when unchanged
+        manifest = {} if rescore else self._load_manifest(student_dir)
+        updated = {}
         quality_scores = []
+        rescored = 0
         for photo_path in photos:
-            frame = cv2.imread(str(photo_path))
-            is_good, score, _ = self.check_photo_quality(frame)
-            quality_scores.append(score)
+            stat = photo_path.stat()
+            entry = manifest.get(photo_path.name)
+            
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                updated[photo_path.name] = entry
+            else:
+                data = photo_path.read_bytes()
+                if entry and entry["sha256"] == hashlib.sha256(data).hexdigest():
+                    # Touched but identical content: keep the score
+                    entry = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                else:
+                    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                    verdict = self.assess_photo_quality(frame)
+                    entry = self._manifest_entry(data, stat, verdict)
+                    rescored += 1
+                updated[photo_path.name] = entry
+            
+            quality_scores.append(entry["quality_score"])
+        
+        if updated != self._load_manifest(student_dir):
+            self._write_manifest(student_dir, updated)
         
         avg_quality = np.mean(quality_scores)
         
         return {
             "valid": avg_quality >= 70,
             "num_photos": len(photos),
+            "photos": [str(p) for p in photos],
             "avg_quality": avg_quality,
-            "quality_scores": quality_scores
+            "quality_scores": quality_scores,
+            "rescored": rescored
         }
 
 
@@ -0,0 +1,243 @@
+"""
+Embedding Cache
+Persistent, content-addressed cache of face embeddings with size-based LRU eviction
+"""
+
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from utils.metrics import metrics
+from utils.preprocessing import PreparedImage
+
+CACHE_REQUESTS = metrics.counter(
+    "attendify_embedding_cache_requests_total",
+    "Embedding cache lookups",
+    ["result"]
+)
+CACHE_SAVED_SECONDS = metrics.counter(
+    "attendify_embedding_cache_saved_seconds_total",
+    "Embedding compute time avoided by cache hits"
+)
+
+
+def image_digest(image_input) -> Optional[str]:
+    """
+    Hash the content of an image given as a path, base64 string, numpy array
+    or PreparedImage (hashed by its source, so it shares keys with the raw input)
+
+    Returns:
+        Hex sha256 of the image bytes, or None if the input cannot be hashed
+    """
+    h = hashlib.sha256()
+    if isinstance(image_input, PreparedImage):
+        image_input = image_input.source()
+    if isinstance(image_input, np.ndarray):
+        h.update(f"{image_input.shape}:{image_input.dtype}".encode())
+        h.update(np.ascontiguousarray(image_input).tobytes())
+    elif isinstance(image_input, (bytes, bytearray)):
+        h.update(image_input)
+    elif isinstance(image_input, str) and len(image_input) > 200:
+        data = image_input.split(",")[1] if "," in image_input else image_input
+        try:
+            h.update(base64.b64decode(data))
+        except ValueError:
+            return None
+    elif isinstance(image_input, str) and os.path.isfile(image_input):
+        with open(image_input, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        return None
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        db_path: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        touch_batch: int = 256,
+        evict_chunk: int = 512
+    ):
+        """
+        Initialize a SQLite-backed embedding cache
+
+        Embeddings are stored as float32 blobs (2 KB for Facenet512). When the
+        stored size exceeds max_bytes, the least recently used entries go first.
+        Hits do not write: their last_used times are buffered and applied in
+        one transaction every touch_batch hits (and before any eviction).
+
+        Args:
+            db_path: Path of the SQLite file
+            max_bytes: Upper bound on the total size of stored embeddings
+            touch_batch: Buffered last_used updates before they are written
+            evict_chunk: Entries read per eviction query
+        """
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.evict_chunk = evict_chunk
+        self._touched: Dict[str, float] = {}
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._saved_seconds = 0.0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                compute_seconds REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(
+        digest: str,
+        model_name: str,
+        detector_backend: str,
+        max_detect_side: Optional[int] = None,
+        high_fidelity_crops: bool = False
+    ) -> str:
+        """
+        Cache key: image content hash scoped to the model, the detector and
+        the preprocessing that decides which pixels reach the model
+        """
+        crops = "hf" if high_fidelity_crops else "std"
+        return f"{model_name}:{detector_backend}:{max_detect_side or 'full'}:{crops}:{digest}"
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """
+        Look up an embedding
+
+        Returns:
+            The cached embedding, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT embedding, compute_seconds FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                CACHE_REQUESTS.inc(result="miss")
+                return None
+
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touches()
+                self._conn.commit()
+            self._hits += 1
+            self._saved_seconds += row[1]
+
+        CACHE_REQUESTS.inc(result="hit")
+        CACHE_SAVED_SECONDS.inc(row[1])
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, key: str, embedding: List[float], compute_seconds: float = 0.0):
+        """
+        Store an embedding and evict least recently used entries if over budget
+
+        Args:
+            key: Cache key (see make_key)
+            embedding: Embedding vector
+            compute_seconds: Time it took to compute, credited on later hits
+        """
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO embeddings (key, embedding, size, compute_seconds, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, blob, len(blob), compute_seconds, now, now)
+            )
+            self._total_bytes += len(blob) - (previous[0] if previous else 0)
+
+            self._touched.pop(key, None)
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        """Write buffered last_used times (lock held, caller commits)"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes (lock held)"""
+        self._flush_touches()
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT ?", (self.evict_chunk,)
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                victims.append((key,))
+                self._total_bytes -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+            self._evictions += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict:
+        """
+        Cache effectiveness since this process started
+
+        Returns:
+            Dictionary with hits, misses, hit_rate, saved_seconds, entries,
+            bytes, max_bytes and evictions
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self._saved_seconds, 3),
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions
+            }
+
+    def close(self):
+        with self._lock:
+            self._flush_touches()
+            self._conn.commit()
+            self._conn.close()
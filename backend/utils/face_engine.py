@@ -1,208 +1,699 @@
 import os
-import cv2
 import time
+import threading
+import uuid
 import base64
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from supabase import create_client, Client
-try:
-    from deepface import DeepFace
-except ImportError:
-    DeepFace = None
+from utils.data_access import get_supabase
+from utils.attendance_marker import attendance_marker
+from utils.model_registry import model_registry, ONNX_DETECTORS
+from utils.onnx_backend import RUNTIMES, EXPORTED_MODELS
+from utils.embedding_cache import EmbeddingCache, image_digest
+from utils.gallery import gallery, class_galleries
+from utils.write_queue import WriteAheadQueue
+from utils.preprocessing import PreparedImage, prepare_array, prepare_bytes
+from utils.metrics import stage, FACES_PER_FRAME, MATCHES, REJECTIONS
+from utils.quality_gate import quality_gates
+# DeepFace (and TensorFlow behind it) load on first use, not at import
+from utils.lazy_import import DeepFace, deepface_preprocessing
 
 # Load environment variables
 load_dotenv()
 
 # --- CONFIGURATION ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Optional on-disk embedding cache (disabled unless a path is set)
+EMBEDDING_CACHE_PATH = os.getenv("ATTENDIFY_EMBEDDING_CACHE")
+EMBEDDING_CACHE_MB = int(os.getenv("ATTENDIFY_EMBEDDING_CACHE_MB", "256"))
 
-# Initialize Supabase Client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
+# Enrollments are queued locally and written to Supabase in the background.
+# Relative paths are anchored to the backend directory, not the working directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENROLLMENT_QUEUE_PATH = os.path.join(BACKEND_DIR, os.getenv("ENROLLMENT_QUEUE_PATH", "enrollment_queue.sqlite3"))
+ENROLLMENT_SPOOL_DIR = os.path.join(BACKEND_DIR, os.getenv("ENROLLMENT_SPOOL_DIR", "enrollment_spool"))
+
+# 'deepface' runs TensorFlow; the others run exported models (utils/onnx_backend.py)
+INFERENCE_BACKENDS = ("deepface",) + RUNTIMES
+
+
+def check_pipeline(model_name, detector_backend, inference_backend):
+    """
+    Raises ValueError for a model / detector / runtime combination that
+    cannot produce embeddings, so it is refused before any photo is processed.
+    """
+    if inference_backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{inference_backend}' (choose from {', '.join(INFERENCE_BACKENDS)})")
+    if inference_backend == "deepface":
+        return
+    if model_name not in EXPORTED_MODELS:
+        raise ValueError(f"{inference_backend} only runs exported models ({', '.join(EXPORTED_MODELS)}), not '{model_name}'")
+    if detector_backend not in ONNX_DETECTORS:
+        raise ValueError(f"{inference_backend} only detects with {', '.join(ONNX_DETECTORS)}, not '{detector_backend}'")
+
+
+def embedding_version_for(model_name, detector_backend, inference_backend="deepface"):
+    """
+    Name of the pipeline producing an embedding, e.g. 'Facenet512/mtcnn' on
+    DeepFace or 'Facenet512@onnxruntime/yunet' on an exported model
+    """
+    if inference_backend != "deepface":
+        model_name = f"{model_name}@{inference_backend}"
+    return f"{model_name}/{detector_backend}"
 
 class AttendifyAI:
     def __init__(self):
         # We use Facenet512 for high accuracy in large classrooms
-        self.model_name = "Facenet512" 
-        self.detector_backend = 'mtcnn' # Best for CCTV/crowded rooms
+        # Changing either makes stored embeddings incompatible: re-embed them
+        # first (utils/reembedding.py, database_updates_v13_embedding_versions.sql)
+        self.model_name = os.getenv("ATTENDIFY_EMBEDDING_MODEL", "Facenet512")
+        self.detector_backend = os.getenv("ATTENDIFY_DETECTOR_BACKEND", "mtcnn") # MTCNN is best for CCTV/crowded rooms
+        self.search_mode = 'auto' # 'centroid', 'templates' or 'auto'
+        self.embedding_cache = None
+        self.enrollment_queue = None
+        self._queue_lock = threading.Lock()
+        # Facenet512 needs ~160px faces; detecting on 12MP selfies wastes time
+        self.max_detect_side = int(os.getenv("ATTENDIFY_MAX_DETECT_SIDE", "1280")) or None
+        self.high_fidelity_crops = os.getenv("ATTENDIFY_HIGH_FIDELITY_CROPS", "0") == "1"
+        # 'deepface' (TensorFlow), or exported ONNX models on 'onnxruntime' / 'opencv'
+        self.inference_backend = os.getenv("ATTENDIFY_INFERENCE_BACKEND", "deepface")
+        if self.inference_backend != "deepface":
+            self.detector_backend = 'yunet' # MTCNN does not export to a single ONNX graph
+
+    @property
+    def supabase(self):
+        """Shared Supabase client, created on first use (see utils/data_access.py)"""
+        return get_supabase()
+
+    @property
+    def embedding_model_id(self):
+        """Registry name of the embedding model, e.g. 'Facenet512@onnxruntime'"""
+        if self.inference_backend == "deepface":
+            return self.model_name
+        return f"{self.model_name}@{self.inference_backend}"
+
+    @property
+    def embedding_version(self):
+        """
+        Model, runtime and detector that produce this engine's embeddings,
+        e.g. 'Facenet512/mtcnn' (see embedding_version_for). Stored with every
+        embedding; vectors with another version cannot be matched against these.
+        """
+        return embedding_version_for(self.model_name, self.detector_backend, self.inference_backend)
+
+    def configure(self, model_name, detector_backend, inference_backend):
+        """Switch this engine to another pipeline (ValueError if unsupported, see check_pipeline)"""
+        check_pipeline(model_name, detector_backend, inference_backend)
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.inference_backend = inference_backend
+
+    def check_embedding_version(self):
+        """
+        Returns the number of active_embeddings rows stored with another
+        embedding_version (counted up to 1000), or None if unknown.
+        """
+        try:
+            rows = self.supabase.table("active_embeddings").select("embedding_version")\
+                .neq("embedding_version", self.embedding_version).limit(1000).execute().data or []
+        except Exception as e:
+            print(f"Could not check embedding versions: {e}")
+            return None
+        return len(rows)
+
+    @property
+    def inference_available(self):
+        """False only without DeepFace on the default backend (testing)"""
+        return self.inference_backend != "deepface" or bool(DeepFace)
+
+    def _extract_faces(self, img):
+        """
+        DeepFace.extract_faces, or the exported detector's equivalent.
+        Raises ValueError when no face is found.
+        """
+        if self.inference_backend == "deepface":
+            model_registry.ensure_detector(self.detector_backend)
+            return DeepFace.extract_faces(
+                img_path=img,
+                detector_backend=self.detector_backend,
+                enforce_detection=True
+            )
+        if not isinstance(img, np.ndarray):
+            raise ValueError("Image could not be decoded")
+        detector = model_registry.get_detector(self.detector_backend)
+        return detector.extract_faces(img, enforce_detection=True)
+
+    def _prepare(self, image_input):
+        """
+        Decodes a base64 string, path or numpy array at detection resolution
+        (longest side <= max_detect_side). Returns a PreparedImage, or None if
+        the input cannot be decoded.
+        """
+        if isinstance(image_input, PreparedImage):
+            return image_input
+        if isinstance(image_input, np.ndarray):
+            with stage("decode"):
+                return prepare_array(image_input, self.max_detect_side)
+        try:
+            with stage("decode"):
+                img_data = self._image_bytes(image_input)
+                if img_data is None:
+                    return None
+                return prepare_bytes(img_data, self.max_detect_side)
+        except Exception as e:
+            print(f"Decoding failed: {e}")
+            return None
 
     def _decode_image(self, image_input):
         """
         Helper to convert base64 or path to a format DeepFace likes (numpy array).
+        Large images are scaled down for detection (see _prepare).
         """
-        if isinstance(image_input, str) and len(image_input) > 200:
-            try:
-                # Remove header if present
-                if "," in image_input:
-                    image_input = image_input.split(",")[1]
-                
-                img_data = base64.b64decode(image_input)
-                nparr = np.frombuffer(img_data, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if img is None:
-                    return image_input
-                return img
-            except Exception as e:
-                print(f"Decoding failed: {e}")
-                return image_input
-        return image_input
+        prepared = self._prepare(image_input)
+        return prepared.image if prepared is not None else image_input
 
     def check_face_quality(self, image_input):
         """
         Uses DeepFace.extract_faces to ensure lighting and quality are sufficient.
         Returns True if a clear face is detected.
         """
-        if not DeepFace:
+        if not self.inference_available:
             return True # Assume OK if deepface not installed (testing)
             
         try:
-            input_data = self._decode_image(image_input)
-            faces = DeepFace.extract_faces(
-                img_path=input_data,
-                detector_backend=self.detector_backend,
-                enforce_detection=True
-            )
+            faces = self._extract_faces(self._decode_image(image_input))
             return len(faces) > 0
         except Exception as e:
             print(f"Face quality check failed: {e}")
             return False
 
-    def get_embedding(self, image_input):
+    def preload_models(self):
+        """
+        Loads this engine's detector and embedding model up front so the first
+        request does not pay for it. Returns per-model load stats.
+        """
+        return model_registry.preload(
+            detectors=[self.detector_backend],
+            embedding_models=[self.embedding_model_id]
+        )
+
+    def _represent(self, input_data, prepared=None, gate=None):
+        """
+        Runs detection and embedding as separately timed stages.
+        Mirrors DeepFace.represent; falls back to it if the internals move.
+        With high_fidelity_crops, faces found on a downscaled image are
+        re-extracted from the original pixels (prepared: PreparedImage).
+        With a QualityGate, faces too dark or blurry to match are dropped
+        before the forward pass. On the DeepFace.represent fallback they are
+        dropped after it, judged on crops cut from input_data by facial_area
+        (represent returns no aligned faces); the gate is skipped there if
+        input_data is not a decoded array.
+        """
+        if self.inference_backend == "deepface" and not deepface_preprocessing:
+            with stage("detect_embed"):
+                embedding_objs = DeepFace.represent(
+                    img_path=input_data,
+                    model_name=self.model_name,
+                    enforce_detection=True,
+                    detector_backend=self.detector_backend
+                )
+            if gate is not None and isinstance(input_data, np.ndarray):
+                with stage("quality"):
+                    for obj in embedding_objs:
+                        area = obj["facial_area"]
+                        x, y = max(0, area["x"]), max(0, area["y"])
+                        crop = input_data[y:y + max(1, area["h"]), x:x + max(1, area["w"])]
+                        obj["face"] = crop[:, :, ::-1] / 255.0  # BGR -> RGB in [0, 1], like extract_faces
+                    embedding_objs = gate.filter_faces(embedding_objs)
+            return [obj["embedding"] for obj in embedding_objs]
+
+        model = model_registry.get_embedding_model(self.embedding_model_id)
+
+        with stage("detect"):
+            faces = self._extract_faces(input_data)
+
+        if self.high_fidelity_crops and prepared is not None and prepared.scale < 1.0:
+            with stage("refine"):
+                faces = [self._refine_face(face, prepared) for face in faces]
+
+        if gate is not None:
+            with stage("quality"):
+                faces = gate.filter_faces(faces)
+            if not faces:
+                return []
+
+        with stage("embed"):
+            return self._forward_batch(model, faces)
+
+    def _refine_face(self, face_obj, prepared):
+        """
+        Re-detects one face on a full-resolution crop around its mapped box,
+        so the aligned face comes from original pixels. Keeps the original
+        detection if the crop yields nothing.
+        """
+        crop = prepared.crop(face_obj["facial_area"], margin=0.25)
+        try:
+            refined = self._extract_faces(crop)
+        except Exception:
+            return face_obj
+        return max(refined, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+
+    def _forward_batch(self, model, faces):
+        """
+        Embeds a list of extracted faces (DeepFace.extract_faces objects) in a
+        single forward pass. Preprocessing mirrors DeepFace.represent.
+        Exported models (utils/onnx_backend.py) do the same steps themselves.
+        """
+        if self.inference_backend != "deepface":
+            return model.forward(faces)
+
+        target_h, target_w = model.input_shape[1], model.input_shape[0]
+        batch = []
+        for face_obj in faces:
+            face = face_obj["face"][:, :, ::-1]  # RGB -> BGR, as DeepFace.represent does
+            face = deepface_preprocessing.resize_image(img=face, target_size=(target_h, target_w))
+            face = deepface_preprocessing.normalize_input(img=face, normalization="base")
+            batch.append(face)
+
+        keras_model = getattr(model, "model", None)
+        if keras_model is None:
+            return [list(model.forward(face)) for face in batch]
+        return keras_model(np.concatenate(batch, axis=0), training=False).numpy().tolist()
+
+    def get_embeddings_batch(self, image_inputs):
+        """
+        Embeds the main face of each image with one batched forward pass.
+        Returns a list aligned with image_inputs (None where no face was found).
+        """
+        if not self.inference_available or (self.inference_backend == "deepface" and not deepface_preprocessing):
+            return [self.get_embedding(image_input) for image_input in image_inputs]
+
+        results = [None] * len(image_inputs)
+        keys = [None] * len(image_inputs)
+        cache = self._get_embedding_cache()
+        if cache is not None:
+            for idx, image_input in enumerate(image_inputs):
+                keys[idx] = self._embedding_cache_key(cache, image_input)
+                if keys[idx] is not None:
+                    results[idx] = cache.get(keys[idx])
+            if all(r is not None for r in results):
+                return results
+
+        model = model_registry.get_embedding_model(self.embedding_model_id)
+
+        start = time.perf_counter()
+        faces, owners = [], []
+        with stage("detect"):
+            for idx, image_input in enumerate(image_inputs):
+                if results[idx] is not None:
+                    continue
+                try:
+                    detected = self._extract_faces(self._decode_image(image_input))
+                except Exception as e:
+                    print(f"No face in image {idx}: {e}")
+                    continue
+                # Enrollment photos hold one person; keep the largest face
+                largest = max(detected, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+                faces.append(largest)
+                owners.append(idx)
+
+        if not faces:
+            return results
+
+        with stage("embed"):
+            embeddings = self._forward_batch(model, faces)
+        per_image = (time.perf_counter() - start) / len(faces)
+        for idx, embedding in zip(owners, embeddings):
+            results[idx] = embedding
+            if keys[idx] is not None:
+                cache.put(keys[idx], embedding, compute_seconds=per_image)
+        return results
+
+    @staticmethod
+    def compute_centroid(templates):
+        """
+        L2-normalizes each template, averages them and re-normalizes, so the
+        centroid is a unit vector comparable by cosine similarity.
+        """
+        matrix = np.asarray(templates, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10
+        centroid = matrix.mean(axis=0)
+        return (centroid / (np.linalg.norm(centroid) + 1e-10)).tolist()
+
+    def _get_embedding_cache(self):
+        """Lazily open the embedding cache if ATTENDIFY_EMBEDDING_CACHE is set"""
+        if self.embedding_cache is None and EMBEDDING_CACHE_PATH:
+            self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MB * 1024 * 1024)
+        return self.embedding_cache
+
+    def _embedding_cache_key(self, cache, image_input):
+        """Cache key for an input under the current settings, or None if it cannot be hashed"""
+        digest = image_digest(image_input)
+        if not digest:
+            return None
+        return cache.make_key(digest, self.embedding_model_id, self.detector_backend,
+                              self.max_detect_side, self.high_fidelity_crops)
+
+    def get_embedding(self, image_input, use_cache=True, gate=None):
         """
         Converts an image (path, base64, or numpy array) into a 512-dimension vector.
+        With the embedding cache enabled, images already seen (same bytes,
+        model, detector and preprocessing) skip detection and embedding entirely.
+        gate: optional QualityGate (see get_embeddings). Gated calls (camera
+        frames) bypass the cache: a hit would skip the gate, whose thresholds
+        change per camera and on reload, and live frames never repeat anyway.
+        """
+        cache = self._get_embedding_cache() if use_cache and gate is None and self.inference_available else None
+        key = None
+        if cache is not None:
+            key = self._embedding_cache_key(cache, image_input)
+            if key is not None:
+                cached = cache.get(key)
+                if cached is not None:
+                    return cached
+
+        start = time.perf_counter()
+        embeddings = self.get_embeddings(image_input, gate=gate)
+        if not embeddings:
+            return None
+        if key is not None:
+            cache.put(key, embeddings[0], compute_seconds=time.perf_counter() - start)
+        return embeddings[0]
+
+    def embedding_cache_stats(self):
+        cache = self._get_embedding_cache()
+        return cache.stats() if cache else {"enabled": False}
+
+    def get_embeddings(self, image_input, gate=None):
+        """
+        Returns one 512-dimension vector per face detected in the image.
+        gate: optional QualityGate (utils/quality_gate.py). Frames it rejects
+        skip detection, and faces it rejects skip embedding.
         """
-        if not DeepFace:
+        if not self.inference_available:
             print("DeepFace not installed. Simulated embedding used.")
-            return np.random.rand(512).tolist()
+            return [np.random.rand(512).tolist()]
 
         try:
-            input_data = self._decode_image(image_input)
-            # DeepFace.represent handles paths, base64, and numpy arrays automatically
-            embedding_objs = DeepFace.represent(
-                img_path=input_data, 
-                model_name=self.model_name,
-                enforce_detection=True,
-                detector_backend=self.detector_backend
-            )
-            return embedding_objs[0]["embedding"]
+            prepared = self._prepare(image_input)
+            input_data = prepared.image if prepared is not None else image_input
+            if gate is not None and prepared is not None:
+                with stage("quality"):
+                    rejected = gate.check_frame(prepared.image)
+                if rejected:
+                    FACES_PER_FRAME.observe(0)
+                    return []
+            embeddings = self._represent(input_data, prepared, gate)
+            FACES_PER_FRAME.observe(len(embeddings))
+            return embeddings
         except Exception as e:
-            print(f"Error processing face: {e}")
-            return None
+            print(f"Error processing faces: {e}")
+            FACES_PER_FRAME.observe(0)
+            REJECTIONS.inc(reason="no_face")
+            return []
 
-    def upload_biometrics(self, profile_id, student_id, full_name, image_input):
+    def _image_bytes(self, image_input):
         """
-        Generates embedding and saves to pending_approvals table.
+        Raw encoded bytes of a base64 string or image path (None otherwise).
+        """
+        if isinstance(image_input, str) and len(image_input) > 200:
+            encoded = image_input.split(",", 1)[1] if "," in image_input else image_input
+            return base64.b64decode(encoded)
+        if isinstance(image_input, str) and os.path.isfile(image_input):
+            with open(image_input, "rb") as f:
+                return f.read()
+        return None
+
+    def _get_enrollment_queue(self):
+        """Open the local enrollment queue and start its flusher (once)"""
+        if self.enrollment_queue is None:
+            with self._queue_lock:
+                if self.enrollment_queue is None:
+                    os.makedirs(ENROLLMENT_SPOOL_DIR, exist_ok=True)
+                    queue = WriteAheadQueue(
+                        ENROLLMENT_QUEUE_PATH,
+                        flush_fn=self._flush_enrollments,
+                        batch_size=int(os.getenv("ENROLLMENT_QUEUE_BATCH_SIZE", "20")),
+                        flush_interval=float(os.getenv("ENROLLMENT_QUEUE_FLUSH_INTERVAL", "0.5")),
+                        name="pending_approvals"
+                    )
+                    queue.start()
+                    self.enrollment_queue = queue
+        return self.enrollment_queue
+
+    def start(self):
         """
-        if not supabase:
+        Open the enrollment queue at startup, so enrollments spooled before a
+        restart are written without waiting for the next one
+        """
+        if self.supabase:
+            self._get_enrollment_queue()
+
+    def _upload_selfie(self, spool_path, selfie_url):
+        try:
+            with open(spool_path, "rb") as f:
+                img_data = f.read()
+        except FileNotFoundError:
+            # Not an outage (OSError would be retried as one): the enrollment
+            # can never succeed and must end up in the dead letters
+            raise Exception(f"Spooled selfie {spool_path} is missing")
+        try:
+            res = self.supabase.storage.from_("selfies").upload(
+                path=selfie_url,
+                file=img_data,
+                file_options={"content-type": "image/jpeg", "upsert": "true"}
+            )
+        except Exception as upload_err:
+            # A retried batch may find its selfie already stored
+            if "duplicate" in str(upload_err).lower() or "already exists" in str(upload_err).lower():
+                return
+            raise
+        if getattr(res, 'error', None):
+            raise Exception(f"Storage Error: {res.error}")
+
+    def _flush_enrollments(self, enrollments):
+        """
+        Writes a batch of queued enrollments: selfie uploads run concurrently
+        with the three batched database writes. Every step is idempotent, so
+        a failed batch is simply retried by the queue, which also isolates an
+        enrollment that keeps failing (missing bucket, foreign key) and
+        dead-letters it (see enrollment_queue_stats).
+        """
+        uploads = [e for e in enrollments if e.get("spool_path")]
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(uploads)))) as pool:
+            pending_uploads = [pool.submit(self._upload_selfie, e["spool_path"], e["selfie_url"]) for e in uploads]
+
+            with stage("db_enroll"):
+                # Create any missing profile first to avoid Foreign Key errors
+                self.supabase.table("profiles").upsert([
+                    {"id": e["profile_id"], "full_name": e["full_name"], "student_id": e["student_id"], "role": "student"}
+                    for e in enrollments
+                ], on_conflict="id", ignore_duplicates=True).execute()
+
+                # Bulk inserts need the same keys on every row
+                self.supabase.table("pending_approvals").upsert([
+                    {key: e.get(key) for key in ("enrollment_id", "profile_id", "student_id", "full_name",
+                                                 "embedding", "selfie_url", "status", "templates",
+                                                 "embedding_version")}
+                    for e in enrollments
+                ], on_conflict="enrollment_id", ignore_duplicates=True).execute()
+
+                self.supabase.table("profiles").update({"face_enrolled": True})\
+                    .in_("id", [e["profile_id"] for e in enrollments]).execute()
+
+            for future in pending_uploads:
+                future.result()
+
+        for e in uploads:
+            try:
+                os.remove(e["spool_path"])
+            except OSError:
+                pass
+
+    def upload_biometrics(self, profile_id, student_id, full_name, image_input, templates=None, wait=False):
+        """
+        Generates embedding and queues it for pending_approvals.
+        If templates (embeddings of several photos) are given, their normalized
+        centroid is stored as the embedding and the full set alongside it;
+        image_input is then only used as the selfie.
+        The image is decoded once. Returns as soon as the enrollment is durably
+        queued; the selfie upload and database writes happen in the background.
+        wait: write the enrollment before returning instead, and return any
+        failure as an error. For scripts, which exit before a queue would drain.
+        """
+        if not self.supabase:
             return {"error": "Supabase not configured."}
-            
-        if not self.check_face_quality(image_input):
-            return {"error": "Poor photo quality. Please ensure good lighting and face visibility."}
 
-        vector = self.get_embedding(image_input)
-        if not vector:
-            return {"error": "Face not detected. Please look straight at the camera."}
+        try:
+            with stage("decode"):
+                img_data = self._image_bytes(image_input)
+        except (ValueError, OSError) as e:
+            return {"error": f"Failed to read image: {str(e)}"}
+
+        if templates:
+            vector = self.compute_centroid(templates)
+        else:
+            input_data = image_input
+            if img_data:
+                prepared = prepare_bytes(img_data, self.max_detect_side)
+                if prepared is not None:
+                    input_data = prepared
+
+            if not self.check_face_quality(input_data):
+                return {"error": "Poor photo quality. Please ensure good lighting and face visibility."}
+
+            vector = self.get_embedding(input_data)
+            if not vector:
+                return {"error": "Face not detected. Please look straight at the camera."}
 
         try:
-            # --- RESILIENCE: Ensure Profile Exists ---
-            # Try to fetch the profile first
-            current_profile = supabase.table("profiles").select("*").eq("id", profile_id).execute()
-            
-            if not current_profile.data:
-                # Profile is missing, creating it now to avoid Foreign Key errors
-                print(f"Resilient Fix: Creating missing profile for {profile_id}")
-                supabase.table("profiles").insert({
-                    "id": profile_id,
-                    "full_name": full_name,
-                    "student_id": student_id,
-                    "role": "student"
-                }).execute()
-
-            # 1. Upload Selfie to Storage
-            selfie_url = None
-            if isinstance(image_input, str) and (image_input.startswith('/') or 'data:image' in image_input or len(image_input) > 200):
-                try:
-                    header, encoded = image_input.split(",", 1) if "," in image_input else (None, image_input)
-                    img_data = base64.b64decode(encoded)
-                    file_path = f"{student_id}_{int(time.time())}.jpg"
-                    
-                    res = supabase.storage.from_("selfies").upload(
-                        path=file_path,
-                        file=img_data,
-                        file_options={"content-type": "image/jpeg"}
-                    )
-                    if getattr(res, 'error', None):
-                        raise Exception(f"Storage Error: {res.error}")
-                        
-                    selfie_url = file_path
-                except Exception as upload_err:
-                    print(f"CRITICAL: Storage upload failed. {upload_err}")
-                    if "bucket_not_found" in str(upload_err).lower() or "not found" in str(upload_err).lower():
-                        return {"error": "Server Configuration Error: 'selfies' storage bucket does not exist. Please contact admin."}
-                    return {"error": f"Failed to save image: {str(upload_err)}"}
-
-            # 2. Save to pending_approvals
-            data = supabase.table("pending_approvals").insert({
+            enrollment_id = str(uuid.uuid4())
+            record = {
+                "enrollment_id": enrollment_id,
                 "profile_id": profile_id,
                 "student_id": student_id,
                 "full_name": full_name,
-                "embedding": vector,
-                "selfie_url": selfie_url,
+                "embedding": list(map(float, vector)),
+                "embedding_version": self.embedding_version,
+                "selfie_url": None,
                 "status": "pending"
-            }).execute()
-            
-            # 3. Update profile status
-            supabase.table("profiles").update({
-                "face_enrolled": True
-            }).eq("id", profile_id).execute()
-            
-            return data
+            }
+            if templates:
+                record["templates"] = [list(map(float, t)) for t in templates]
+
+            # Spool the selfie bytes so the flusher can upload them after a restart
+            if img_data:
+                os.makedirs(ENROLLMENT_SPOOL_DIR, exist_ok=True)
+                spool_path = os.path.join(ENROLLMENT_SPOOL_DIR, f"{enrollment_id}.jpg")
+                with open(spool_path, "wb") as f:
+                    f.write(img_data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                record["spool_path"] = spool_path
+                record["selfie_url"] = f"{student_id}_{int(time.time())}.jpg"
+
+            if wait:
+                try:
+                    self._flush_enrollments([record])
+                except Exception:
+                    if record.get("spool_path"):
+                        try:
+                            os.remove(record["spool_path"])
+                        except OSError:
+                            pass
+                    raise
+                return {"status": "pending", "enrollment_id": enrollment_id, "selfie_url": record["selfie_url"]}
+
+            with stage("db_write"):
+                self._get_enrollment_queue().enqueue(enrollment_id, record)
+
+            return {"status": "queued", "enrollment_id": enrollment_id, "selfie_url": record["selfie_url"]}
         except Exception as e:
             error_msg = str(e)
             print(f"Error during biometrics upload: {error_msg}")
-            return {"error": f"Database error: {error_msg}"}
+            return {"error": f"Failed to {'write' if wait else 'queue'} enrollment: {error_msg}"}
+
+    def enrollment_queue_stats(self, failed_limit=50):
+        """
+        Enrollment queue depth and flush lag (empty queue if never used),
+        plus the most recent enrollments that were given up on
+        """
+        if self.enrollment_queue is None:
+            return {"name": "pending_approvals", "depth": 0, "flush_lag_seconds": 0.0, "flusher_running": False,
+                    "dead_letters": 0, "failed": []}
+        stats = self.enrollment_queue.stats()
+        stats["failed"] = [
+            {
+                "enrollment_id": entry["key"],
+                "student_id": entry["payload"].get("student_id"),
+                "profile_id": entry["payload"].get("profile_id"),
+                "selfie_url": entry["payload"].get("selfie_url"),
+                "attempts": entry["attempts"],
+                "last_error": entry["last_error"],
+                "failed_at": entry["failed_at"]
+            }
+            for entry in self.enrollment_queue.dead_letters(failed_limit)
+        ]
+        return stats
+
+    def close(self):
+        """Stop the enrollment flusher after a final drain attempt and persist cache state"""
+        if self.enrollment_queue is not None:
+            self.enrollment_queue.stop()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+
+    def upload_biometrics_multi(self, profile_id, student_id, full_name, image_inputs, wait=False):
+        """
+        Multi-template enrollment: embeds every accepted photo in one batched
+        pass and stores the template set plus its centroid. The first image
+        is uploaded as the selfie. wait: see upload_biometrics.
+        """
+        if not image_inputs:
+            return {"error": "No photos provided."}
+
+        templates = [t for t in self.get_embeddings_batch(image_inputs) if t is not None]
+        if not templates:
+            return {"error": "Face not detected in any photo."}
+
+        print(f"Embedded {len(templates)}/{len(image_inputs)} photos as templates")
+        return self.upload_biometrics(profile_id, student_id, full_name, image_inputs[0], templates=templates, wait=wait)
 
     def approve_student(self, pending_id):
         """
         Teacher approval: Move embedding from pending_approvals to active_embeddings.
+        Returns True if approved, None if the pending record does not exist.
+        """
+        results = self.approve_students_bulk([pending_id])
+        if not results:
+            return False
+        if results[0]["result"] == "not_found":
+            return None
+        return results[0]["result"] == "approved"
+
+    def approve_students_bulk(self, pending_ids):
+        """
+        Teacher approval for any number of pending records in one database
+        transaction (approve_pending_bulk RPC). Approved students are added to
+        the in-process gallery in one step.
+        Returns one {pending_id, result, student_id, profile_id} per id, or []
+        on error.
         """
+        if not pending_ids:
+            return []
         try:
-            # 1. Get pending record
-            pending = supabase.table("pending_approvals").select("*").eq("id", pending_id).single().execute()
-            if not pending.data:
-                return None
-            
-            p_data = pending.data
-            
-            # 2. Insert into active_embeddings
-            supabase.table("active_embeddings").insert({
-                "profile_id": p_data["profile_id"],
-                "student_id": p_data["student_id"],
-                "embedding": p_data["embedding"]
-            }).execute()
-            
-            # 3. Mark profile as active
-            supabase.table("profiles").update({
-                "is_active": True
-            }).eq("id", p_data["profile_id"]).execute()
-            
-            # 4. Delete from pending (or update status)
-            supabase.table("pending_approvals").update({"status": "approved"}).eq("id", pending_id).execute()
-            
-            return True
+            with stage("db_approve"):
+                rows = self.supabase.rpc("approve_pending_bulk", {"pending_ids": list(pending_ids)}).execute().data or []
         except Exception as e:
             print(f"Error during approval: {e}")
-            return False
+            return []
 
-    def recognize_from_frame(self, frame):
+        approved = [r for r in rows if r["result"] == "approved"]
+        if approved and gallery.loaded:
+            gallery.add(approved)
+        if approved:
+            class_galleries.invalidate()
+
+        return [
+            {key: r.get(key) for key in ("pending_id", "result", "student_id", "profile_id")}
+            for r in rows
+        ]
+
+    def recognize_from_frame(self, frame, search_mode=None, class_id=None, camera_id=None):
         """
         Matches a CCTV frame against the active_embeddings database.
+        search_mode: 'centroid' (one vector per student, fastest), 'templates'
+        (every enrolled photo) or 'auto' (centroid first, templates if no match).
+        With class_id, or a camera_id whose class is in session, the class
+        roster is searched first and the whole gallery only if that misses.
+        Frames and faces failing the camera's quality gate are not matched.
         """
-        if not supabase:
+        search_mode = search_mode or self.search_mode
+        if not self.supabase:
             print("Supabase not configured.")
             return None
 
-        vector = self.get_embedding(frame)
+        vector = self.get_embedding(frame, gate=quality_gates.get(camera_id))
         if not vector: 
             return None
         
@@ -212,14 +703,70 @@ class AttendifyAI:
                 "match_threshold": 0.4, # Adjusted threshold for Cosine Similarity (1 - distance)
                 "match_count": 1
             }
-            result = supabase.rpc("match_students", rpc_params).execute()
-            return result.data
+            matches = []
+            class_id = class_id or attendance_marker.resolve_class(camera_id)
+            if class_id:
+                with stage("match_class"):
+                    roster_gallery = class_galleries.get(class_id, attendance_marker.get_class_roster, self.supabase)
+                    matches = roster_gallery.search(vector, rpc_params["match_threshold"], rpc_params["match_count"])
+                if matches:
+                    MATCHES.inc()
+                    return matches
+            if search_mode in ("centroid", "auto"):
+                with stage("match"):
+                    if gallery.loaded:
+                        # Centroids are mirrored in-process (see utils/gallery.py)
+                        matches = gallery.search(vector, rpc_params["match_threshold"], rpc_params["match_count"])
+                    else:
+                        matches = self.supabase.rpc("match_students", rpc_params).execute().data
+            if search_mode == "templates" or (search_mode == "auto" and not matches):
+                # Hard case (pose, lighting): search every enrolled template
+                with stage("match_templates"):
+                    matches = self.supabase.rpc("match_students_templates", rpc_params).execute().data
+            if matches:
+                MATCHES.inc()
+            else:
+                REJECTIONS.inc(reason="no_match")
+            return matches
         except Exception as e:
             print(f"Error searching active_embeddings: {e}")
             return None
 
-# Create a singleton instance
-face_engine = AttendifyAI()
+    def recognize_and_mark(self, frame, class_id=None, camera_id="cctv_main"):
+        """
+        Embeds every face in a frame and matches + marks them all in a single
+        database round trip. Returns per-face outcomes.
+        """
+        vectors = self.get_embeddings(frame, gate=quality_gates.get(camera_id))
+        if not vectors:
+            return []
+
+        return attendance_marker.recognize_and_mark(
+            vectors,
+            class_id=class_id,
+            camera_id=camera_id,
+            match_threshold=0.4
+        )
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_face_engine():
+    """
+    Returns the process-wide AttendifyAI instance, creating it on first call.
+    Creating it is cheap: models and clients load on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AttendifyAI()
+    return _engine
+
 
-# Create a singleton instance
-face_engine = AttendifyAI()
+def __getattr__(name):
+    # `from utils.face_engine import face_engine` keeps working
+    if name == "face_engine":
+        return get_face_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
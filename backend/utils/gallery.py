@@ -0,0 +1,461 @@
+"""
+Embedding Gallery
+In-process copy of active_embeddings for matching without a database round trip
+
+With ATTENDIFY_GALLERY_SHARED_DIR set (e.g. a directory under /dev/shm),
+the gallery is a memory-mapped snapshot shared read-only by every uvicorn
+worker instead of one private copy per process.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process gallery is available
+    fcntl = None
+
+EMBEDDING_DIM = 512
+GALLERY_SHARED_DIR = os.getenv("ATTENDIFY_GALLERY_SHARED_DIR")
+
+
+def _to_vector(embedding) -> np.ndarray:
+    """pgvector values arrive as '[0.1,...]' strings through PostgREST"""
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def _load_mapped(path: str) -> np.ndarray:
+    """Read-only memory map of a .npy file (plain load for empty arrays)"""
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        return np.load(path)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
+
+
+class EmbeddingGallery:
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        """
+        Initialize an empty gallery
+
+        Rows are L2-normalized on the way in, so a search is one matrix-vector
+        product. Updates build new arrays and swap them in under the lock;
+        searches work on whatever snapshot they picked up.
+        """
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._student_ids: List[str] = []
+        self._profile_ids: List[Optional[str]] = []
+        self.loaded = False
+        self.version = 0
+        self.loaded_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._student_ids)
+
+    def _snapshot(self):
+        """Current (matrix, student_ids, profile_ids)"""
+        with self._lock:
+            return self._matrix, self._student_ids, self._profile_ids
+
+    def _update(self, change: Callable):
+        """
+        Apply change(matrix, student_ids, profile_ids) -> new triple (or None
+        for no change) and swap the result in
+        """
+        with self._lock:
+            result = change(self._matrix, self._student_ids, self._profile_ids)
+            if result is None:
+                return
+            self._matrix, self._student_ids, self._profile_ids = result
+            self.version += 1
+
+    @staticmethod
+    def _fetch_rows(client, page_size: int) -> List[Dict]:
+        rows = []
+        offset = 0
+        while True:
+            page = client.table("active_embeddings")\
+                .select("student_id, profile_id, embedding")\
+                .order("student_id")\
+                .range(offset, offset + page_size - 1)\
+                .execute().data or []
+            rows.extend(page)
+            if len(page) < page_size:
+                break
+            offset += page_size
+        return rows
+
+    def load(self, client, page_size: int = 1000) -> int:
+        """
+        Replace the gallery with the contents of active_embeddings
+
+        Args:
+            client: Supabase client
+            page_size: Rows fetched per request
+
+        Returns:
+            Number of students loaded
+        """
+        rows = self._fetch_rows(client, page_size)
+        self._update(lambda *_: (np.zeros((0, self.dim), dtype=np.float32), [], []))
+        self.add(rows)
+        self.loaded = True
+        self.loaded_at = time.time()
+        return len(self)
+
+    def add(self, entries: Iterable[Dict]):
+        """
+        Add or replace students in one step
+
+        Args:
+            entries: Dictionaries with student_id, profile_id and embedding
+        """
+        entries = [e for e in entries if e.get("embedding") is not None]
+        if not entries:
+            return
+        new_rows = _normalize(np.stack([_to_vector(e["embedding"]) for e in entries]))
+        replaced = {e["student_id"] for e in entries}
+
+        def change(matrix, student_ids, profile_ids):
+            keep = [i for i, sid in enumerate(student_ids) if sid not in replaced]
+            return (
+                np.concatenate([matrix[keep], new_rows]),
+                [student_ids[i] for i in keep] + [e["student_id"] for e in entries],
+                [profile_ids[i] for i in keep] + [e.get("profile_id") for e in entries]
+            )
+
+        self._update(change)
+
+    def remove(self, student_ids: Iterable[str]):
+        """Remove students from the gallery"""
+        removed = set(student_ids)
+
+        def change(matrix, student_ids, profile_ids):
+            keep = [i for i, sid in enumerate(student_ids) if sid not in removed]
+            if len(keep) == len(student_ids):
+                return None
+            return matrix[keep], [student_ids[i] for i in keep], [profile_ids[i] for i in keep]
+
+        self._update(change)
+
+    def search(self, query_embedding, match_threshold: float = 0.4, match_count: int = 1) -> List[Dict]:
+        """
+        Cosine-similarity search, same result shape as the match_students RPC
+
+        Returns:
+            Up to match_count {student_id, profile_id, similarity}, best first
+        """
+        matrix, student_ids, profile_ids = self._snapshot()
+        if not len(student_ids):
+            return []
+
+        query = _to_vector(query_embedding)
+        similarities = matrix @ (query / (np.linalg.norm(query) + 1e-10))
+        count = min(match_count, len(student_ids))
+        top = np.argpartition(-similarities, count - 1)[:count]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            {"student_id": str(student_ids[i]), "profile_id": profile_ids[i] or None, "similarity": float(similarities[i])}
+            for i in top if similarities[i] > match_threshold
+        ]
+
+    def export(self):
+        """Current rows as (matrix, student_ids, profile_ids), e.g. for a snapshot"""
+        matrix, student_ids, profile_ids = self._snapshot()
+        return matrix, [str(s) for s in student_ids], [p or None for p in profile_ids]
+
+    def restore(self, matrix: np.ndarray, student_ids: List[str], profile_ids: List[Optional[str]]):
+        """Replace the gallery with already-normalized rows (from export())"""
+        self._update(lambda *_: (
+            np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim),
+            list(student_ids),
+            list(profile_ids)
+        ))
+        self.loaded = True
+        self.loaded_at = time.time()
+
+    def subset(self, student_ids: Iterable[str]) -> "EmbeddingGallery":
+        """
+        New in-process gallery holding only the given students' rows
+        (copied out of the current snapshot)
+        """
+        matrix, all_ids, profile_ids = self._snapshot()
+        wanted = set(student_ids)
+        keep = [i for i, sid in enumerate(all_ids) if sid in wanted]
+        part = EmbeddingGallery(self.dim)
+        part._update(lambda *_: (
+            np.array(matrix[keep], dtype=np.float32).reshape(-1, self.dim),
+            [str(all_ids[i]) for i in keep],
+            [profile_ids[i] or None for i in keep]
+        ))
+        part.loaded = True
+        part.loaded_at = time.time()
+        return part
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self.loaded,
+            "students": len(self),
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "bytes": int(self._matrix.nbytes)
+        }
+
+
+class SharedGallery(EmbeddingGallery):
+    CURRENT = "CURRENT"
+    LOCK = "build.lock"
+
+    def __init__(self, directory: str, dim: int = EMBEDDING_DIM, reuse_seconds: float = 300.0):
+        """
+        Gallery kept as memory-mapped .npy snapshots in a shared directory
+
+        Each snapshot is a generation-N/ directory holding the matrix and the
+        id arrays. CURRENT names the live generation and is swapped with
+        os.replace, so a reader sees either the old or the new snapshot,
+        never half of one. Workers map the snapshot read-only: the pages live
+        once in the page cache (tmpfs under /dev/shm) however many workers
+        there are. Writers serialize on an flock and always start from the
+        latest generation, so concurrent approvals in different workers do
+        not lose each other's rows. The flock also serializes threads (each
+        call opens its own descriptor); the in-process lock only guards
+        swapping the mapped arrays, so searches never wait on a writer's
+        disk or network I/O.
+
+        Args:
+            directory: Snapshot directory, shared by all workers on the host
+            dim: Embedding dimension
+            reuse_seconds: load() maps an existing snapshot this recent
+                           instead of querying the database again, so
+                           workers starting together build it only once
+        """
+        if fcntl is None:
+            raise RuntimeError("SharedGallery needs POSIX file locking (fcntl)")
+        super().__init__(dim)
+        self.directory = directory
+        self.reuse_seconds = reuse_seconds
+        self._current_stat = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.directory, *parts)
+
+    def _read_current(self) -> Optional[Dict]:
+        try:
+            with open(self._path(self.CURRENT), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _map(self, current: Dict):
+        """Map a generation read-only and make it this worker's snapshot"""
+        folder = self._path(current["folder"])
+        matrix = _load_mapped(os.path.join(folder, "matrix.npy"))
+        student_ids = _load_mapped(os.path.join(folder, "student_ids.npy"))
+        profile_ids = _load_mapped(os.path.join(folder, "profile_ids.npy"))
+        with self._lock:
+            if self.loaded and current["generation"] < self.version:
+                return  # A concurrent refresh already mapped something newer
+            self._matrix, self._student_ids, self._profile_ids = matrix, student_ids, profile_ids
+            self.version = current["generation"]
+            self.loaded_at = current["built_at"]
+            self.loaded = True
+
+    def _refresh(self):
+        """Switch to a newer generation if CURRENT was replaced (one stat call)"""
+        try:
+            st = os.stat(self._path(self.CURRENT))
+        except OSError:
+            return
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == self._current_stat:
+            return
+        current = self._read_current()
+        if current is not None and current["generation"] != self.version:
+            self._map(current)
+        self._current_stat = key
+
+    def attach(self) -> bool:
+        """
+        Map the live generation, if there is one, without touching the
+        database (workers that follow another worker's sync)
+
+        Returns:
+            True if a snapshot is mapped
+        """
+        self._refresh()
+        return self.loaded
+
+    def _publish(self, matrix, student_ids, profile_ids):
+        """Write the next generation and point CURRENT at it (caller holds the flock)"""
+        generation = self.version + 1
+        folder = f"generation-{generation:08d}"
+        tmp = self._path(f".{folder}.{os.getpid()}")
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "matrix.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+        # Fixed-width string arrays map like the matrix; None is stored as ''
+        np.save(os.path.join(tmp, "student_ids.npy"), np.array([str(s) for s in student_ids], dtype=str).reshape(-1))
+        np.save(os.path.join(tmp, "profile_ids.npy"), np.array([str(p or "") for p in profile_ids], dtype=str).reshape(-1))
+        # Left behind if a writer died before updating CURRENT
+        shutil.rmtree(self._path(folder), ignore_errors=True)
+        os.replace(tmp, self._path(folder))
+
+        current = {"generation": generation, "folder": folder, "students": len(student_ids), "built_at": time.time()}
+        with open(self._path(self.CURRENT + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(current, f)
+        os.replace(self._path(self.CURRENT + ".tmp"), self._path(self.CURRENT))
+        self._map(current)
+        self._current_stat = None
+
+        # Workers still mapping an older generation keep it alive after unlink
+        for name in os.listdir(self.directory):
+            if name.startswith("generation-") and name < f"generation-{generation - 1:08d}":
+                shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def _locked(self):
+        lock_file = open(self._path(self.LOCK), "a+")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _snapshot(self):
+        self._refresh()
+        with self._lock:
+            return self._matrix, self._student_ids, self._profile_ids
+
+    def _update(self, change: Callable):
+        lock_file = self._locked()
+        try:
+            self._refresh()
+            with self._lock:
+                matrix, student_ids, profile_ids = self._matrix, self._student_ids, self._profile_ids
+            result = change(matrix, student_ids, profile_ids)
+            if result is not None:
+                self._publish(*result)
+        finally:
+            lock_file.close()
+
+    def load(self, client, page_size: int = 1000) -> int:
+        """
+        Map the shared snapshot, building it from active_embeddings only if
+        there is none from the last reuse_seconds
+        """
+        lock_file = self._locked()
+        try:
+            current = self._read_current()
+            if current is not None and time.time() - current["built_at"] < self.reuse_seconds:
+                self._map(current)
+                return len(self)
+            self._refresh()
+            rows = [r for r in self._fetch_rows(client, page_size) if r.get("embedding") is not None]
+            matrix = _normalize(np.stack([_to_vector(r["embedding"]) for r in rows])) if rows \
+                else np.zeros((0, self.dim), dtype=np.float32)
+            self._publish(matrix, [r["student_id"] for r in rows], [r.get("profile_id") for r in rows])
+        finally:
+            lock_file.close()
+        return len(self)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({"shared": True, "directory": self.directory, "generation": self.version})
+        return stats
+
+
+class ClassGalleries:
+    def __init__(self, ttl_seconds: float = 300.0, max_classes: int = 256):
+        """
+        Cache of per-class sub-galleries (the class roster's embeddings)
+
+        A class is a few dozen students, so searching its sub-gallery costs a
+        tiny fraction of a full search and cannot match someone from another
+        class. Sub-galleries are cut from the global gallery when it is
+        loaded, otherwise fetched from active_embeddings for the roster only.
+        Entries are rebuilt after ttl_seconds (roster changes) or when the
+        global gallery changes version.
+
+        Args:
+            ttl_seconds: Maximum age of a cached sub-gallery
+            max_classes: Classes kept; the oldest entry is dropped beyond this
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_classes = max_classes
+        self._lock = threading.Lock()
+        self._entries: Dict[str, tuple] = {}
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, class_id: str, roster_fn: Callable[[str], List[str]], client=None,
+            page_size: int = 200) -> EmbeddingGallery:
+        """
+        Sub-gallery for a class, built on first use
+
+        Args:
+            class_id: Class ID
+            roster_fn: Returns the class's student IDs
+            client: Supabase client, used when the global gallery is not loaded
+            page_size: Student IDs per active_embeddings request
+        """
+        source_version = gallery.version if gallery.loaded else None
+        with self._lock:
+            entry = self._entries.get(class_id)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds and entry[2] == source_version:
+                self.hits += 1
+                return entry[0]
+
+        roster = roster_fn(class_id)
+        if gallery.loaded:
+            part = gallery.subset(roster)
+        else:
+            rows = []
+            for start in range(0, len(roster), page_size):
+                rows.extend(client.table("active_embeddings")
+                    .select("student_id, profile_id, embedding")
+                    .in_("student_id", roster[start:start + page_size])
+                    .execute().data or [])
+            part = EmbeddingGallery(gallery.dim)
+            part.add(rows)
+            part.loaded = True
+            part.loaded_at = time.time()
+
+        with self._lock:
+            self.builds += 1
+            self._entries[class_id] = (part, time.monotonic(), source_version)
+            while len(self._entries) > self.max_classes:
+                oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                del self._entries[oldest]
+        return part
+
+    def invalidate(self, class_id: Optional[str] = None):
+        """Drop one class's sub-gallery, or all of them"""
+        with self._lock:
+            if class_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(class_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "classes": len(self._entries),
+                "students": sum(len(entry[0]) for entry in self._entries.values()),
+                "hits": self.hits,
+                "builds": self.builds,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+
+# Create singleton instances
+gallery = SharedGallery(GALLERY_SHARED_DIR) if GALLERY_SHARED_DIR else EmbeddingGallery()
+class_galleries = ClassGalleries(float(os.getenv("ATTENDIFY_CLASS_GALLERY_TTL", "300")))
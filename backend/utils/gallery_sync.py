@@ -0,0 +1,351 @@
+"""
+Gallery Sync
+Keeps the in-process gallery current with incremental pulls from active_embeddings
+
+A cold start loads the last binary snapshot and then fetches only rows
+changed since it was written (updated_at) plus deletions (tombstones), both
+from database_updates_v12_embedding_changes.sql. A background thread repeats
+the delta pull and rewrites the snapshot periodically.
+
+With a SharedGallery, one worker per host (whoever holds an flock on
+sync.lock in the shared directory) pulls and publishes; the others map
+what it publishes and take over when it exits.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from utils.gallery import EmbeddingGallery, SharedGallery, gallery, _normalize, _to_vector
+from utils.metrics import metrics
+
+GALLERY_SNAPSHOT_PATH = os.getenv("ATTENDIFY_GALLERY_SNAPSHOT", "gallery_snapshot.npz")
+GALLERY_SYNC_INTERVAL = float(os.getenv("ATTENDIFY_GALLERY_SYNC_INTERVAL", "30"))
+GALLERY_SNAPSHOT_INTERVAL = float(os.getenv("ATTENDIFY_GALLERY_SNAPSHOT_INTERVAL", "600"))
+
+SYNC_ROWS = metrics.counter(
+    "attendify_gallery_sync_rows_total",
+    "Rows applied to the gallery by incremental sync, by kind",
+    ["kind"]
+)
+SYNC_SECONDS = metrics.gauge(
+    "attendify_gallery_sync_seconds",
+    "Duration of the last gallery sync, by kind",
+    ["kind"]
+)
+
+
+def _parse(timestamp: Optional[str]) -> Optional[datetime]:
+    """PostgREST timestamp (or None) as a datetime"""
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+
+
+def _now_like(reference: datetime) -> datetime:
+    """Current time, timezone-aware only if reference is"""
+    return datetime.now(timezone.utc) if reference.tzinfo else datetime.now()
+
+
+class GallerySync:
+    def __init__(
+        self,
+        gallery: EmbeddingGallery,
+        snapshot_path: str = GALLERY_SNAPSHOT_PATH,
+        overlap_seconds: float = 60.0,
+        page_size: int = 1000
+    ):
+        """
+        Initialize the sync for a gallery
+
+        Args:
+            gallery: Gallery to keep current
+            snapshot_path: .npz file for the binary snapshot
+            overlap_seconds: updated_at is the writing transaction's start
+                             time, so a transaction still open during a pull
+                             can later commit rows stamped before the cursor.
+                             Each pull therefore also re-reads rows stamped
+                             within this long before the previous pull;
+                             re-applying them is harmless.
+            page_size: Rows fetched per request
+        """
+        self.gallery = gallery
+        self.snapshot_path = snapshot_path
+        self.overlap_seconds = overlap_seconds
+        self.page_size = page_size
+        self.cursor: Optional[datetime] = None  # Latest server timestamp seen
+        self._pulled_at: Optional[datetime] = None  # When the previous delta pull started
+        self.last_sync: Optional[float] = None
+        self.last_snapshot: Optional[float] = None
+        self.changes_since_snapshot = 0
+        # Rows and tombstones seen by the previous pull, by id -> timestamp:
+        # the overlap re-reads them, and unchanged ones are not re-applied
+        self._recent: Dict[tuple, Optional[str]] = {}
+        self._leader_file = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fetch(self, client, table: str, columns: str, column: str, since: Optional[datetime]) -> List[Dict]:
+        rows = []
+        offset = 0
+        while True:
+            query = client.table(table).select(columns)
+            if since is not None:
+                query = query.gt(column, since.isoformat())
+            # A unique sort key keeps offset paging from skipping rows
+            page = query.order("id")\
+                .range(offset, offset + self.page_size - 1)\
+                .execute().data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    @property
+    def leader(self) -> bool:
+        """Whether this worker runs the sync for its host"""
+        return not isinstance(self.gallery, SharedGallery) or self._leader_file is not None
+
+    def _try_lead(self) -> bool:
+        """
+        Become the host's sync leader if no other worker is (non-blocking).
+        The flock is held until stop() or process exit, so another worker
+        takes over when the leader goes away.
+        """
+        if self.leader:
+            return True
+        import fcntl  # SharedGallery already requires it
+        lock_file = open(os.path.join(self.gallery.directory, "sync.lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_file = lock_file
+        return True
+
+    def _advance(self, timestamps):
+        timestamps = [_parse(t) for t in timestamps if t]
+        if timestamps:
+            latest = max(timestamps)
+            if self.cursor is None or latest > self.cursor:
+                self.cursor = latest
+
+    def full_sync(self, client) -> int:
+        """
+        Rebuild the gallery from the whole table
+
+        Returns:
+            Number of students loaded
+        """
+        start = time.perf_counter()
+        with self._lock:
+            rows = self._fetch(client, "active_embeddings", "id, student_id, profile_id, embedding, updated_at",
+                               "updated_at", None)
+            rows = [r for r in rows if r.get("embedding") is not None]
+            # Oldest first, so a student's newest row wins
+            rows.sort(key=lambda r: str(r.get("updated_at") or ""))
+            matrix = _normalize(np.stack([_to_vector(r["embedding"]) for r in rows])) if rows \
+                else np.zeros((0, self.gallery.dim), dtype=np.float32)
+            latest = {r["student_id"]: i for i, r in enumerate(rows)}
+            keep = sorted(latest.values())
+            self.gallery.restore(matrix[keep], [rows[i]["student_id"] for i in keep],
+                                 [rows[i].get("profile_id") for i in keep])
+            self.cursor = None
+            self._pulled_at = None
+            self._recent = {}
+            self._advance(r.get("updated_at") for r in rows)
+            self.last_sync = time.time()
+            self.changes_since_snapshot += len(keep)
+        SYNC_ROWS.inc(len(keep), kind="full")
+        SYNC_SECONDS.set(time.perf_counter() - start, kind="full")
+        return len(self.gallery)
+
+    def sync(self, client) -> Dict:
+        """
+        Apply rows changed and deleted since the cursor
+
+        Returns:
+            {"upserted", "deleted", "cursor"}
+        """
+        if self.cursor is None:
+            return {"upserted": self.full_sync(client), "deleted": 0, "cursor": self.stats()["cursor"]}
+
+        start = time.perf_counter()
+        with self._lock:
+            since = self.cursor
+            if self._pulled_at is not None:
+                since = min(since, self._pulled_at - timedelta(seconds=self.overlap_seconds))
+            self._pulled_at = _now_like(self.cursor)
+            changed = self._fetch(client, "active_embeddings", "id, student_id, profile_id, embedding, updated_at",
+                                  "updated_at", since)
+            deleted = self._fetch(client, "active_embeddings_tombstones", "id, student_id, deleted_at",
+                                  "deleted_at", since)
+
+            # A delete only counts if the student was not (re)written after it
+            written_at = {}
+            for r in changed:
+                stamp = _parse(r.get("updated_at"))
+                if stamp is not None and (r["student_id"] not in written_at or stamp > written_at[r["student_id"]]):
+                    written_at[r["student_id"]] = stamp
+            removed = [
+                t["student_id"] for t in deleted
+                if t.get("student_id") and (t["student_id"] not in written_at
+                                            or _parse(t.get("deleted_at")) > written_at[t["student_id"]])
+                and self._recent.get(("tombstone", t["id"])) != t.get("deleted_at")
+            ]
+            # Rows re-read only because of the overlap are already applied;
+            # skipping them avoids rebuilding (and republishing) the gallery
+            fresh = [r for r in changed if self._recent.get(("row", r["id"])) != r.get("updated_at")]
+
+            if removed:
+                self.gallery.remove(removed)
+            if fresh:
+                self.gallery.add(fresh)
+            self._advance([r.get("updated_at") for r in changed] + [t.get("deleted_at") for t in deleted])
+            # The next pull starts no earlier than this one, so only this pull's rows can come back
+            self._recent = {("row", r["id"]): r.get("updated_at") for r in changed}
+            self._recent.update({("tombstone", t["id"]): t.get("deleted_at") for t in deleted})
+            self.last_sync = time.time()
+            self.changes_since_snapshot += len(fresh) + len(removed)
+
+        SYNC_ROWS.inc(len(fresh), kind="upsert")
+        SYNC_ROWS.inc(len(removed), kind="delete")
+        SYNC_SECONDS.set(time.perf_counter() - start, kind="delta")
+        return {"upserted": len(fresh), "deleted": len(removed), "cursor": self.stats()["cursor"]}
+
+    def save_snapshot(self) -> bool:
+        """
+        Write the gallery and cursor to snapshot_path (atomic replace)
+
+        Returns:
+            True if written
+        """
+        with self._lock:
+            if self.cursor is None:
+                return False
+            matrix, student_ids, profile_ids = self.gallery.export()
+            cursor = self.cursor
+            self.changes_since_snapshot = 0
+
+        tmp = f"{self.snapshot_path}.tmp.npz"
+        np.savez(
+            tmp,
+            matrix=np.ascontiguousarray(matrix, dtype=np.float32),
+            student_ids=np.array(student_ids, dtype=str).reshape(-1),
+            profile_ids=np.array([p or "" for p in profile_ids], dtype=str).reshape(-1),
+            cursor=np.array(cursor.isoformat()),
+            dim=np.array(self.gallery.dim)
+        )
+        os.replace(tmp, self.snapshot_path)
+        self.last_snapshot = time.time()
+        return True
+
+    def load_snapshot(self) -> bool:
+        """
+        Restore the gallery and cursor from snapshot_path
+
+        Returns:
+            False if there is no usable snapshot
+        """
+        try:
+            with np.load(self.snapshot_path, allow_pickle=False) as data:
+                if int(data["dim"]) != self.gallery.dim:
+                    return False
+                matrix = data["matrix"]
+                student_ids = [str(s) for s in data["student_ids"]]
+                profile_ids = [str(p) or None for p in data["profile_ids"]]
+                cursor = _parse(str(data["cursor"]))
+        except (OSError, KeyError, ValueError) as e:
+            if os.path.exists(self.snapshot_path):
+                print(f"Ignoring unreadable gallery snapshot {self.snapshot_path}: {e}")
+            return False
+
+        with self._lock:
+            self.gallery.restore(matrix, student_ids, profile_ids)
+            self.cursor = cursor
+            self._recent = {}
+            self.last_snapshot = os.path.getmtime(self.snapshot_path)
+            # Rows committed late, just before the snapshot, are re-read too
+            written = datetime.fromtimestamp(self.last_snapshot, timezone.utc)
+            self._pulled_at = written if cursor.tzinfo else written.astimezone().replace(tzinfo=None)
+        return True
+
+    def start(self, client, interval: float = GALLERY_SYNC_INTERVAL,
+              snapshot_interval: float = GALLERY_SNAPSHOT_INTERVAL) -> Dict:
+        """
+        Cold start (snapshot + delta, or a full pull) and start the background loop
+
+        A worker that is not its host's sync leader only maps the shared
+        gallery (building it if no worker has yet); its loop keeps trying
+        to take over.
+
+        Returns:
+            stats() after the initial sync
+        """
+        if self._try_lead():
+            if self.load_snapshot():
+                print(f"Gallery snapshot loaded: {len(self.gallery)} students, syncing since {self.cursor}")
+            self.sync(client)
+            if self.changes_since_snapshot:
+                self.save_snapshot()
+        elif not self.gallery.attach():
+            self.gallery.load(client)
+
+        if self._thread is None and interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(client, interval, snapshot_interval),
+                name="gallery-sync", daemon=True
+            )
+            self._thread.start()
+        return self.stats()
+
+    def _run(self, client, interval: float, snapshot_interval: float):
+        while not self._stop.wait(interval):
+            try:
+                if not self.leader:
+                    if not self._try_lead():
+                        continue
+                    # The shared gallery is current; a full pull (not the last
+                    # .npz) avoids publishing older rows over it
+                    print("Gallery sync: taking over as this host's sync leader")
+                    self.cursor = None
+                self.sync(client)
+                due = self.last_snapshot is None or time.time() - self.last_snapshot >= snapshot_interval
+                if self.changes_since_snapshot and due:
+                    self.save_snapshot()
+            except Exception as e:
+                print(f"Gallery sync failed: {e}")
+
+    def stop(self, save: bool = True):
+        """Stop the background loop, writing a final snapshot if anything changed"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if save and self.changes_since_snapshot:
+            self.save_snapshot()
+        if self._leader_file is not None:
+            self._leader_file.close()
+            self._leader_file = None
+
+    def stats(self) -> Dict:
+        return {
+            "students": len(self.gallery),
+            "cursor": self.cursor.isoformat() if self.cursor else None,
+            "last_sync": self.last_sync,
+            "last_snapshot": self.last_snapshot,
+            "changes_since_snapshot": self.changes_since_snapshot,
+            "snapshot_path": self.snapshot_path,
+            "leader": self.leader,
+            "running": self._thread is not None
+        }
+
+
+# Create singleton instance
+gallery_sync = GallerySync(gallery)
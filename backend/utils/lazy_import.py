@@ -0,0 +1,63 @@
+"""
+Lazy Imports
+Defer heavy optional dependencies (DeepFace, TensorFlow) until first use
+"""
+
+import importlib
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        """
+        Stand-in for a module that is imported on first attribute access
+
+        Truth-testing imports it too and is False if it is not installed, so
+        `if not DeepFace:` keeps working as it did with a try/except import.
+
+        Args:
+            name: Dotted module name (e.g. 'deepface.DeepFace')
+        """
+        self._name = name
+        self._module = None
+        self._error: Optional[ImportError] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None and self._error is None:
+            with self._lock:
+                if self._module is None and self._error is None:
+                    start = time.perf_counter()
+                    try:
+                        self._module = importlib.import_module(self._name)
+                    except ImportError as e:
+                        self._error = e
+                    IMPORT_SECONDS[self._name] = round(time.perf_counter() - start, 3)
+        return self._module
+
+    def __bool__(self) -> bool:
+        return self._load() is not None
+
+    def __getattr__(self, attr):
+        module = self._load()
+        if module is None:
+            raise ImportError(f"{self._name} is not installed") from self._error
+        return getattr(module, attr)
+
+    @property
+    def loaded(self) -> bool:
+        """True once imported, without triggering the import"""
+        return self._module is not None
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "failed" if self._error else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+# Seconds spent importing each lazy module, for startup diagnostics
+IMPORT_SECONDS: Dict[str, float] = {}
+
+DeepFace = LazyModule("deepface.DeepFace")
+deepface_preprocessing = LazyModule("deepface.modules.preprocessing")
@@ -0,0 +1,207 @@
+"""
+Model Registry
+Lazily loaded, process-wide face detector and embedding models
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Tuple
+from utils.metrics import metrics
+from utils.lazy_import import DeepFace
+
+MODEL_LOAD_SECONDS = metrics.gauge(
+    "attendify_model_load_seconds",
+    "Time taken to load a model into the registry",
+    ["kind", "name"]
+)
+MODEL_MEMORY_BYTES = metrics.gauge(
+    "attendify_model_memory_bytes",
+    "Resident memory added while loading a model",
+    ["kind", "name"]
+)
+
+# Detectors served by OpenCV directly rather than through DeepFace
+HAAR_DETECTORS = ("opencv_haar", "haarcascade")
+# Detectors run from an exported ONNX file (see utils/onnx_backend.py)
+ONNX_DETECTORS = ("yunet",)
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (0 if unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak RSS; kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+def _load_haar_detector(name: str):
+    import cv2
+    return cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+
+def _load_onnx_detector(name: str):
+    from utils.onnx_backend import load_detector
+    return load_detector()
+
+
+def _load_deepface_detector(name: str):
+    if not DeepFace:
+        raise RuntimeError("DeepFace is not installed")
+    try:
+        # deepface >= 0.0.93
+        return DeepFace.build_model(model_name=name, task="face_detector")
+    except TypeError:
+        try:
+            from deepface.detectors import DetectorWrapper
+            return DetectorWrapper.build_model(name)
+        except ImportError:
+            from deepface.detectors import FaceDetector
+            return FaceDetector.build_model(name)
+
+
+def _load_embedding_model(name: str):
+    if "@" in name:
+        # "<model>@<runtime>": exported model on onnxruntime or opencv
+        from utils.onnx_backend import load_embedder
+        model_name, runtime = name.split("@", 1)
+        return load_embedder(model_name, runtime)
+    if not DeepFace:
+        raise RuntimeError("DeepFace is not installed")
+    return DeepFace.build_model(name)
+
+
+class ModelRegistry:
+    def __init__(self):
+        """Initialize an empty registry; models load on first use"""
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._stats: Dict[Tuple[str, str], Dict] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, loader):
+        key = (kind, name)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        # Per-model lock: concurrent first requests load it once
+        with key_lock:
+            model = self._models.get(key)
+            if model is not None:
+                return model
+
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model = loader(name)
+            load_seconds = time.perf_counter() - start
+            memory_bytes = max(0, _rss_bytes() - rss_before)
+
+            self._models[key] = model
+            self._stats[key] = {
+                "kind": kind,
+                "name": name,
+                "load_seconds": round(load_seconds, 3),
+                "memory_bytes": memory_bytes
+            }
+            MODEL_LOAD_SECONDS.set(load_seconds, kind=kind, name=name)
+            MODEL_MEMORY_BYTES.set(memory_bytes, kind=kind, name=name)
+            print(f"Loaded {kind} '{name}' in {load_seconds:.2f}s (+{memory_bytes / 1e6:.0f} MB)")
+            return model
+
+    def get_detector(self, backend: str):
+        """
+        Get a face detector by backend name
+
+        Args:
+            backend: 'opencv_haar' for OpenCV's Haar cascade, or any DeepFace
+                     detector backend ('mtcnn', 'retinaface', 'opencv', ...).
+                     DeepFace detectors are also what DeepFace.extract_faces
+                     reuses internally, so loading here warms that path.
+                     'yunet' for the exported ONNX detector.
+        """
+        if backend in HAAR_DETECTORS:
+            loader = _load_haar_detector
+        elif backend in ONNX_DETECTORS:
+            loader = _load_onnx_detector
+        else:
+            loader = _load_deepface_detector
+        return self._get("detector", backend, loader)
+
+    def ensure_detector(self, backend: str) -> bool:
+        """
+        Warm a detector that is used indirectly (through DeepFace.extract_faces)
+
+        Unlike get_detector(), failures are remembered and reported in stats()
+        instead of raised, so a warm-up problem never breaks detection itself.
+        """
+        key = ("detector", backend)
+        if key in self._models:
+            return True
+        if "error" in self._stats.get(key, {}):
+            return False
+        try:
+            self.get_detector(backend)
+            return True
+        except Exception as e:
+            self._stats[key] = {"kind": "detector", "name": backend, "error": str(e)}
+            return False
+
+    def get_embedding_model(self, model_name: str):
+        """
+        Get a face embedding model by name (e.g. 'Facenet512')
+
+        'Facenet512@onnxruntime' or 'Facenet512@opencv' load the exported
+        ONNX model on that runtime instead of the TensorFlow one.
+        """
+        return self._get("embedding", model_name, _load_embedding_model)
+
+    def preload(
+        self,
+        detectors: Iterable[str] = (),
+        embedding_models: Iterable[str] = ()
+    ) -> Dict[str, Dict]:
+        """
+        Load an explicit set of models up front
+
+        Args:
+            detectors: Detector backend names
+            embedding_models: Embedding model names
+
+        Returns:
+            stats() after loading; models that failed are reported with an error
+        """
+        for backend in detectors:
+            self.ensure_detector(backend)
+        for model_name in embedding_models:
+            try:
+                self.get_embedding_model(model_name)
+            except Exception as e:
+                self._stats[("embedding", model_name)] = {"kind": "embedding", "name": model_name, "error": str(e)}
+        return self.stats()
+
+    def is_loaded(self, kind: str, name: str) -> bool:
+        return (kind, name) in self._models
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Load time and memory per model
+
+        Returns:
+            Dictionary keyed by "<kind>:<name>"
+        """
+        return {f"{kind}:{name}": dict(info) for (kind, name), info in self._stats.items()}
+
+
+# Create singleton instance
+model_registry = ModelRegistry()
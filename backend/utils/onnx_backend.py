@@ -0,0 +1,221 @@
+"""
+Exported Model Backend
+Facenet512 and YuNet face detection from ONNX files, run through ONNX Runtime
+or OpenCV DNN instead of TensorFlow
+
+Produce the ONNX files with scripts/export_onnx_models.py. Both runtimes take
+the embedding model in NCHW layout, so it is exported with inputs_as_nchw.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from utils.lazy_import import LazyModule
+
+onnxruntime = LazyModule("onnxruntime")
+
+RUNTIMES = ("onnxruntime", "opencv")
+# DeepFace models with an exported ONNX file (scripts/export_onnx_models.py)
+EXPORTED_MODELS = ("Facenet512",)
+
+FACENET_ONNX_PATH = os.getenv("ATTENDIFY_FACENET_ONNX", "models/facenet512.onnx")
+DETECTOR_ONNX_PATH = os.getenv("ATTENDIFY_DETECTOR_ONNX", "models/face_detection_yunet_2023mar.onnx")
+# Intra-op threads for inference (0 = runtime default, usually one per core)
+INFERENCE_THREADS = int(os.getenv("ATTENDIFY_INFERENCE_THREADS", "0"))
+
+
+def resize_face(face: np.ndarray, target_size=(160, 160)) -> np.ndarray:
+    """
+    Letterbox a face to target_size (h, w) and add a batch axis
+
+    Same steps as deepface.modules.preprocessing.resize_image, so the
+    exported models see exactly the input the TensorFlow path feeds them.
+    """
+    factor = min(target_size[0] / face.shape[0], target_size[1] / face.shape[1])
+    size = (int(face.shape[1] * factor), int(face.shape[0] * factor))
+    face = cv2.resize(face, size)
+
+    diff_0 = target_size[0] - face.shape[0]
+    diff_1 = target_size[1] - face.shape[1]
+    face = np.pad(
+        face,
+        ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)),
+        "constant"
+    )
+    if face.shape[0:2] != tuple(target_size):
+        face = cv2.resize(face, (target_size[1], target_size[0]))
+
+    face = np.asarray(face, dtype=np.float32)
+    if face.max() > 1:
+        face /= 255
+    return np.expand_dims(face, axis=0)
+
+
+def align_crop(img: np.ndarray, box, eye_a, eye_b) -> np.ndarray:
+    """
+    Crop a face box with the eyes rotated level
+
+    Only a margin around the box is warped, not the whole frame.
+    """
+    x, y, w, h = box
+    (ax, ay), (bx, by) = sorted([tuple(eye_a), tuple(eye_b)])
+    angle = float(np.degrees(np.arctan2(by - ay, bx - ax)))
+    if abs(angle) < 1.0:
+        return img[y:y + h, x:x + w]
+
+    # Region with half a box of margin on each side, clipped to the frame
+    rx0, ry0 = max(0, x - w // 2), max(0, y - h // 2)
+    rx1, ry1 = min(img.shape[1], x + w + w // 2), min(img.shape[0], y + h + h // 2)
+    region = img[ry0:ry1, rx0:rx1]
+
+    center = ((ax + bx) / 2 - rx0, (ay + by) / 2 - ry0)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    rotated = cv2.warpAffine(region, matrix, (region.shape[1], region.shape[0]))
+    return rotated[y - ry0:y - ry0 + h, x - rx0:x - rx0 + w]
+
+
+class FaceEmbedder:
+    def __init__(self, path: str, runtime: str = "onnxruntime", threads: int = 0):
+        """
+        Facenet512 exported to ONNX
+
+        Args:
+            path: ONNX file (NCHW input, see scripts/export_onnx_models.py)
+            runtime: 'onnxruntime' or 'opencv' (cv2.dnn)
+            threads: Intra-op threads (0 = runtime default)
+        """
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Unknown runtime '{runtime}' (expected one of {RUNTIMES})")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found; run scripts/export_onnx_models.py")
+
+        self.runtime = runtime
+        self.input_shape = (160, 160)
+        self._lock = threading.Lock()
+
+        if runtime == "onnxruntime":
+            if not onnxruntime:
+                raise RuntimeError("onnxruntime is not installed")
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            # One request at a time per session; parallelism comes from intra-op threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self._input_name = self._session.get_inputs()[0].name
+            dims = self._session.get_inputs()[0].shape[2:4]
+            if all(isinstance(d, int) for d in dims):
+                self.input_shape = tuple(dims)
+        else:
+            if threads:
+                cv2.setNumThreads(threads)
+            self._net = cv2.dnn.readNetFromONNX(path)
+            self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Raw forward pass
+
+        Args:
+            batch: float32 array (N, H, W, 3), BGR in [0, 1], as resize_face returns
+        """
+        blob = np.ascontiguousarray(batch.transpose(0, 3, 1, 2), dtype=np.float32)
+        if self.runtime == "onnxruntime":
+            return self._session.run(None, {self._input_name: blob})[0]
+        # cv2.dnn.Net keeps per-call state and is not thread-safe
+        with self._lock:
+            self._net.setInput(blob)
+            return self._net.forward()
+
+    def forward(self, faces: List[Dict]) -> List[List[float]]:
+        """
+        Embed faces in one forward pass
+
+        Args:
+            faces: DeepFace.extract_faces-style objects ("face" is RGB in [0, 1])
+        """
+        batch = np.concatenate([
+            resize_face(face_obj["face"][:, :, ::-1], self.input_shape)  # RGB -> BGR, as DeepFace.represent does
+            for face_obj in faces
+        ], axis=0)
+        return self.run(batch).tolist()
+
+
+class FaceDetector:
+    def __init__(self, path: str, score_threshold: float = 0.9, nms_threshold: float = 0.3, top_k: int = 5000):
+        """
+        YuNet face detector on OpenCV DNN (cv2.FaceDetectorYN)
+
+        Args:
+            path: YuNet ONNX file
+            score_threshold: Minimum detection confidence
+            nms_threshold: IoU threshold for non-maximum suppression
+            top_k: Candidates kept before NMS
+        """
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"{path} not found; see scripts/export_onnx_models.py")
+        if INFERENCE_THREADS:
+            cv2.setNumThreads(INFERENCE_THREADS)
+        self._detector = cv2.FaceDetectorYN.create(path, "", (320, 320), score_threshold, nms_threshold, top_k)
+        # setInputSize + detect must not interleave between threads
+        self._lock = threading.Lock()
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        """Raw YuNet rows: x, y, w, h, 5 landmark (x, y) pairs, score"""
+        with self._lock:
+            self._detector.setInputSize((img.shape[1], img.shape[0]))
+            _, detections = self._detector.detect(img)
+        return detections if detections is not None else np.zeros((0, 15), dtype=np.float32)
+
+    def extract_faces(self, img: np.ndarray, enforce_detection: bool = True, align: bool = True) -> List[Dict]:
+        """
+        Detect and crop faces, in the shape DeepFace.extract_faces returns
+
+        Args:
+            img: BGR image
+            enforce_detection: Raise ValueError when no face is found
+            align: Rotate each face so the eyes are level
+
+        Returns:
+            List of {"face": RGB float32 in [0, 1], "facial_area": {...}, "confidence": float}
+        """
+        faces = []
+        height, width = img.shape[:2]
+        for row in self.detect(img):
+            x, y = max(0, int(row[0])), max(0, int(row[1]))
+            w, h = min(width - x, int(row[2])), min(height - y, int(row[3]))
+            if w <= 0 or h <= 0:
+                continue
+            right_eye = (int(row[4]), int(row[5]))
+            left_eye = (int(row[6]), int(row[7]))
+
+            if align:
+                crop = align_crop(img, (x, y, w, h), right_eye, left_eye)
+            else:
+                crop = img[y:y + h, x:x + w]
+            faces.append({
+                "face": crop[:, :, ::-1].astype(np.float32) / 255,
+                "facial_area": {"x": x, "y": y, "w": w, "h": h, "left_eye": left_eye, "right_eye": right_eye},
+                "confidence": round(float(row[14]), 4)
+            })
+
+        if not faces and enforce_detection:
+            raise ValueError("Face could not be detected in the image")
+        return faces
+
+
+def load_embedder(model_name: str, runtime: str, path: Optional[str] = None) -> FaceEmbedder:
+    """Exported embedding model by DeepFace model name (only Facenet512 is exported)"""
+    if model_name not in EXPORTED_MODELS:
+        raise ValueError(f"No exported ONNX model for '{model_name}'")
+    return FaceEmbedder(path or FACENET_ONNX_PATH, runtime, INFERENCE_THREADS)
+
+
+def load_detector(path: Optional[str] = None) -> FaceDetector:
+    return FaceDetector(path or DETECTOR_ONNX_PATH)
@@ -0,0 +1,166 @@
+"""
+Image Preprocessing
+Resolution normalization before face detection
+"""
+
+import struct
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# JPEG start-of-frame markers (baseline, extended, progressive, lossless, ...)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# libjpeg can decode directly at 1/2, 1/4 and 1/8 scale (DCT scaling)
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a JPEG header without decoding the image
+
+    Returns:
+        (width, height), or None if data is not a readable JPEG
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # Markers without a length
+            pos += 2
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def downscale(image: np.ndarray, max_side: Optional[int]) -> Tuple[np.ndarray, float]:
+    """
+    Resize so the longest side is at most max_side
+
+    Returns:
+        (image, scale) where scale = new size / original size (1.0 if untouched)
+    """
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return image, 1.0
+    scale = max_side / max(h, w)
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def map_box(box: Dict, scale: float, shape: Tuple[int, ...]) -> Dict:
+    """
+    Map an {x, y, w, h} box detected on a scaled image back to original pixels
+
+    Args:
+        box: Box in scaled-image coordinates
+        scale: Scale returned by downscale() / PreparedImage.scale
+        shape: Original image shape (h, w, ...), used to clip the box
+    """
+    h_full, w_full = shape[:2]
+    x = max(0, int(round(box.get('x', 0) / scale)))
+    y = max(0, int(round(box.get('y', 0) / scale)))
+    w = min(w_full - x, int(round(box.get('w', 0) / scale)))
+    h = min(h_full - y, int(round(box.get('h', 0) / scale)))
+    return {'x': x, 'y': y, 'w': w, 'h': h}
+
+
+class PreparedImage:
+    def __init__(self, image: np.ndarray, scale: float, original_size: Tuple[int, int], data: Optional[bytes] = None,
+                 original: Optional[np.ndarray] = None):
+        """
+        An image resized for detection, with what is needed to get back to
+        the original pixels
+
+        Args:
+            image: BGR image to run detection on
+            scale: image size / original size
+            original_size: (width, height) of the original image
+            data: Encoded bytes, kept so the original can be decoded on demand
+            original: Original array, if the input already was one
+        """
+        self.image = image
+        self.scale = scale
+        self.original_size = original_size
+        self._data = data
+        self._original = original
+
+    def original(self) -> np.ndarray:
+        """Full-resolution image (decoded on first use for encoded inputs)"""
+        if self._original is None:
+            if self.scale == 1.0 or self._data is None:
+                self._original = self.image
+            else:
+                self._original = cv2.imdecode(np.frombuffer(self._data, np.uint8), cv2.IMREAD_COLOR)
+        return self._original
+
+    def source(self):
+        """The input this image was prepared from: its encoded bytes, or the original array"""
+        return self._data if self._data is not None else self.original()
+
+    def crop(self, box: Dict, margin: float = 0.0) -> np.ndarray:
+        """
+        Crop a box detected on self.image from the original pixels
+
+        Args:
+            box: {x, y, w, h} in detection-image coordinates
+            margin: Extra context around the box, as a fraction of its size
+        """
+        original = self.original()
+        full = map_box(box, self.scale, original.shape)
+        dx, dy = int(full['w'] * margin), int(full['h'] * margin)
+        x0, y0 = max(0, full['x'] - dx), max(0, full['y'] - dy)
+        x1 = min(original.shape[1], full['x'] + full['w'] + dx)
+        y1 = min(original.shape[0], full['y'] + full['h'] + dy)
+        return original[y0:y1, x0:x1]
+
+
+def prepare_bytes(data: bytes, max_side: Optional[int]) -> Optional[PreparedImage]:
+    """
+    Decode encoded image bytes at (about) max_side resolution
+
+    JPEGs larger than 2x max_side are decoded at 1/2, 1/4 or 1/8 scale by
+    libjpeg itself, which skips most of the decode work, then resized the
+    rest of the way. Other formats are decoded fully and resized.
+
+    Returns:
+        PreparedImage, or None if the bytes could not be decoded
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    dims = jpeg_dimensions(data) if max_side else None
+
+    image = None
+    if dims:
+        for factor, flag in _REDUCED_FLAGS:
+            # Largest reduction that still leaves at least max_side pixels
+            if max(dims) // factor >= max_side:
+                image = cv2.imdecode(buffer, flag)
+                break
+    if image is None:
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        dims = (image.shape[1], image.shape[0])
+
+    image, _ = downscale(image, max_side)
+    # Longest sides compare correctly even if EXIF orientation rotated the image
+    scale = max(image.shape[:2]) / max(dims)
+    return PreparedImage(image, scale, dims, data=data)
+
+
+def prepare_array(image: np.ndarray, max_side: Optional[int]) -> PreparedImage:
+    """Resize an already decoded BGR image for detection"""
+    resized, scale = downscale(image, max_side)
+    return PreparedImage(resized, scale, (image.shape[1], image.shape[0]), original=image)
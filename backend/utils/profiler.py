@@ -0,0 +1,229 @@
+"""
+Profiler
+On-demand CPU profiling of the running backend process
+
+Two modes, both idle until asked for:
+  sampling       sys._current_frames() polled from a helper thread for a
+                 fixed time; every thread is sampled, nothing is hooked.
+                 Output: collapsed stacks (flamegraph.pl / speedscope) and
+                 the top functions by self and total samples.
+  deterministic  cProfile around the next N matching requests. Blocking
+                 work runs in run_blocking()'s thread pool, which runs the
+                 call under the request's profiler. Output: top functions
+                 and a pstats dump (snakeviz, flameprof, gprof2dot).
+"""
+
+import contextvars
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+_request_profile: contextvars.ContextVar = contextvars.ContextVar("attendify_request_profile", default=None)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A leaf frame in one of these means the thread is parked (lock, event loop, pool queue)
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+
+
+def _label(code) -> str:
+    """Function label for stacks: name (file:first line), paths relative to backend/ or site-packages"""
+    path = code.co_filename
+    if path.startswith(BACKEND_DIR):
+        path = os.path.relpath(path, BACKEND_DIR)
+    elif "site-packages" in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _top(self_counts: Counter, total_counts: Counter, samples: int, limit: int) -> List[Dict]:
+    return [
+        {
+            "function": label,
+            "self_samples": self_counts.get(label, 0),
+            "total_samples": total_counts[label],
+            "self_pct": round(100 * self_counts.get(label, 0) / samples, 2) if samples else 0.0,
+            "total_pct": round(100 * total_counts[label] / samples, 2) if samples else 0.0
+        }
+        for label, _ in sorted(total_counts.items(), key=lambda item: (-self_counts.get(item[0], 0), -item[1]))[:limit]
+    ]
+
+
+def sample(seconds: float, interval: float = 0.005, limit: int = 30, idle: bool = False) -> Dict:
+    """
+    Sample every thread's stack for a fixed time
+
+    Args:
+        seconds: Capture duration
+        interval: Seconds between samples
+        limit: Functions in the top list
+        idle: Keep stacks of threads parked in a wait (lock, queue, selector)
+
+    Returns:
+        {"samples", "seconds", "collapsed", "top"}; collapsed is one
+        "root;...;leaf count" line per distinct stack
+    """
+    me = threading.get_ident()
+    stacks: Counter = Counter()
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            if not idle and frame.f_code.co_filename.endswith(_IDLE_FILES):
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_label(frame.f_code))
+                frame = frame.f_back
+            labels.reverse()
+            stacks[";".join(labels)] += 1
+            self_counts[labels[-1]] += 1
+            for label in set(labels):
+                total_counts[label] += 1
+            samples += 1
+        time.sleep(interval)
+
+    collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return {
+        "samples": samples,
+        "seconds": seconds,
+        "interval": interval,
+        "collapsed": collapsed,
+        "top": _top(self_counts, total_counts, samples, limit)
+    }
+
+
+class RequestProfiler:
+    def __init__(self):
+        """Deterministic profiles of the next N requests (disarmed by default)"""
+        self._lock = threading.Lock()
+        self.remaining = 0
+        self.path_prefix: Optional[str] = None
+        self.requested = 0
+        self.started_at: Optional[float] = None
+        self._profiles: List[cProfile.Profile] = []
+        self._in_flight = 0
+
+    def arm(self, count: int, path_prefix: Optional[str] = None):
+        """Profile the next count requests whose path starts with path_prefix"""
+        with self._lock:
+            self.remaining = count
+            self.requested = count
+            self.path_prefix = path_prefix
+            self.started_at = time.time()
+            self._profiles = []
+
+    def begin(self, path: str):
+        """
+        Called by the HTTP middleware for every request. Returns a token for
+        end(), or None when disarmed (a single attribute check).
+        """
+        if not self.remaining:
+            return None
+        with self._lock:
+            if not self.remaining or (self.path_prefix and not path.startswith(self.path_prefix)):
+                return None
+            self.remaining -= 1
+            self._in_flight += 1
+        return _request_profile.set(cProfile.Profile())
+
+    def end(self, token):
+        profile = _request_profile.get()
+        _request_profile.reset(token)
+        with self._lock:
+            self._profiles.append(profile)
+            self._in_flight -= 1
+
+    @property
+    def done(self) -> bool:
+        return self.requested > 0 and not self.remaining and not self._in_flight
+
+    def _stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def report(self, limit: int = 30, sort: str = "tottime") -> Dict:
+        """
+        Status, plus top functions once requests have been profiled
+
+        Args:
+            limit: Functions in the top list
+            sort: 'tottime' (own time) or 'cumtime' (including callees)
+        """
+        report = {
+            "requested": self.requested,
+            "profiled": len(self._profiles),
+            "remaining": self.remaining,
+            "in_flight": self._in_flight,
+            "done": self.done,
+            "path_prefix": self.path_prefix,
+            "started_at": self.started_at,
+            "top": []
+        }
+        stats = self._stats()
+        if stats is None:
+            return report
+
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                "function": f"{name} ({filename}:{line})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3)
+            })
+        key = "cumtime_ms" if sort == "cumtime" else "tottime_ms"
+        rows.sort(key=lambda r: r[key], reverse=True)
+        report["total_ms"] = round(stats.total_tt * 1000, 3)
+        report["top"] = rows[:limit]
+        return report
+
+    def dump(self) -> Optional[bytes]:
+        """Merged profile in pstats/marshal format (what Stats.dump_stats writes)"""
+        stats = self._stats()
+        if stats is None:
+            return None
+        return marshal.dumps(stats.stats)
+
+
+def profiled(fn: Callable, *args, **kwargs):
+    """
+    Run fn under the current request's profiler, if any (see run_blocking)
+
+    cProfile hooks one thread, so the blocking part of a request is profiled
+    in the pool thread that runs it.
+    """
+    profile = _request_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows one active cProfile per process; run this call unprofiled
+        return fn(*args, **kwargs)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+
+
+# Create singleton instances
+request_profiler = RequestProfiler()
+sampling_lock = threading.Lock()
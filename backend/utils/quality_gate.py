@@ -0,0 +1,222 @@
+"""
+Quality Gate
+Brightness, overexposure and sharpness checks run before detection and embedding
+
+The measures are the ones DatasetBuilder scores enrollment photos with
+(mean gray level, variance of the Laplacian), computed with numpy on a
+stack of small grayscale images so a whole frame or every face crop of a
+frame costs one vectorized pass. Frames are measured at analysis_side
+pixels and faces at FACE_SIDE, so sharpness thresholds refer to those
+sizes, not to the original resolution.
+
+Per-camera thresholds come from a JSON file (ATTENDIFY_QUALITY_CAMERAS):
+  {"default": {"min_brightness": 35}, "room_204": {"frame_min_sharpness": 5}}
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from utils.metrics import REJECTIONS
+
+QUALITY_GATE_ENABLED = os.getenv("ATTENDIFY_QUALITY_GATE", "1") == "1"
+QUALITY_CAMERAS_PATH = os.getenv("ATTENDIFY_QUALITY_CAMERAS")
+
+FACE_SIDE = 64  # Face crops are compared at this size
+_CLIPPED_LEVEL = 250  # Gray level counted as blown out
+_GRAY_WEIGHTS_RGB = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def measure(grays: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Brightness, clipped fraction and sharpness of a stack of gray images
+
+    Sharpness is the variance of the 4-neighbour Laplacian (cv2.Laplacian's
+    default kernel) over interior pixels.
+
+    Args:
+        grays: (N, H, W) or (H, W) gray levels in [0, 255]
+
+    Returns:
+        {"brightness", "clipped", "sharpness"}, each an (N,) array
+    """
+    grays = np.asarray(grays, dtype=np.float32)
+    if grays.ndim == 2:
+        grays = grays[None]
+    n = grays.shape[0]
+    laplacian = (
+        grays[:, :-2, 1:-1] + grays[:, 2:, 1:-1] + grays[:, 1:-1, :-2] + grays[:, 1:-1, 2:]
+        - 4 * grays[:, 1:-1, 1:-1]
+    )
+    flat = grays.reshape(n, -1)
+    return {
+        "brightness": flat.mean(axis=1),
+        "clipped": (flat >= _CLIPPED_LEVEL).mean(axis=1),
+        "sharpness": laplacian.reshape(n, -1).var(axis=1)
+    }
+
+
+def frame_gray(image: np.ndarray, side: Optional[int]) -> np.ndarray:
+    """BGR (or gray) image as gray levels, downscaled so its longest side is at most side"""
+    h, w = image.shape[:2]
+    if side and max(h, w) > side:
+        scale = side / max(h, w)
+        image = cv2.resize(image, (max(3, int(w * scale)), max(3, int(h * scale))), interpolation=cv2.INTER_AREA)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def face_grays(faces: List[Dict]) -> np.ndarray:
+    """
+    Stack extracted faces ("face" is RGB in [0, 1], as DeepFace.extract_faces
+    returns it) as FACE_SIDE x FACE_SIDE gray levels in [0, 255]
+    """
+    grays = []
+    for face_obj in faces:
+        face = np.asarray(face_obj["face"], dtype=np.float32)
+        gray = face @ _GRAY_WEIGHTS_RGB if face.ndim == 3 else face
+        grays.append(cv2.resize(gray * 255, (FACE_SIDE, FACE_SIDE), interpolation=cv2.INTER_AREA))
+    return np.stack(grays) if grays else np.zeros((0, FACE_SIDE, FACE_SIDE), dtype=np.float32)
+
+
+class QualityGate:
+    def __init__(
+        self,
+        min_brightness: float = 40.0,
+        max_brightness: float = 220.0,
+        max_clipped: float = 0.5,
+        frame_min_sharpness: float = 10.0,
+        face_min_sharpness: float = 20.0,
+        analysis_side: int = 320,
+        enabled: bool = True
+    ):
+        """
+        Thresholds for one camera (defaults are deliberately lenient)
+
+        Args:
+            min_brightness: Mean gray level below which an image is too dark
+            max_brightness: Mean gray level above which it is overexposed
+            max_clipped: Fraction of blown-out pixels above which it is overexposed
+            frame_min_sharpness: Minimum Laplacian variance of the frame at analysis_side
+            face_min_sharpness: Minimum Laplacian variance of a face at FACE_SIDE
+            analysis_side: Longest side (pixels) frames are measured at
+            enabled: False lets everything through
+        """
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.frame_min_sharpness = frame_min_sharpness
+        self.face_min_sharpness = face_min_sharpness
+        self.analysis_side = analysis_side
+        self.enabled = enabled
+
+    def _reasons(self, measures: Dict[str, np.ndarray], min_sharpness: float) -> List[Optional[str]]:
+        """Rejection reason per image (None if it passes), checked in DatasetBuilder's order"""
+        reasons = np.full(len(measures["brightness"]), None, dtype=object)
+        reasons[measures["sharpness"] < min_sharpness] = "blurry"
+        reasons[(measures["brightness"] > self.max_brightness) | (measures["clipped"] > self.max_clipped)] = "overexposed"
+        reasons[measures["brightness"] < self.min_brightness] = "dark"
+        return reasons.tolist()
+
+    def check_frame(self, image: np.ndarray) -> Optional[str]:
+        """
+        Rejection reason for a whole frame ('dark', 'overexposed', 'blurry'),
+        or None if it should go on to detection. Rejections are counted.
+        """
+        if not self.enabled or image is None:
+            return None
+        reason = self._reasons(measure(frame_gray(image, self.analysis_side)), self.frame_min_sharpness)[0]
+        if reason:
+            REJECTIONS.inc(reason=f"frame_{reason}")
+        return reason
+
+    def filter_faces(self, faces: List[Dict]) -> List[Dict]:
+        """Drop extracted faces too dark, overexposed or blurry to embed; rejections are counted"""
+        if not self.enabled or not faces:
+            return faces
+        kept = []
+        for face_obj, reason in zip(faces, self._reasons(measure(face_grays(faces)), self.face_min_sharpness)):
+            if reason:
+                REJECTIONS.inc(reason=f"face_{reason}")
+            else:
+                kept.append(face_obj)
+        return kept
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self))
+
+
+class CameraQualityGates:
+    def __init__(self, path: Optional[str] = QUALITY_CAMERAS_PATH, enabled: bool = QUALITY_GATE_ENABLED):
+        """
+        Per-camera QualityGate thresholds
+
+        Args:
+            path: JSON file of {camera_id: {threshold: value}}; the "default"
+                  entry applies to every camera, including unnamed ones.
+                  Re-read when its modification time changes.
+            enabled: Master switch (ATTENDIFY_QUALITY_GATE)
+        """
+        self.path = path
+        self.enabled = enabled
+        self._overrides: Dict[str, Dict] = {}
+        self._mtime: Optional[float] = None
+        self._gates: Dict[Optional[str], QualityGate] = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                overrides = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable quality thresholds {self.path}: {e}")
+            overrides = {}
+        self._overrides = overrides if isinstance(overrides, dict) else {}
+        self._mtime = mtime
+        self._gates = {}
+
+    def get(self, camera_id: Optional[str] = None) -> QualityGate:
+        """Gate for a camera: defaults, then the "default" entry, then the camera's own entry"""
+        with self._lock:
+            self._reload()
+            gate = self._gates.get(camera_id)
+            if gate is None:
+                gate = QualityGate()
+                settings = dict(self._overrides.get("default", {}))
+                if camera_id:
+                    settings.update(self._overrides.get(camera_id, {}))
+                for key, value in settings.items():
+                    if hasattr(gate, key):
+                        setattr(gate, key, value)
+                    else:
+                        print(f"Unknown quality threshold {key!r} for camera {camera_id or 'default'}")
+                gate.enabled = self.enabled and bool(gate.enabled)
+                self._gates[camera_id] = gate
+            return gate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._reload()
+            cameras = sorted(k for k in self._overrides if k != "default")
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "default": self.get().to_dict(),
+            "cameras": {camera_id: self.get(camera_id).to_dict() for camera_id in cameras}
+        }
+
+
+# Create singleton instance
+quality_gates = CameraQualityGates()
@@ -0,0 +1,429 @@
+"""
+Re-embedding
+Streaming, parallel, resumable migration of stored embeddings to a new model or detector
+
+Every embedding row records the embedding_version that produced it
+(database_updates_v13_embedding_versions.sql). Changing the model or detector
+means re-embedding every student still on another version: their stored
+photos (selfies bucket, or a local <dataset>/<student_id>/*.jpg tree) are
+fetched chunk by chunk, embedded in batches across a process pool and
+upserted into the embedding_reembed shadow table. The shadow table is the
+checkpoint: students already in it are skipped when the run is started
+again. Once every student is covered, cutover_embedding_version() swaps all
+of them in one transaction.
+"""
+
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SOURCES = ("auto", "bucket", "dataset")
+
+# Per-process state for pool workers (models load once per worker)
+_worker_engine = None
+
+
+def _init_worker(model_name: str, detector_backend: str, inference_backend: str):
+    global _worker_engine
+    from utils.face_engine import get_face_engine
+
+    _worker_engine = get_face_engine()
+    # The whole pipeline, not just the model: the runtime is part of the version
+    _worker_engine.configure(model_name, detector_backend, inference_backend)
+
+
+def _embed_chunk(tasks: List[Dict]) -> List[Dict]:
+    """
+    Embed the photos of a chunk of students in one batched pass (runs in a pool worker)
+
+    Args:
+        tasks: [{"student_id", "source", "images": [paths or encoded bytes], "error"}]
+
+    Returns:
+        One result per task: status 'success' (with templates and their
+        centroid as embedding) or 'failed', and per-student counts
+    """
+    import cv2
+    import numpy as np
+
+    results = [
+        {
+            "student_id": task["student_id"],
+            "source": task["source"],
+            "images": len(task["images"]),
+            "embedded": 0,
+            "status": "failed",
+            "error": task.get("error")
+        }
+        for task in tasks
+    ]
+
+    try:
+        frames, owners = [], []
+        for idx, task in enumerate(tasks):
+            for image in task["images"]:
+                if isinstance(image, str):
+                    frame = cv2.imread(image)
+                else:
+                    frame = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    frames.append(frame)
+                    owners.append(idx)
+
+        templates: List[List] = [[] for _ in tasks]
+        for owner, embedding in zip(owners, _worker_engine.get_embeddings_batch(frames) if frames else []):
+            if embedding is not None:
+                templates[owner].append(list(map(float, embedding)))
+
+        for result, student_templates in zip(results, templates):
+            if student_templates:
+                result.update({
+                    "status": "success",
+                    "embedded": len(student_templates),
+                    "templates": student_templates,
+                    "embedding": _worker_engine.compute_centroid(student_templates),
+                    "error": None
+                })
+            elif result["images"]:
+                result["error"] = "Face not detected in any photo"
+            elif not result["error"]:
+                result["error"] = "No stored photo"
+
+    except Exception as e:
+        for result in results:
+            if result["status"] != "success":
+                result["error"] = str(e)
+
+    return results
+
+
+class Reembedder:
+    def __init__(
+        self,
+        supabase,
+        model_name: str,
+        detector_backend: str,
+        inference_backend: str = "deepface",
+        source: str = "auto",
+        dataset_root: str = "dataset",
+        workers: Optional[int] = None,
+        chunk_size: int = 16,
+        batch_size: int = 100,
+        max_images: int = 10,
+        report_path: str = "reembed_report.csv",
+        page_size: int = 1000
+    ):
+        """
+        Initialize the re-embedding run
+
+        Args:
+            supabase: Supabase client (rows, selfies bucket, shadow table)
+            model_name: Target embedding model, e.g. 'Facenet512'
+            detector_backend: Target detector, e.g. 'yunet'
+            inference_backend: Target runtime: 'deepface', 'onnxruntime' or 'opencv'
+            source: 'bucket' (stored selfies), 'dataset' (local photos) or
+                    'auto' (local photos where a student has any, else selfies)
+            dataset_root: Directory laid out as <dataset_root>/<student_id>/*.jpg
+            workers: Process pool size (default: CPU count)
+            chunk_size: Students per task sent to a worker (one batched forward pass)
+            batch_size: Students per shadow table upsert
+            max_images: Photos embedded per student at most
+            report_path: Per-student CSV report
+            page_size: Rows fetched per request
+
+        Raises:
+            ValueError: If the runtime cannot run this model or detector
+        """
+        from utils.face_engine import check_pipeline
+
+        # Refused here rather than by every worker, once per student
+        check_pipeline(model_name, detector_backend, inference_backend)
+        self.supabase = supabase
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.inference_backend = inference_backend
+        self.source = source
+        self.dataset_root = Path(dataset_root)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_images = max_images
+        self.report_path = report_path
+        self.page_size = page_size
+
+    @property
+    def version(self) -> str:
+        """Target embedding_version, same format as AttendifyAI.embedding_version"""
+        from utils.face_engine import embedding_version_for
+        return embedding_version_for(self.model_name, self.detector_backend, self.inference_backend)
+
+    def _fetch(self, table: str, columns: str, order: str = "id", **filters) -> List[Dict]:
+        rows = []
+        offset = 0
+        while True:
+            query = self.supabase.table(table).select(columns)
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            # A unique sort key keeps offset paging from skipping rows
+            page = query.order(order)\
+                .range(offset, offset + self.page_size - 1)\
+                .execute().data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            offset += self.page_size
+
+    def students_to_migrate(self) -> List[str]:
+        """Students with an active or pending embedding of another version, in a stable order"""
+        stale = set()
+        for r in self._fetch("active_embeddings", "id, student_id, embedding_version"):
+            if r.get("student_id") and r.get("embedding_version") != self.version:
+                stale.add(r["student_id"])
+        for r in self._fetch("pending_approvals", "id, student_id, embedding_version", status="pending"):
+            if r.get("student_id") and r.get("embedding_version") != self.version:
+                stale.add(r["student_id"])
+        return sorted(stale)
+
+    def completed_students(self) -> set:
+        """Students already staged in the shadow table for the target version (the checkpoint)"""
+        rows = self._fetch("embedding_reembed", "student_id", order="student_id", embedding_version=self.version)
+        return {r["student_id"] for r in rows}
+
+    def _dataset_images(self, student_id: str) -> List[str]:
+        student_dir = self.dataset_root / student_id
+        if not student_dir.is_dir():
+            return []
+        return sorted(str(p) for p in student_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)[:self.max_images]
+
+    def _download(self, path: str) -> Optional[bytes]:
+        try:
+            return self.supabase.storage.from_("selfies").download(path)
+        except Exception as e:
+            print(f"Could not download selfie {path}: {e}")
+            return None
+
+    def _load_chunk(self, student_ids: List[str]) -> List[Dict]:
+        """
+        Gather the photos of a chunk of students (runs in an I/O thread)
+
+        Local photos are passed as paths and read by the worker; selfies are
+        downloaded here, newest first, skipping rejected enrollments.
+        """
+        tasks = {sid: {"student_id": sid, "source": "dataset", "images": [], "error": None} for sid in student_ids}
+        if self.source in ("dataset", "auto"):
+            for sid in student_ids:
+                tasks[sid]["images"] = self._dataset_images(sid)
+
+        need_bucket = [sid for sid in student_ids if self.source != "dataset" and not tasks[sid]["images"]]
+        if need_bucket:
+            try:
+                rows = self.supabase.table("pending_approvals").select("student_id, selfie_url, status, created_at")\
+                    .in_("student_id", need_bucket).execute().data or []
+            except Exception as e:
+                rows = []
+                for sid in need_bucket:
+                    tasks[sid]["error"] = f"Database error: {e}"
+            rows = [r for r in rows if r.get("selfie_url") and r.get("status") != "rejected"]
+            rows.sort(key=lambda r: str(r.get("created_at") or ""), reverse=True)
+            paths: Dict[str, List[str]] = {}
+            for r in rows:
+                student_paths = paths.setdefault(r["student_id"], [])
+                if len(student_paths) < self.max_images and r["selfie_url"] not in student_paths:
+                    student_paths.append(r["selfie_url"])
+            for sid in need_bucket:
+                tasks[sid]["source"] = "bucket"
+                downloads = (self._download(path) for path in paths.get(sid, []))
+                tasks[sid]["images"] = [data for data in downloads if data]
+
+        return [tasks[sid] for sid in student_ids]
+
+    def _write_batch(self, batch: List[Dict]):
+        """Stage a batch of students in the shadow table (idempotent, so resumes can repeat it)"""
+        if not batch:
+            return
+        self.supabase.table("embedding_reembed").upsert([
+            {
+                "student_id": r["student_id"],
+                "embedding_version": self.version,
+                "embedding": r["embedding"],
+                "templates": r["templates"],
+                "images": r["embedded"],
+                "source": r["source"]
+            }
+            for r in batch
+        ], on_conflict="student_id,embedding_version").execute()
+
+    def status(self) -> Dict:
+        """Students still on another version, and how many of them are staged"""
+        stale = self.students_to_migrate()
+        done = self.completed_students()
+        staged = sum(1 for sid in stale if sid in done)
+        return {
+            "version": self.version,
+            "students": len(stale),
+            "staged": staged,
+            "remaining": len(stale) - staged,
+            "ready_for_cutover": staged == len(stale)
+        }
+
+    def run(self) -> Dict:
+        """
+        Re-embed every student not yet staged for the target version
+
+        Returns:
+            Summary with counts, failures and throughput
+        """
+        from utils.gallery import EMBEDDING_DIM
+
+        stale = self.students_to_migrate()
+        done = self.completed_students()
+        pending = [sid for sid in stale if sid not in done]
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+
+        summary = {
+            "version": self.version,
+            "total": len(stale),
+            "skipped": len(stale) - len(pending),
+            "success": 0,
+            "failed": 0,
+            "images": 0,
+            "failed_students": []
+        }
+
+        print(f"\n{'='*70}")
+        print(f"RE-EMBEDDING TO {self.version}")
+        print(f"{'='*70}")
+        print(f"Students: {len(stale)} ({summary['skipped']} already staged, {len(pending)} to process)")
+        print(f"Source: {self.source} | Workers: {self.workers} | Chunk: {self.chunk_size} students")
+        print(f"{'='*70}\n")
+
+        new_report = not os.path.exists(self.report_path)
+        report_file = open(self.report_path, 'a', newline='', encoding='utf-8')
+        report = csv.writer(report_file)
+        if new_report:
+            report.writerow(["student_id", "version", "status", "source", "images", "embedded", "error"])
+
+        start = time.perf_counter()
+        last_progress = 0.0
+        batch: List[Dict] = []
+
+        def record(results: List[Dict]):
+            for r in results:
+                report.writerow([r["student_id"], self.version, r["status"], r["source"], r["images"],
+                                 r["embedded"], r.get("error") or ""])
+                if r["status"] == "success":
+                    summary["success"] += 1
+                else:
+                    summary["failed"] += 1
+                    summary["failed_students"].append(r["student_id"])
+            report_file.flush()
+
+        def flush_batch():
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                for r in batch:
+                    r["status"], r["error"] = "failed", f"Database error: {e}"
+            record(batch)
+            batch.clear()
+
+        def progress(force: bool = False):
+            nonlocal last_progress
+            elapsed = time.perf_counter() - start
+            if not force and elapsed - last_progress < 5:
+                return
+            last_progress = elapsed
+            processed = summary["success"] + summary["failed"] + len(batch)
+            rate = processed / elapsed if elapsed else 0.0
+            eta = (len(pending) - processed) / rate if rate else float("inf")
+            eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta != float("inf") else "--:--:--"
+            print(f"[{processed}/{len(pending)}] {rate:.1f} students/s | "
+                  f"{summary['images'] / elapsed if elapsed else 0:.1f} images/s | ETA {eta_text}")
+
+        def handle(results: List[Dict]):
+            for r in results:
+                summary["images"] += r["embedded"]
+                if r["status"] != "success":
+                    record([r])
+                    continue
+                if len(r["embedding"]) != EMBEDDING_DIM:
+                    raise RuntimeError(
+                        f"{self.version} produces {len(r['embedding'])}-dimension embeddings; the vector({EMBEDDING_DIM}) "
+                        f"columns and the gallery need a schema change before switching to it"
+                    )
+                batch.append(r)
+                if len(batch) >= self.batch_size:
+                    flush_batch()
+            progress()
+
+        in_flight = self.workers * 2
+        try:
+            with ThreadPoolExecutor(max_workers=min(8, in_flight)) as loader, ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.model_name, self.detector_backend, self.inference_backend)
+            ) as pool:
+                # Photos for the next chunks download while the pool embeds earlier ones
+                chunk_iter = iter(chunks)
+                loading = deque(loader.submit(self._load_chunk, ids) for ids in
+                                (next(chunk_iter) for _ in range(min(in_flight, len(chunks)))))
+                running = set()
+                while loading or running:
+                    if loading and len(running) < in_flight:
+                        tasks = loading.popleft().result()
+                        next_ids = next(chunk_iter, None)
+                        if next_ids is not None:
+                            loading.append(loader.submit(self._load_chunk, next_ids))
+                        running.add(pool.submit(_embed_chunk, tasks))
+                        continue
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        handle(future.result())
+
+                flush_batch()
+
+        except KeyboardInterrupt:
+            flush_batch()
+            print("\n\n⚠️  Re-embedding interrupted - staged students are saved, re-run to resume")
+        finally:
+            report_file.close()
+
+        elapsed = time.perf_counter() - start
+        summary["elapsed_seconds"] = round(elapsed, 2)
+        summary["students_per_second"] = round((summary["success"] + summary["failed"]) / elapsed, 2) if elapsed else 0
+        summary["images_per_second"] = round(summary["images"] / elapsed, 2) if elapsed else 0
+        summary["ready_for_cutover"] = summary["skipped"] + summary["success"] == summary["total"]
+
+        print(f"\n{'='*70}")
+        print(f"RE-EMBEDDING COMPLETE")
+        print(f"{'='*70}")
+        print(f"✅ Staged: {summary['success']}")
+        print(f"❌ Failed: {summary['failed']}")
+        print(f"⏭️  Skipped (already staged): {summary['skipped']}")
+        print(f"⏱️  {summary['elapsed_seconds']}s | {summary['students_per_second']} students/s | {summary['images_per_second']} images/s")
+        if summary["ready_for_cutover"]:
+            print(f"Every student is staged - run the cutover to switch to {self.version}")
+        print(f"Report: {self.report_path}")
+        print(f"{'='*70}\n")
+
+        return summary
+
+    def cutover(self) -> Dict[str, int]:
+        """
+        Switch every student to the target version in one transaction
+
+        Refused (changing nothing) while any student is not staged, since
+        matching does not filter by version.
+
+        Returns:
+            Rows changed per table
+        """
+        rows = self.supabase.rpc("cutover_embedding_version", {
+            "target_version": self.version
+        }).execute().data or []
+        return {r["item"]: r["rows_changed"] for r in rows}
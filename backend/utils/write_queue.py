@@ -0,0 +1,332 @@
+"""
+Write-Ahead Queue
+Durable local queue that decouples database writes from the request hot path
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    True for errors that say nothing about the rows themselves (network,
+    timeouts), so retrying the same batch later can succeed
+    """
+    if isinstance(error, (OSError, TimeoutError)):
+        return True
+    # httpx / httpcore transport errors (connect, read, pool timeouts) do not subclass OSError
+    return type(error).__module__.split(".")[0] in ("httpx", "httpcore")
+
+
+class WriteAheadQueue:
+    def __init__(
+        self,
+        db_path: str,
+        flush_fn: Callable[[List[Dict]], None],
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_backoff: float = 60.0,
+        name: str = "queue",
+        max_attempts: int = 10,
+        lookup_fn: Optional[Callable[[Dict], str]] = None,
+        is_transient: Callable[[Exception], bool] = is_transient_error
+    ):
+        """
+        Initialize a SQLite-backed write-ahead queue
+
+        Args:
+            db_path: Path of the SQLite file holding unflushed entries
+            flush_fn: Callable that durably writes a batch of payloads.
+                      It must raise on failure so the batch is retried.
+            batch_size: Maximum number of entries handed to flush_fn at once
+            flush_interval: Seconds between flush attempts when idle
+            max_backoff: Upper bound (seconds) for retry backoff after failures
+            name: Name used in log messages
+            max_attempts: Failures after which a single row that keeps being
+                          rejected (constraint, type or RLS error) is moved to
+                          the dead_letters table instead of blocking the queue
+            lookup_fn: Optional payload -> lookup value, indexed so
+                       pending_for() does not scan the whole queue
+            is_transient: Classifies flush errors; transient ones (network)
+                          retry the batch as is, others bisect it to find the
+                          rows being rejected
+        """
+        self.db_path = db_path
+        self.flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.name = name
+        self.max_attempts = max_attempts
+        self.lookup_fn = lookup_fn
+        self.is_transient = is_transient
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._flushed_total = 0
+        self._failed_flushes = 0
+        self._last_flush_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._dead_lettered_total = 0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                seq INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                payload TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER,
+                last_error TEXT,
+                failed_at REAL NOT NULL
+            )
+            """
+        )
+        # Queue files written before the lookup column existed
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if "lookup" not in columns:
+            self._conn.execute("ALTER TABLE entries ADD COLUMN lookup TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_lookup ON entries(lookup)")
+        if lookup_fn is not None:
+            rows = self._conn.execute("SELECT seq, payload FROM entries WHERE lookup IS NULL").fetchall()
+            self._conn.executemany(
+                "UPDATE entries SET lookup = ? WHERE seq = ?",
+                [(lookup_fn(json.loads(payload)), seq) for seq, payload in rows]
+            )
+        self._conn.commit()
+
+    def enqueue(self, key: str, payload: Dict) -> bool:
+        """
+        Durably append a payload to the queue
+
+        Args:
+            key: Idempotency key; enqueuing the same key twice is a no-op
+            payload: JSON-serializable dictionary
+
+        Returns:
+            True if the entry was added, False if the key was already queued
+        """
+        lookup = self.lookup_fn(payload) if self.lookup_fn else None
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO entries (key, payload, enqueued_at, lookup) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload), time.time(), lookup)
+            )
+            self._conn.commit()
+            added = cursor.rowcount > 0
+
+        if added and len(self) >= self.batch_size:
+            self._wakeup.set()
+        return added
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def pending_payloads(self) -> List[Dict]:
+        """Return every payload that has not been flushed yet, oldest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT payload FROM entries ORDER BY seq").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pending_for(self, lookup: str) -> List[Dict]:
+        """Unflushed payloads whose lookup_fn value is lookup, oldest first (indexed)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM entries WHERE lookup = ? ORDER BY seq", (lookup,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _record_failure(self, rows: List[tuple], error: Exception, single: bool = False):
+        """
+        Count a failed attempt; a single rejected row that has used up
+        max_attempts moves to dead_letters
+        """
+        seqs = [row[0] for row in rows]
+        placeholders = ",".join("?" * len(seqs))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE entries SET attempts = attempts + 1, last_error = ? WHERE seq IN ({placeholders})",
+                [str(error), *seqs]
+            )
+            if single and rows[0][2] + 1 >= self.max_attempts:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_letters (seq, key, payload, enqueued_at, attempts, last_error, failed_at) "
+                    "SELECT seq, key, payload, enqueued_at, attempts, last_error, ? FROM entries WHERE seq = ?",
+                    (time.time(), seqs[0])
+                )
+                self._conn.execute("DELETE FROM entries WHERE seq = ?", (seqs[0],))
+                self._dead_lettered_total += 1
+                print(f"[{self.name}] Dead-lettered entry {seqs[0]} after {rows[0][2] + 1} attempts: {error}")
+            self._conn.commit()
+            self._failed_flushes += 1
+            self._last_error = str(error)
+
+    def _flush_rows(self, rows: List[tuple]) -> int:
+        """
+        Write rows, bisecting on non-transient errors so one rejected row
+        cannot hold back the rest. Returns the number of rows written.
+        """
+        try:
+            self.flush_fn([json.loads(row[1]) for row in rows])
+        except Exception as e:
+            if self.is_transient(e):
+                self._record_failure(rows, e)
+                raise
+            if len(rows) == 1:
+                self._record_failure(rows, e, single=True)
+                return 0
+            mid = len(rows) // 2
+            return self._flush_rows(rows[:mid]) + self._flush_rows(rows[mid:])
+
+        seqs = [row[0] for row in rows]
+        placeholders = ",".join("?" * len(seqs))
+        with self._lock:
+            self._conn.execute(f"DELETE FROM entries WHERE seq IN ({placeholders})", seqs)
+            self._conn.commit()
+            self._flushed_total += len(seqs)
+            self._last_flush_at = time.time()
+            self._last_error = None
+        return len(seqs)
+
+    def flush_once(self) -> int:
+        """
+        Flush the oldest batch of entries
+
+        Rows the database keeps rejecting are isolated by bisection and,
+        after max_attempts, moved to dead_letters; the rest are written.
+
+        Returns:
+            Number of entries written (0 if the queue was empty)
+
+        Raises:
+            Transient errors from flush_fn, or RuntimeError if no entry
+            could be written; the batch stays queued for retry
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, payload, attempts FROM entries ORDER BY seq LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+
+        if not rows:
+            return 0
+        written = self._flush_rows(rows)
+        if not written:
+            # Nothing got through: back off as for an outage rather than burning attempts
+            raise RuntimeError(self._last_error)
+        return written
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        """Entries given up on, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload, enqueued_at, attempts, last_error, failed_at "
+                "FROM dead_letters ORDER BY failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"key": key, "payload": json.loads(payload), "enqueued_at": enqueued_at,
+             "attempts": attempts, "last_error": last_error, "failed_at": failed_at}
+            for key, payload, enqueued_at, attempts, last_error, failed_at in rows
+        ]
+
+    def requeue_dead_letters(self) -> int:
+        """Move every dead letter back into the queue (after fixing the cause)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, payload, enqueued_at FROM dead_letters").fetchall()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO entries (key, payload, enqueued_at, lookup) VALUES (?, ?, ?, ?)",
+                [(key, payload, enqueued_at, self.lookup_fn(json.loads(payload)) if self.lookup_fn else None)
+                 for key, payload, enqueued_at in rows]
+            )
+            self._conn.execute("DELETE FROM dead_letters")
+            self._conn.commit()
+        if rows:
+            self._wakeup.set()
+        return len(rows)
+
+    def start(self):
+        """Start the background flusher thread (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop the flusher after a final drain attempt
+
+        Args:
+            timeout: Seconds to wait for the flusher thread to exit
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+
+            try:
+                while self.flush_once() == self.batch_size:
+                    pass
+                backoff = self.flush_interval
+            except Exception as e:
+                backoff = min(self.max_backoff, max(backoff, self.flush_interval) * 2)
+                print(f"[{self.name}] Flush failed, retrying in {backoff:.0f}s: {e}")
+
+            if self._stopping.is_set():
+                break
+
+    def stats(self) -> Dict:
+        """
+        Queue health metrics
+
+        Returns:
+            Dictionary with depth, flush lag (age of the oldest unflushed
+            entry in seconds) and flusher counters
+        """
+        with self._lock:
+            depth, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(enqueued_at) FROM entries"
+            ).fetchone()
+            dead = self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+            return {
+                "name": self.name,
+                "depth": depth,
+                "flush_lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+                "flushed_total": self._flushed_total,
+                "failed_flushes": self._failed_flushes,
+                "dead_letters": dead,
+                "dead_lettered_total": self._dead_lettered_total,
+                "last_flush_at": self._last_flush_at,
+                "last_error": self._last_error,
+                "flusher_running": bool(self._thread and self._thread.is_alive())
+            }
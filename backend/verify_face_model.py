@@ -6,7 +6,9 @@ import os
 # Ensure backend path is in python path
 sys.path.append(os.getcwd())
 
-from utils.face_engine import face_engine
+from utils.face_engine import get_face_engine
+
+face_engine = get_face_engine()
 
 print("\n" + "="*50)
 print("🧠 TESTING DEEPFACE MODEL (Facenet512)")
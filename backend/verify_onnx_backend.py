@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import sys
+import os
+from pathlib import Path
+
+# Ensure backend path is in python path
+sys.path.append(os.getcwd())
+
+# Reference path is the TensorFlow one; exported models are loaded explicitly below
+os.environ["ATTENDIFY_INFERENCE_BACKEND"] = "deepface"
+
+from utils.face_engine import get_face_engine
+from utils.model_registry import model_registry
+from utils.onnx_backend import RUNTIMES
+from utils.lazy_import import DeepFace
+
+# Same faces through both models: embeddings must agree to this cosine similarity
+MODEL_TOLERANCE = 0.999
+# Different detectors (MTCNN vs YuNet) crop slightly differently; reported, not enforced
+PIPELINE_TOLERANCE = 0.90
+
+face_engine = get_face_engine()
+
+print("\n" + "="*50)
+print("🧠 TESTING ONNX BACKEND PARITY (Facenet512)")
+print("="*50)
+print("Usage: python verify_onnx_backend.py [face_photo_dir]")
+
+
+def cosine(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-10))
+
+
+def load_images():
+    images = []
+    if len(sys.argv) > 1:
+        for path in sorted(Path(sys.argv[1]).rglob("*")):
+            if path.suffix.lower() in (".jpg", ".jpeg", ".png"):
+                img = cv2.imread(str(path))
+                if img is not None:
+                    images.append(img)
+            if len(images) >= 20:
+                break
+    if not images:
+        # Synthetic faces plus noise: enough to compare the two models' arithmetic
+        rng = np.random.default_rng(0)
+        for i in range(8):
+            img = rng.integers(0, 255, (240, 200, 3), dtype=np.uint8)
+            cv2.circle(img, (100, 120), 70 + i * 3, (200, 200, 200), -1)
+            images.append(img)
+    return images
+
+
+if not DeepFace:
+    print("❌ DeepFace is not installed; the TensorFlow reference cannot run")
+    sys.exit(1)
+
+failed = False
+try:
+    images = load_images()
+    print(f"📸 {len(images)} test images")
+
+    # 1. Model parity: identical aligned faces through TensorFlow and ONNX
+    faces = []
+    for img in images:
+        detected = DeepFace.extract_faces(img_path=img, detector_backend=face_engine.detector_backend, enforce_detection=False)
+        faces.append(max(detected, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"]))
+
+    reference = face_engine._forward_batch(model_registry.get_embedding_model(face_engine.model_name), faces)
+
+    for runtime in RUNTIMES:
+        try:
+            model = model_registry.get_embedding_model(f"{face_engine.model_name}@{runtime}")
+        except Exception as e:
+            print(f"⚠️ {runtime}: not available ({e})")
+            continue
+        embeddings = model.forward(faces)
+        similarities = [cosine(a, b) for a, b in zip(reference, embeddings)]
+        max_diff = float(np.max(np.abs(np.asarray(reference) - np.asarray(embeddings))))
+        worst = min(similarities)
+        if worst >= MODEL_TOLERANCE:
+            print(f"✅ {runtime}: min cosine {worst:.6f}, max |diff| {max_diff:.2e}")
+        else:
+            print(f"❌ {runtime}: min cosine {worst:.6f} < {MODEL_TOLERANCE} (max |diff| {max_diff:.2e})")
+            failed = True
+
+    # 2. Pipeline parity: full detect + embed on each backend (real photos only)
+    if len(sys.argv) > 1:
+        print("\n⏳ Comparing full pipelines (MTCNN + TensorFlow vs YuNet + ONNX)...")
+        from utils.face_engine import AttendifyAI
+        for runtime in RUNTIMES:
+            engine = AttendifyAI()
+            engine.inference_backend = runtime
+            engine.detector_backend = "yunet"
+            try:
+                pairs = [(face_engine.get_embedding(img, use_cache=False), engine.get_embedding(img, use_cache=False)) for img in images]
+            except Exception as e:
+                print(f"⚠️ {runtime}: pipeline not available ({e})")
+                continue
+            similarities = [cosine(a, b) for a, b in pairs if a and b]
+            if not similarities:
+                print(f"⚠️ {runtime}: no face found by both pipelines")
+                continue
+            icon = "✅" if min(similarities) >= PIPELINE_TOLERANCE else "⚠️"
+            print(f"{icon} {runtime}: mean cosine {np.mean(similarities):.4f}, min {min(similarities):.4f} over {len(similarities)} faces")
+
+except Exception as e:
+    print(f"❌ TEST FAILED: {e}")
+    import traceback
+    traceback.print_exc()
+    failed = True
+
+print("="*50 + "\n")
+sys.exit(1 if failed else 0)